@@ -1,50 +1,236 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from core.parser import SQLParser
+from core.parser import SQLParser, SelectStmt, ExplainStmt, VerifyStmt, AnalyzeStmt
 from core.storage import LedgerStorage
 from core.executor import QueryExecutor
+from core.concurrency import WriteQueue, Compactor, ReplicaTailer
 import os
+import sys
+import subprocess
+import json
+import time
+import atexit
+import logging
 
 app = Flask(__name__)
 CORS(app)
 
-storage = LedgerStorage()
-executor = QueryExecutor(storage)
+# Errors, queries slower than this and a sampled share of the rest are logged
+SLOW_QUERY_MS = float(os.environ.get('LEDGERDB_SLOW_QUERY_MS', 250))
+SAMPLE_RATE = float(os.environ.get('LEDGERDB_SAMPLE_RATE', 0.01))
+# A replica serves reads from the primary's data directory and follows its commits;
+# it answers 503 while it is further behind than MAX_REPLICA_LAG seconds
+REPLICA = os.environ.get('LEDGERDB_REPLICA') == '1'
+MAX_REPLICA_LAG = float(os.environ.get('LEDGERDB_MAX_REPLICA_LAG', 5))
+# Processes a large sequential scan is split across; one per CPU by default
+SCAN_WORKERS = int(os.environ['LEDGERDB_SCAN_WORKERS']) if 'LEDGERDB_SCAN_WORKERS' in os.environ else None
+# COPY reads server files only from this directory, since any client can send it
+IMPORT_DIR = os.environ.get('LEDGERDB_IMPORT_DIR', os.path.join('data', 'import'))
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+log = logging.getLogger('ledgerdb.query')
+
+storage = LedgerStorage(read_only=REPLICA)
+executor = QueryExecutor(storage, sample_rate=SAMPLE_RATE, scan_workers=SCAN_WORKERS, import_dir=IMPORT_DIR)
 parser = SQLParser()
+atexit.register(storage.close)
+
+if REPLICA:
+    tailer = ReplicaTailer(storage)
+    atexit.register(tailer.close)
+else:
+    # Auto-seed if database is empty
+    if not storage.schemas:
+        print("Database empty, seeding with sample data...")
+        from seed import seed_database
+        seed_database(executor)
+    
+    # Reads run on request threads against a snapshot; writes are serialized on one thread
+    write_queue = WriteQueue(storage)
+    compactor = Compactor(storage, write_queue)
+    atexit.register(write_queue.close)
+    atexit.register(compactor.close)
+
+def run_script(stmts, run=None):
+    # ANALYZE only reads the tables, so it runs on the request thread, on replicas too
+    run = run or executor.execute_script
+    if all(isinstance(stmt, (SelectStmt, ExplainStmt, AnalyzeStmt)) for stmt in stmts):
+        return run(stmts)
+    if REPLICA:
+        raise ValueError("Read-only replica: send writes to the primary")
+    return write_queue.submit(lambda: run(stmts))
 
-# Auto-seed if database is empty
-if not storage.schemas:
-    print("Database empty, seeding with sample data...")
-    from seed import seed_database
-    seed_database()
+def run_serialized(fn):
+    # For reads of the log itself, which must not interleave with changes to it: on the
+    # writer thread, or on a replica between catch-ups
+    if REPLICA:
+        with tailer.lock:
+            return fn()
+    return write_queue.submit(fn)
+
+def wants_stream():
+    return bool(request.json.get('stream')) or 'application/x-ndjson' in request.headers.get('Accept', '')
+
+def stream_rows(stmt):
+    # One JSON row per line, sent as it is produced; the first row is pulled before
+    # responding so a bad query still gets a normal error response
+    rows = executor.select_iter(stmt)
+    try:
+        first = next(rows)
+    except StopIteration:
+        return Response('', mimetype='application/x-ndjson')
+    
+    def generate():
+        try:
+            yield json.dumps(first, default=str) + '\n'
+            for row in rows:
+                yield json.dumps(row, default=str) + '\n'
+        except Exception as e:
+            yield json.dumps({'error': str(e)}) + '\n'
+        finally:
+            rows.close()
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def parse_all(statements):
+    start = time.perf_counter()
+    stmts = [parser.parse(s['sql'], s.get('params')) if isinstance(s, dict) else parser.parse(s)
+             for s in statements]
+    executor.metrics.observe('ledgerdb_stage_seconds', time.perf_counter() - start, stage='parse')
+    return stmts
+
+def respond(body):
+    start = time.perf_counter()
+    response = jsonify(body)
+    executor.metrics.observe('ledgerdb_stage_seconds', time.perf_counter() - start, stage='serialize')
+    return response
+
+def log_query(sql, start, result=None, error=None):
+    # One JSON line per logged query; sampled queries carry their traced plan
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    plan = executor.last_plan()
+    slow = elapsed_ms >= SLOW_QUERY_MS
+    if error is None and plan is None and not slow:
+        return
+    text = sql if isinstance(sql, str) or sql is None else json.dumps(sql, default=str)
+    entry = {'event': 'query', 'sql': text and text[:2000], 'ms': round(elapsed_ms, 3)}
+    if isinstance(result, dict) and 'rows' in result:
+        entry['rows'] = len(result['rows'])
+    if error is not None:
+        entry['error'] = str(error)
+    if plan is not None:
+        entry['plan'] = plan
+    # Unexpected exceptions keep their traceback
+    log.log(logging.WARNING if error is not None or slow else logging.INFO, json.dumps(entry, default=str),
+            exc_info=error is not None and not isinstance(error, ValueError))
+
+@app.before_request
+def check_replica_lag():
+    if REPLICA and request.path in ('/api/query', '/api/batch'):
+        lag = storage.replica_lag()
+        if lag > MAX_REPLICA_LAG:
+            return jsonify({'success': False, 'error': f"Replica is {lag:.1f}s behind the primary"}), 503
+
+@app.after_request
+def add_replica_lag(response):
+    if REPLICA:
+        response.headers['X-Replica-Lag'] = f"{storage.replica_lag():.3f}"
+    return response
 
 @app.route('/api/query', methods=['POST'])
 def execute_query():
+    start = time.perf_counter()
+    sql = None
     try:
         sql = request.json.get('sql')
-        print(f"\n=== Executing SQL ===")
-        print(f"Query: {sql}")
-        stmt = parser.parse(sql)
-        print(f"Parsed: {stmt}")
-        result = executor.execute(stmt)
-        print(f"Result: {result}")
-        print(f"===================\n")
-        return jsonify({'success': True, 'result': result})
+        # A request may carry a script, e.g. BEGIN; UPDATE ...; INSERT ...; COMMIT,
+        # or a single statement with `?` placeholders bound from params
+        params = request.json.get('params')
+        statements = parser.split(sql)
+        if params is not None and len(statements) != 1:
+            raise ValueError("params can only be used with a single statement")
+        stmts = parse_all([{'sql': statement, 'params': params} for statement in statements])
+        if wants_stream() and len(stmts) == 1 and isinstance(stmts[0], SelectStmt):
+            return stream_rows(stmts[0])
+        result = run_script(stmts)[-1] if stmts else None
+        response = respond({'success': True, 'result': result})
+        log_query(sql, start, result)
+        return response
+    except Exception as e:
+        log_query(sql, start, error=e)
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/batch', methods=['POST'])
+def execute_batch():
+    # Many statements in one request; autocommit writes share a single WAL commit
+    start = time.perf_counter()
+    statements = None
+    try:
+        # Items are SQL strings or {"sql": ..., "params": [...]} objects
+        statements = request.json.get('statements') or parser.split(request.json.get('sql', ''))
+        stmts = parse_all(statements)
+        results, failure = run_script(stmts, executor.execute_batch)
+        if failure is not None:
+            # The statements before the failed one may have been committed; say which
+            log_query(statements, start, error=failure['error'])
+            return jsonify({'success': False, 'error': str(failure['error']), 'results': results,
+                            'failed_statement': failure['index'], 'committed': failure['committed']}), 400
+        response = respond({'success': True, 'results': results})
+        log_query(statements, start)
+        return response
+    except Exception as e:
+        log_query(statements, start, error=e)
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/verify/<table>', methods=['GET'])
+def verify_table(table):
+    # Reads the log directly, so it runs between writes
+    try:
+        since = request.args.get('since', type=int)
+        result = run_serialized(lambda: executor.execute(VerifyStmt(table, since=since)))
+        return jsonify({'success': True, 'result': result['verification']})
     except Exception as e:
-        print(f"\n!!! ERROR !!!")
-        print(f"Query: {sql}")
-        print(f"Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        print(f"=============\n")
         return jsonify({'success': False, 'error': str(e)}), 400
 
+@app.route('/api/proof/<table>/<int:rid>', methods=['GET'])
+def prove_row(table, rid):
+    try:
+        result = run_serialized(lambda: executor.execute(VerifyStmt(table, rid=rid)))
+        return jsonify({'success': True, 'result': result['proof']})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    # Prometheus text exposition of the counters and stage latency histograms
+    return Response(executor.render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/tables', methods=['GET'])
 def get_tables():
     return jsonify({'tables': list(storage.schemas.keys())})
 
+def start_replicas(port: int, count: int):
+    # Replica processes on the ports after the primary's, sharing its data directory
+    env = dict(os.environ, LEDGERDB_REPLICA='1')
+    replicas = [subprocess.Popen([sys.executable, os.path.abspath(__file__), str(port + i)], env=env)
+                for i in range(1, count + 1)]
+    atexit.register(lambda: [p.terminate() for p in replicas])
+    for i in range(1, count + 1):
+        print(f"   read replica on http://localhost:{port + i}")
+
 if __name__ == '__main__':
-    import sys
-    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
-    print(f"\n🚀 LedgerDB Backend running on http://localhost:{port}\n")
-    app.run(debug=True, port=port)
+    # python api.py [port] [--replicas N]
+    args = sys.argv[1:]
+    replicas = 0
+    if '--replicas' in args:
+        pos = args.index('--replicas')
+        replicas = int(args[pos + 1])
+        del args[pos:pos + 2]
+    port = int(args[0]) if args else 5000
+    role = "read replica" if REPLICA else "Backend"
+    print(f"\n🚀 LedgerDB {role} running on http://localhost:{port}\n")
+    # The debug reloader runs this file again in a child; replicas are started once,
+    # from the outer process, and run without a reloader of their own
+    if replicas and not os.environ.get('WERKZEUG_RUN_MAIN'):
+        start_replicas(port, replicas)
+    app.run(debug=True, port=port, threaded=True, use_reloader=not REPLICA)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from array import array
+from datetime import datetime
+
+from core.parser import SQLParser
+from core.storage import LedgerStorage
+from core.executor import QueryExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+TX_TYPES = ('deposit', 'credit', 'debit', 'transfer')
+FIRST_NAMES = ('Alice', 'Bob', 'Carol', 'David', 'Eve', 'Faith', 'Grace', 'Hassan', 'Imani', 'Juma')
+LAST_NAMES = ('Johnson', 'Smith', 'White', 'Brown', 'Davis', 'Otieno', 'Wanjiru', 'Mwangi', 'Kamau', 'Achieng')
+
+SCHEMA = [
+    "CREATE TABLE users (id INT PRIMARY KEY, name TEXT, email TEXT UNIQUE) LEDGER",
+    "CREATE TABLE wallets (wallet_id INT PRIMARY KEY, user_id INT, balance FLOAT) LEDGER",
+    "CREATE TABLE transactions (tx_id INT PRIMARY KEY, wallet_id INT, amount FLOAT, type TEXT) LEDGER",
+    "CREATE INDEX ON wallets (user_id)",
+    "CREATE INDEX ON transactions (wallet_id) USING BTREE",
+]
+
+READS = {
+    'pk_lookup': "SELECT * FROM wallets WHERE wallet_id = ?",
+    'join': "SELECT users.name, wallets.wallet_id, wallets.balance FROM users "
+            "JOIN wallets ON users.id = wallets.user_id WHERE users.id = ?",
+    'history': "SELECT * FROM wallets HISTORY WHERE wallet_id = ?",
+    'aggregate': "SELECT type, COUNT(*), SUM(amount) FROM transactions WHERE wallet_id <= ? GROUP BY type",
+}
+
+class Recorder:
+    def __init__(self, parser: SQLParser, executor: QueryExecutor):
+        # Per-operation latencies in seconds, kept as doubles so millions of samples
+        # do not dominate the RSS being measured
+        self.parser = parser
+        self.executor = executor
+        self.samples = {}
+        self.rows = {}
+    
+    def run(self, name: str, sql: str, params: list = None, rows: int = 1):
+        # Timed through the same parse -> execute path the API and REPL use
+        start = time.perf_counter()
+        result = self.executor.execute(self.parser.parse(sql, params))
+        self.samples.setdefault(name, array('d')).append(time.perf_counter() - start)
+        self.rows[name] = self.rows.get(name, 0) + rows
+        return result
+    
+    def summary(self):
+        return {name: _stats(samples, self.rows[name]) for name, samples in self.samples.items()}
+
+def _percentile(ordered, p: float):
+    # Nearest-rank percentile of an already sorted sample
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def _stats(samples, rows: int):
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        'count': len(ordered),
+        'rows': rows,
+        'seconds': round(total, 6),
+        'ops_per_sec': round(len(ordered) / total, 1) if total else None,
+        'rows_per_sec': round(rows / total, 1) if total else None,
+        'p50_ms': round(_percentile(ordered, 50) * 1000, 4),
+        'p99_ms': round(_percentile(ordered, 99) * 1000, 4),
+        'max_ms': round(ordered[-1] * 1000, 4),
+    }
+
+def _peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _insert(table: str, width: int, count: int):
+    # One statement text per batch size, so repeats hit the parse cache
+    row = '(' + ', '.join('?' * width) + ')'
+    return f"INSERT INTO {table} VALUES " + ', '.join([row] * count)
+
+def _batches(items, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def load(recorder: Recorder, args, rng: random.Random):
+    for sql in SCHEMA:
+        recorder.executor.execute(recorder.parser.parse(sql))
+    
+    users = [(i, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", f"user{i}@example.com")
+             for i in range(1, args.users + 1)]
+    for batch in _batches(users, args.batch):
+        recorder.run('insert', _insert('users', 3, len(batch)), [v for row in batch for v in row], len(batch))
+    
+    wallet_count = args.users * args.wallets_per_user
+    balances = {}
+    wallets = []
+    for wallet_id in range(1, wallet_count + 1):
+        balances[wallet_id] = round(rng.uniform(0, 5000), 2)
+        wallets.append((wallet_id, (wallet_id - 1) // args.wallets_per_user + 1, balances[wallet_id]))
+    for batch in _batches(wallets, args.batch):
+        recorder.run('insert', _insert('wallets', 3, len(batch)), [v for row in batch for v in row], len(batch))
+    
+    # Each payment is a transaction row; a share of them also moves the wallet balance,
+    # which appends a new ledger version of the wallet
+    pending = 0.0
+    for start in range(0, args.transactions, args.batch):
+        count = min(args.batch, args.transactions - start)
+        params = []
+        moved = []
+        for tx_id in range(start + 1, start + count + 1):
+            wallet_id = _pick_wallet(rng, wallet_count)
+            tx_type = rng.choice(TX_TYPES)
+            amount = round(rng.uniform(1, 500), 2)
+            params += [tx_id, wallet_id, amount, tx_type]
+            moved.append((wallet_id, -amount if tx_type in ('debit', 'transfer') else amount))
+        recorder.run('insert', _insert('transactions', 4, count), params, count)
+        
+        pending += count * args.update_ratio
+        while pending >= 1:
+            pending -= 1
+            wallet_id, amount = moved[rng.randrange(len(moved))]
+            balances[wallet_id] = round(balances[wallet_id] + amount, 2)
+            recorder.run('update', "UPDATE wallets SET balance = ? WHERE wallet_id = ?",
+                         [balances[wallet_id], wallet_id])
+    return wallet_count
+
+def _pick_wallet(rng: random.Random, wallet_count: int):
+    # Payment traffic is skewed: a fifth of the wallets see most of the activity
+    if rng.random() < 0.8:
+        return rng.randint(1, max(1, wallet_count // 5))
+    return rng.randint(1, wallet_count)
+
+def reads(recorder: Recorder, args, rng: random.Random, wallet_count: int):
+    counts = {'pk_lookup': args.lookups, 'join': args.joins, 'history': args.history,
+              'aggregate': args.aggregates}
+    ops = [name for name, count in counts.items() for _ in range(count)]
+    rng.shuffle(ops)
+    for name in ops:
+        if name == 'join':
+            key = rng.randint(1, args.users)
+        elif name == 'aggregate':
+            # Aggregates cover a random slice of the wallets
+            key = rng.randint(1, wallet_count)
+        else:
+            key = _pick_wallet(rng, wallet_count)
+        result = recorder.run(name, READS[name], [key])
+        recorder.rows[name] += len(result['rows']) - 1
+
+def startup(data_dir: str, args):
+    # Reopening replays the segment log tails past each table's snapshot; tables load
+    # lazily, so the first query against each one is part of the startup cost
+    parser = SQLParser()
+    start = time.perf_counter()
+    storage = LedgerStorage(data_dir, sync=args.sync)
+    executor = QueryExecutor(storage, cache_bytes=args.cache_mb * 1024 * 1024, scan_workers=args.scan_workers)
+    rows = {}
+    for table in ('users', 'wallets', 'transactions'):
+        rows[table] = executor.execute(parser.parse(f"SELECT COUNT(*) FROM {table}"))['rows'][0]['COUNT(*)']
+    return storage, executor, time.perf_counter() - start, rows
+
+def compare(results, baseline):
+    # Ratios against an earlier run: > 1 means this run is slower
+    changes = {}
+    for name, current in results['operations'].items():
+        previous = baseline.get('operations', {}).get(name)
+        if not previous:
+            continue
+        changes[name] = {key: round(current[key] / previous[key], 3)
+                         for key in ('p50_ms', 'p99_ms') if previous.get(key)}
+        if current.get('ops_per_sec') and previous.get('ops_per_sec'):
+            changes[name]['ops_per_sec'] = round(previous['ops_per_sec'] / current['ops_per_sec'], 3)
+    if baseline.get('startup_seconds'):
+        changes['startup_seconds'] = round(results['startup_seconds'] / baseline['startup_seconds'], 3)
+    if baseline.get('peak_rss_bytes') and results['peak_rss_bytes']:
+        changes['peak_rss_bytes'] = round(results['peak_rss_bytes'] / baseline['peak_rss_bytes'], 3)
+    return changes
+
+def run(args):
+    rng = random.Random(args.seed)
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='ledgerdb-bench-')
+    if os.path.exists(data_dir) and os.listdir(data_dir):
+        raise ValueError(f"Benchmark data directory {data_dir} is not empty")
+    
+    try:
+        storage = LedgerStorage(data_dir, sync=args.sync)
+        recorder = Recorder(SQLParser(), QueryExecutor(storage, cache_bytes=args.cache_mb * 1024 * 1024,
+                                                       scan_workers=args.scan_workers))
+        start = time.perf_counter()
+        wallet_count = load(recorder, args, rng)
+        load_seconds = time.perf_counter() - start
+        storage.close()
+        
+        storage, recorder.executor, startup_seconds, rows = startup(data_dir, args)
+        reads(recorder, args, rng, wallet_count)
+        storage.close()
+    finally:
+        if not args.keep and not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    
+    return {
+        'started_at': datetime.now().isoformat(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'rows': rows,
+        'load_seconds': round(load_seconds, 3),
+        'startup_seconds': round(startup_seconds, 3),
+        'peak_rss_bytes': _peak_rss(),
+        'operations': recorder.summary(),
+    }
+
+def print_report(results):
+    print(f"Loaded {results['rows']} in {results['load_seconds']}s, "
+          f"startup {results['startup_seconds']}s, peak RSS "
+          f"{(results['peak_rss_bytes'] or 0) / 1024 / 1024:.1f} MB")
+    print(f"{'operation':<12} {'count':>9} {'ops/s':>10} {'rows/s':>11} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, op in results['operations'].items():
+        print(f"{name:<12} {op['count']:>9} {op['ops_per_sec'] or 0:>10} {op['rows_per_sec'] or 0:>11} "
+              f"{op['p50_ms']:>9} {op['p99_ms']:>9}")
+    for name, change in results.get('compared', {}).items():
+        print(f"vs baseline {name}: {change}")
+
+def main():
+    parser = argparse.ArgumentParser(description="LedgerDB payment workload benchmark")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--wallets-per-user', type=int, default=2)
+    parser.add_argument('--transactions', type=int, default=20000)
+    parser.add_argument('--update-ratio', type=float, default=0.5,
+                        help="wallet balance updates per transaction")
+    parser.add_argument('--batch', type=int, default=100, help="rows per INSERT statement")
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--joins', type=int, default=500)
+    parser.add_argument('--history', type=int, default=500)
+    parser.add_argument('--aggregates', type=int, default=50)
+    parser.add_argument('--cache-mb', type=int, default=0, help="result cache size; 0 measures uncached reads")
+    parser.add_argument('--scan-workers', type=int, help="processes per large scan (default: one per CPU)")
+    parser.add_argument('--sync', action='store_true', help="fsync the WAL on every commit")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', help="directory to build the database in (default: a temporary one)")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary database afterwards")
+    parser.add_argument('--output', default='bench-results.json')
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    args = parser.parse_args()
+    
+    results = run(args)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            results['compared'] = compare(results, json.load(f))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print_report(results)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == '__main__':
+    main()
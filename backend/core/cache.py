@@ -0,0 +1,58 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+class ResultCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        # SELECT results keyed by statement, each stored with the write generations of
+        # the tables it read; a bumped generation makes the entry unreachable
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str, generations: Tuple[int, ...]):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generations:
+                self.misses += 1
+                if entry is not None and entry[0] < generations:
+                    del self._entries[key]
+                    self.size -= entry[2]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key: str, generations: Tuple[int, ...], rows: List[Dict]):
+        size = self._estimate(rows)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            self._entries[key] = (generations, rows, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+    
+    def _estimate(self, rows: List[Dict]):
+        # Rows from one query share their keys, so those are counted once
+        size = sys.getsizeof(rows)
+        if rows:
+            size += sum(sys.getsizeof(k) for k in rows[0])
+        for row in rows:
+            size += sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values())
+            if size > self.max_bytes:
+                break
+        return size
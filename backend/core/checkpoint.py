@@ -0,0 +1,53 @@
+import bisect
+import json
+import os
+from typing import Dict, List, Tuple
+
+class CheckpointStore:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.entries = self._read_manifest()
+    
+    def _manifest_path(self):
+        return os.path.join(self.path, "manifest.json")
+    
+    def _read_manifest(self):
+        if not os.path.exists(self._manifest_path()):
+            return []
+        with open(self._manifest_path(), 'r') as f:
+            return json.load(f)
+    
+    def _write_json(self, path: str, data):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            # json.dumps uses the C encoder; json.dump to a file streams through the Python one
+            f.write(json.dumps(data, separators=(',', ':')))
+        os.replace(tmp_path, path)
+    
+    def save(self, at: str, position: Tuple[int, int], rows: List):
+        # Materialized active set of a table as of `at`, valid up to `position` in its log
+        name = f"{position[0]:06d}-{position[1]:012d}.json"
+        self._write_json(os.path.join(self.path, name), rows)
+        self.entries.append({'at': at, 'position': list(position), 'file': name})
+        self._write_json(self._manifest_path(), self.entries)
+    
+    def latest_before(self, at: str):
+        times = [e['at'] for e in self.entries]
+        pos = bisect.bisect_right(times, at)
+        return self.entries[pos - 1] if pos else None
+    
+    def load(self, entry: Dict):
+        with open(os.path.join(self.path, entry['file']), 'r') as f:
+            return {rid: row for rid, row in json.load(f)}
+    
+    def reload(self, position: Tuple[int, int]):
+        # A replica picks up the checkpoints another process saved, up to its own position
+        self.entries = [e for e in self._read_manifest() if tuple(e['position']) <= tuple(position)]
+    
+    def discard_after(self, position: Tuple[int, int]):
+        # Checkpoints past the end of the log describe writes that never became durable
+        kept = [e for e in self.entries if tuple(e['position']) <= tuple(position)]
+        if len(kept) != len(self.entries):
+            self.entries = kept
+            self._write_json(self._manifest_path(), self.entries)
@@ -0,0 +1,110 @@
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+from .storage import LedgerStorage
+
+class WriteQueue:
+    def __init__(self, storage: LedgerStorage, max_batch: int = 64):
+        self.storage = storage
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+        self._thread.start()
+    
+    def submit(self, fn: Callable):
+        # Runs fn on the single writer thread and blocks until its writes are durable
+        future = Future()
+        self._queue.put((fn, future))
+        return future.result()
+    
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopping = True
+                batch.pop()
+            if batch:
+                self._run_batch(batch)
+    
+    def _run_batch(self, batch):
+        # Autocommit writes from the whole batch share one WAL commit
+        results = []
+        try:
+            with self.storage.write_group():
+                for fn, future in batch:
+                    try:
+                        results.append((future, fn(), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            for fn, future in batch:
+                future.set_exception(e)
+            return
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+    
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class Compactor:
+    def __init__(self, storage: LedgerStorage, write_queue: WriteQueue, interval: float = 60.0,
+                 min_rows: int = 10000):
+        # Periodically moves retired ledger versions into history segments; the work is
+        # queued behind writes since it changes the hot set
+        self.storage = storage
+        self.write_queue = write_queue
+        self.interval = interval
+        self.min_rows = min_rows
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ledger-compactor", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for table_name, schema in list(self.storage.schemas.items()):
+                if schema['is_ledger']:
+                    self.write_queue.submit(lambda t=table_name: self.storage.compact(t, self.min_rows))
+    
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class ReplicaTailer:
+    def __init__(self, storage: LedgerStorage, interval: float = 0.05):
+        # Keeps a read-only replica current by applying the primary's new commits from
+        # the segment logs every `interval` seconds
+        self.storage = storage
+        self.interval = interval
+        # Held while applying; log reads such as VERIFY take it to see a settled tree
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ledger-replica", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with self.lock:
+                    self.storage.catch_up()
+            except (OSError, ValueError):
+                # e.g. a segment file swapped out mid-read; the lag keeps growing until a
+                # later attempt gets through
+                self.storage.metrics.inc('ledgerdb_replica_errors_total')
+    
+    def close(self):
+        self._stop.set()
+        self._thread.join()
@@ -1,62 +1,626 @@
+import csv
+import heapq
+import json
+import os
+import random
+import re
+import threading
+import time
+from array import array
+from functools import cmp_to_key
+from itertools import chain, islice
 from .parser import *
 from .storage import LedgerStorage
-from .index import Index
+from .cache import ResultCache
+from .metrics import PlanTrace, exclusive_times, format_plan
+from .parallel import ScanPool
+from .planner import Planner
+from .predicate import compile_predicate, conjuncts, conjoin, referenced_columns, map_columns, format_expr
+from .index import _sort_key
+from typing import Dict, List, Iterator
+
+# COPY validates and commits this many rows at a time
+COPY_BATCH_SIZE = 10000
+# Aggregation reads this many rows per column batch
+AGGREGATE_BATCH_SIZE = 65536
+
+# Traced operators whose own time is reported as a stage
+_OPERATOR_STAGES = {'Seq Scan': 'scan', 'Parallel Seq Scan': 'scan', 'Index Scan': 'scan', 'Version Chain Scan': 'scan', 'As Of Scan': 'scan',
+                    'Version Scan': 'scan', 'Join': 'join', 'Aggregate': 'aggregate', 'Sort': 'sort'}
 
 class QueryExecutor:
-    def __init__(self, storage: LedgerStorage):
+    def __init__(self, storage: LedgerStorage, cache_bytes: int = 64 * 1024 * 1024, sample_rate: float = 0.01,
+                 scan_workers: int = None, import_dir: str = None):
         self.storage = storage
-        self.index = Index()
+        self.index = storage.index
+        self.metrics = storage.metrics
+        self.cache = ResultCache(cache_bytes) if cache_bytes else None
+        # Share of SELECTs traced like EXPLAIN ANALYZE to time their operators
+        self.sample_rate = sample_rate
+        self._local = threading.local()
+        # Large sequential scans are split across this many processes (default: one per CPU)
+        self.scan_pool = ScanPool(scan_workers)
+        self.planner = Planner(storage)
+        # COPY only reads files inside this directory; None lets it read any path
+        self.import_dir = os.path.realpath(import_dir) if import_dir is not None else None
         self.storage.load_schemas()
     
+    def execute_script(self, stmts: List):
+        results, failure = self.execute_batch(stmts)
+        if failure is not None:
+            raise failure['error']
+        return results
+    
+    def execute_batch(self, stmts: List):
+        # A script must leave no transaction open; on any error its open one is rolled back.
+        # Returns the results of the statements that ran and, if one failed, its index,
+        # its error and how many statements before it were committed: autocommit ones and
+        # transactions closed by COMMIT, which the rollback does not undo
+        results = []
+        committed = 0
+        try:
+            for stmt in stmts:
+                results.append(self.execute(stmt))
+                if not self.storage.in_transaction:
+                    committed = len(results)
+            if self.storage.in_transaction:
+                raise ValueError("Transaction was not committed")
+        except Exception as e:
+            if self.storage.in_transaction:
+                self.storage.rollback()
+            return results, {'index': len(results), 'error': e, 'committed': committed}
+        return results, None
+    
     def execute(self, stmt):
+        kind = type(stmt).__name__[:-4].lower()
+        start = time.perf_counter()
+        try:
+            return self._dispatch(stmt)
+        except Exception:
+            self.metrics.inc('ledgerdb_statement_errors_total', kind=kind)
+            raise
+        finally:
+            self.metrics.observe('ledgerdb_statement_seconds', time.perf_counter() - start, kind=kind)
+    
+    def _dispatch(self, stmt):
         if isinstance(stmt, CreateTableStmt):
             return self._exec_create(stmt)
+        elif isinstance(stmt, CreateIndexStmt):
+            return self._exec_create_index(stmt)
+        elif isinstance(stmt, CreateViewStmt):
+            return self._exec_create_view(stmt)
         elif isinstance(stmt, InsertStmt):
             return self._exec_insert(stmt)
+        elif isinstance(stmt, CopyStmt):
+            return self._exec_copy(stmt)
         elif isinstance(stmt, SelectStmt):
             return self._exec_select(stmt)
         elif isinstance(stmt, UpdateStmt):
             return self._exec_update(stmt)
         elif isinstance(stmt, DeleteStmt):
             return self._exec_delete(stmt)
+        elif isinstance(stmt, VerifyStmt):
+            return self._exec_verify(stmt)
+        elif isinstance(stmt, ExplainStmt):
+            return self._exec_explain(stmt)
+        elif isinstance(stmt, AnalyzeStmt):
+            return self._exec_analyze(stmt)
+        elif isinstance(stmt, BeginStmt):
+            self.storage.begin()
+            return {"message": "Transaction started"}
+        elif isinstance(stmt, CommitStmt):
+            self.storage.commit()
+            return {"message": "Transaction committed"}
+        elif isinstance(stmt, RollbackStmt):
+            self.storage.rollback()
+            return {"message": "Transaction rolled back"}
     
     def _exec_create(self, stmt: CreateTableStmt):
         cols = [{'name': c.name, 'type': c.type, 'primary_key': c.primary_key, 'unique': c.unique} 
                 for c in stmt.columns]
         self.storage.create_table(stmt.table_name, cols, stmt.is_ledger)
-        
-        for col in stmt.columns:
-            if col.primary_key or col.unique:
-                self.index.create_index(stmt.table_name, col.name, col.unique or col.primary_key)
-        
         return {"message": f"Table {stmt.table_name} created"}
     
+    def _exec_create_index(self, stmt: CreateIndexStmt):
+        self.storage.create_index(stmt.table_name, stmt.column, stmt.method, stmt.index_name)
+        return {"message": f"Index on {stmt.table_name}({stmt.column}) created"}
+    
+    def _exec_create_view(self, stmt: CreateViewStmt):
+        self.storage.create_view(stmt.view_name, stmt.query)
+        return {"message": f"Materialized view {stmt.view_name} created"}
+    
     def _exec_insert(self, stmt: InsertStmt):
         schema = self.storage.schemas[stmt.table_name]
-        row = {col['name']: val for col, val in zip(schema['columns'], stmt.values)}
+        rows = []
+        for values in stmt.rows:
+            if len(values) != len(schema['columns']):
+                raise ValueError(f"Expected {len(schema['columns'])} values, got {len(values)}")
+            rows.append({col['name']: val for col, val in zip(schema['columns'], values)})
+        self.storage.insert_rows(stmt.table_name, rows)
+        return {"message": "Row inserted" if len(rows) == 1 else f"{len(rows)} rows inserted"}
+    
+    def _exec_copy(self, stmt: CopyStmt):
+        if stmt.table_name not in self.storage.schemas:
+            raise ValueError(f"Table {stmt.table_name} does not exist")
+        columns = self.storage.schemas[stmt.table_name]['columns']
+        reader = self._read_ndjson if stmt.format == 'NDJSON' else self._read_csv
         
-        for col in schema['columns']:
-            if col.get('primary_key') or col.get('unique'):
-                existing = self.index.lookup(stmt.table_name, col['name'], row[col['name']])
-                if existing:
-                    raise ValueError(f"Constraint violation on {col['name']}")
+        path = self._copy_path(stmt.path)
         
-        self.storage.insert_row(stmt.table_name, row)
-        return {"message": "Row inserted"}
+        count = 0
+        batch = []
+        try:
+            with open(path, 'r', newline='', encoding='utf-8') as f:
+                for record in reader(f):
+                    # insert_rows gives values their column types, as for INSERT
+                    batch.append({c['name']: record.get(c['name']) for c in columns})
+                    if len(batch) >= COPY_BATCH_SIZE:
+                        count += self._copy_batch(stmt.table_name, batch)
+                        batch = []
+            count += self._copy_batch(stmt.table_name, batch)
+        except Exception as e:
+            # Batches committed before the error stay; a transaction's rollback drops them all
+            if not count or self.storage.in_transaction:
+                raise
+            raise ValueError(f"{e} ({count} rows were copied and committed before the error)") from e
+        return {"message": f"{count} rows copied"}
+    
+    def _copy_path(self, path: str):
+        # Relative paths are read from the import directory, and no path, link or '..'
+        # may lead out of it
+        if self.import_dir is None:
+            return path
+        resolved = os.path.realpath(os.path.join(self.import_dir, path))
+        if os.path.commonpath([resolved, self.import_dir]) != self.import_dir:
+            raise ValueError(f"COPY can only read files in the import directory: {path}")
+        return resolved
+    
+    def _copy_batch(self, table: str, rows: List[Dict]):
+        # Outside a transaction every batch is durable on its own, even inside a write group
+        self.storage.insert_rows(table, rows)
+        if not self.storage.in_transaction:
+            self.storage.flush()
+        return len(rows)
+    
+    def _read_csv(self, f) -> Iterator[Dict]:
+        # CSV has no NULL of its own; an empty field is one
+        for record in csv.DictReader(f):
+            yield {k: None if v == '' else v for k, v in record.items()}
+    
+    def _read_ndjson(self, f) -> Iterator[Dict]:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
     
     def _exec_select(self, stmt: SelectStmt):
-        rows = self.storage.select_rows(stmt.table_name, stmt.where, stmt.history)
+        if self.cache is None:
+            with self.storage.snapshot():
+                return {"rows": self._collect(stmt)}
+        # Generations are read before the snapshot is taken, so a result can only be
+        # newer than the generations it is stored under, never older
+        key = repr(stmt)
+        tables = [stmt.table_name] + [j['table'] for j in stmt.joins]
+        generations = tuple(self.storage.generation(t) for t in tables)
+        with self.storage.snapshot() as lsn:
+            # The writer thread may be reading its own uncommitted writes
+            if lsn is None:
+                return {"rows": self._collect(stmt)}
+            rows = self.cache.get(key, generations)
+            if rows is None:
+                rows = self._collect(stmt)
+                self.cache.put(key, generations, rows)
+        return {"rows": list(rows)}
+    
+    def _collect(self, stmt: SelectStmt):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return list(self._select_pipeline(stmt))
+        trace = self._local.trace = PlanTrace(analyze=True)
+        try:
+            rows = list(self._select_pipeline(stmt))
+        finally:
+            self._local.trace = None
+        for operator, ms in exclusive_times(trace.root):
+            if operator in _OPERATOR_STAGES:
+                self.metrics.observe('ledgerdb_stage_seconds', ms / 1000, stage=_OPERATOR_STAGES[operator])
+        self._local.plan = trace.root
+        return rows
+    
+    def last_plan(self):
+        # The traced plan of this thread's last SELECT, if it was sampled
+        plan = getattr(self._local, 'plan', None)
+        self._local.plan = None
+        return plan
+    
+    def render_metrics(self):
+        if self.cache is not None:
+            self.metrics.set('ledgerdb_result_cache_bytes', self.cache.size)
+            self.metrics.set('ledgerdb_result_cache_hits', self.cache.hits)
+            self.metrics.set('ledgerdb_result_cache_misses', self.cache.misses)
+        if self.storage.read_only:
+            self.metrics.set('ledgerdb_replica_lag_seconds', round(self.storage.replica_lag(), 6))
+        for table in list(self.storage.tables):
+            self.metrics.set('ledgerdb_table_rows', len(self.storage.tables.get(table, ())), table=table)
+        return self.metrics.render()
+    
+    def _exec_explain(self, stmt: ExplainStmt):
+        # EXPLAIN assembles the pipeline without pulling rows from it; ANALYZE runs it
+        trace = self._local.trace = PlanTrace(stmt.analyze)
+        try:
+            with self.storage.snapshot():
+                start = time.perf_counter()
+                rows = self._select_pipeline(stmt.stmt)
+                planned = time.perf_counter()
+                count = sum(1 for _ in rows) if stmt.analyze else None
+                finished = time.perf_counter()
+        finally:
+            self._local.trace = None
+        result = {"message": format_plan(trace.root), "plan": trace.root}
+        if stmt.analyze:
+            result["message"] += (f"\nPlanning: {(planned - start) * 1000:.3f} ms, "
+                                  f"Execution: {(finished - planned) * 1000:.3f} ms, Rows: {count}")
+            result.update(planning_ms=round((planned - start) * 1000, 3),
+                          execution_ms=round((finished - planned) * 1000, 3), rows_returned=count)
+        return result
+    
+    def _exec_analyze(self, stmt: AnalyzeStmt):
+        tables = [stmt.table_name] if stmt.table_name is not None else list(self.storage.schemas)
+        stats = {}
+        lines = []
+        with self.storage.snapshot():
+            for table in tables:
+                found = self.storage.analyze(table)
+                stats[table] = found.to_dict()
+                lines.append(f"{table}: {found.active} active rows, {found.versions - found.active} inactive")
+        return {"message": '\n'.join(lines) or "No tables to analyze", "stats": stats}
+    
+    def _traced(self, rows, node, parent=None, batched: bool = False):
+        # Adds an operator to the plan being traced, if any; `node` is None otherwise
+        if node is None:
+            return rows
+        return self._local.trace.add(rows, node, parent, batched)
+    
+    def _node(self, operator: str, **details):
+        if getattr(self._local, 'trace', None) is None:
+            return None
+        return dict(operator=operator, **{k: v for k, v in details.items() if v is not None})
+    
+    def _scan_node(self, table: str, where, stmt: SelectStmt, order=None):
+        # Mirrors _source_rows and _scan
+        if getattr(self._local, 'trace', None) is None:
+            return None
+        if table == stmt.table_name and stmt.as_of_version is not None:
+            node = {'operator': 'Version Scan', 'table': table, 'version': stmt.as_of_version}
+        elif stmt.as_of is not None and self.storage.schemas[table]['is_ledger']:
+            node = {'operator': 'As Of Scan', 'table': table, 'as_of': stmt.as_of}
+        elif order is not None:
+            node = self.storage.access_path(table, where, order_by=order[0], descending=order[1])
+        elif table == stmt.table_name and self._partitions(stmt, where) is not None:
+            ranges, pruned = self._partitions(stmt, where)
+            node = {'operator': 'Parallel Seq Scan', 'table': table, 'history': stmt.history or None,
+                    'workers': min(self.scan_pool.workers, len(ranges)), 'partitions': len(ranges),
+                    'pruned': pruned or None,
+                    'est_rows': round(self.storage.estimate_rows(table, where, stmt.history), 1)}
+            node = {k: v for k, v in node.items() if v is not None}
+        else:
+            node = self.storage.access_path(table, where, stmt.history and table == stmt.table_name)
+        if where is not None:
+            node['filter'] = format_expr(where)
+        return node
+    
+    def select_iter(self, stmt: SelectStmt) -> Iterator[Dict]:
+        # Every table in the query is read at the same committed snapshot, held until
+        # the last row has been consumed
+        with self.storage.snapshot():
+            yield from self._select_pipeline(stmt)
+    
+    def _select_pipeline(self, stmt: SelectStmt):
+        # Operators are assembled here and run as rows are pulled
+        start = time.perf_counter()
+        where, residual = self._split_where(stmt)
+        if any('(' in col for col in referenced_columns(stmt.where)):
+            raise ValueError("Aggregates are not allowed in WHERE; use HAVING")
+        if stmt.aggregates or stmt.group_by:
+            order = None
+            rows = self._aggregate(stmt, where, residual)
+        else:
+            order = self._index_order(stmt, where)
+            rows = self._source_rows(stmt, where, residual, order)
         
-        if stmt.join:
-            rows = self._exec_join(rows, stmt)
+        if stmt.order_by and order is None:
+            keys = ', '.join(col + (' DESC' if desc else '') for col, desc in stmt.order_by)
+            rows = self._traced(self._sort(rows, stmt),
+                                self._node('Sort' if stmt.limit is None else 'Top-N Sort', keys=keys))
+        if stmt.offset or stmt.limit is not None:
+            rows = self._traced(islice(rows, stmt.offset, None if stmt.limit is None else stmt.offset + stmt.limit),
+                                self._node('Limit', limit=stmt.limit, offset=stmt.offset or None))
         
         if stmt.columns != ['*']:
-            rows = [{k: r[k] for k in stmt.columns if k in r} for r in rows]
+            rows = self._traced((self._project(r, stmt.columns) for r in rows),
+                                self._node('Project', columns=', '.join(
+                                    c.label if isinstance(c, Aggregate) else c for c in stmt.columns)))
+        
+        self.metrics.observe('ledgerdb_stage_seconds', time.perf_counter() - start, stage='plan')
+        return rows
+    
+    def _source_rows(self, stmt: SelectStmt, where, residual, order=None):
+        if stmt.joins:
+            return self._join_rows(stmt, where, residual)
+        if stmt.as_of_version is not None:
+            rows = self._deferred(self.storage.select_version, stmt.table_name, stmt.as_of_version, where)
+        elif order is not None:
+            rows = self.storage.iter_rows(stmt.table_name, where, order_by=order[0], descending=order[1])
+        else:
+            rows = self._scan(stmt.table_name, where, stmt)
+        return self._traced(rows, self._scan_node(stmt.table_name, where, stmt, order))
+    
+    def _join_rows(self, stmt: SelectStmt, where, residual):
+        # The planner picks the table the join starts from and the order of the rest
+        plan = self.planner.plan_joins(stmt, where, residual)
+        driver = plan['driver']
+        filter_ = plan['filters'].get(driver)
+        if driver == stmt.table_name and stmt.as_of_version is not None:
+            rows = self._deferred(self.storage.select_version, driver, stmt.as_of_version, filter_)
+        else:
+            rows = self._scan(driver, filter_, stmt)
+        rows = self._traced(rows, self._scan_node(driver, filter_, stmt))
+        rows = self._exec_join(rows, stmt, plan)
+        if plan['residual'] is not None:
+            match = compile_predicate(plan['residual'], self._query_types(stmt))
+            rows = self._traced((r for r in rows if match(r)), self._node('Filter', cond=format_expr(plan['residual'])))
+        if plan['reordered'] and stmt.columns == ['*']:
+            # Columns come out grouped by table in the order the query names the tables
+            rank = {t: i for i, t in enumerate([stmt.table_name] + [j['table'] for j in stmt.joins])}
+            rows = (dict(sorted(r.items(), key=lambda item: rank[item[0].partition('.')[0]])) for r in rows)
+        return rows
+    
+    def _deferred(self, fn, *args):
+        # Runs an eager read when the first row is pulled
+        yield from fn(*args)
+    
+    def _aggregate(self, stmt: SelectStmt, where, residual):
+        # Hash aggregation over column batches; each aggregate folds a whole batch (or
+        # a group's slice of it) with one builtin call
+        for col in stmt.columns:
+            if not isinstance(col, Aggregate) and col not in stmt.group_by:
+                raise ValueError(f"Column {col} must appear in GROUP BY or in an aggregate")
+        aggregates = list(stmt.aggregates)
+        names = {a.name for a in aggregates}
+        for key in referenced_columns(stmt.having) + [col for col, _ in stmt.order_by]:
+            match = re.match(r'^(\w+)\((\*|[\w.]+)\)$', key)
+            if match and key not in names:
+                aggregates.append(Aggregate(match.group(1), match.group(2)))
+                names.add(key)
+        columns = list(dict.fromkeys(stmt.group_by + [a.column for a in aggregates if a.column != '*']))
+        
+        parts = self._partitions(stmt, where)
+        if parts is not None:
+            partials = self._parallel_groups(stmt, aggregates, columns, where, parts[0])
+        else:
+            batches = self._column_batches(stmt, columns, where, residual)
+            partials = self._deferred(lambda: [self._partial(stmt, aggregates, batches)])
+        node = self._node('Aggregate', group_by=', '.join(stmt.group_by) or None,
+                          aggregates=', '.join(a.name for a in aggregates), having=format_expr(stmt.having))
+        return self._traced(self._fold(stmt, aggregates, partials), node)
+    
+    def _partial(self, stmt: SelectStmt, aggregates: List[Aggregate], batches):
+        # (rows read, {group key: aggregate states}) over a stream of column batches
+        groups = {}
+        total = 0
+        for count, batch in batches:
+            total += count
+            if stmt.group_by:
+                positions = {}
+                for pos, key in enumerate(zip(*(batch[c] for c in stmt.group_by))):
+                    positions.setdefault(key, []).append(pos)
+            else:
+                positions = {(): None}
+            for key, rows in positions.items():
+                state = groups.get(key)
+                if state is None:
+                    state = groups[key] = [[0, None] for _ in aggregates]
+                for agg, acc in zip(aggregates, state):
+                    values = None if agg.column == '*' else batch[agg.column]
+                    if rows is not None and values is not None:
+                        values = [values[p] for p in rows]
+                    self._accumulate(agg, acc, values, count if rows is None else len(rows))
+        return total, groups
+    
+    def _fold(self, stmt: SelectStmt, aggregates: List[Aggregate], partials):
+        # Merges the group states of each partition, then finishes every group
+        having = compile_predicate(stmt.having) if stmt.having is not None else None
+        groups = {}
+        for _, partial in partials:
+            if not groups:
+                groups = partial
+                continue
+            for key, state in partial.items():
+                into = groups.get(key)
+                if into is None:
+                    groups[key] = state
+                    continue
+                for agg, acc, (count, value) in zip(aggregates, into, state):
+                    self._combine(agg, acc, count, value)
+        if not stmt.group_by and not groups:
+            groups[()] = [[0, None] for _ in aggregates]
+        
+        for key, state in groups.items():
+            row = dict(zip(stmt.group_by, key))
+            for agg, acc in zip(aggregates, state):
+                row[agg.name] = self._finish(agg, acc)
+                if agg.alias:
+                    row[agg.alias] = row[agg.name]
+            if having is not None and not having(row):
+                continue
+            yield row
+    
+    def _column_batches(self, stmt: SelectStmt, columns: List[str], where, residual):
+        if not stmt.joins and stmt.as_of is None and stmt.as_of_version is None:
+            return self._traced(self._table_batches(stmt, columns, where),
+                                self._scan_node(stmt.table_name, where, stmt), batched=True)
+        return self._row_batches(self._source_rows(stmt, where, residual), columns)
+    
+    def _table_batches(self, stmt: SelectStmt, columns: List[str], where, partition: tuple = None):
+        names = [c.rpartition('.')[2] for c in columns]
+        batches = self.storage.iter_batches(stmt.table_name, names, where, stmt.history, AGGREGATE_BATCH_SIZE,
+                                            partition)
+        return ((count, {c: batch[n] for c, n in zip(columns, names)}) for count, batch in batches)
+    
+    def _partitions(self, stmt: SelectStmt, where):
+        # Row id ranges for a parallel scan of the base table, with the number pruned, or
+        # None to scan serially: when the table is small, an index narrows the scan, a
+        # LIMIT could stop it early, or a HISTORY scan reads compacted segments, which
+        # every worker would have to decompress whole
+        if (stmt.joins or stmt.as_of is not None or stmt.as_of_version is not None
+                or stmt.limit is not None and not stmt.order_by and not stmt.aggregates and not stmt.group_by
+                or stmt.history and self.storage.compacted_rows(stmt.table_name)
+                or not self.scan_pool.enabled(self.storage.row_count(stmt.table_name))):
+            return None
+        if self.storage.access_path(stmt.table_name, where, stmt.history)['operator'] != 'Seq Scan':
+            return None
+        # Several partitions per worker even out partitions of uneven cost
+        return self.storage.partitions(stmt.table_name, where, self.scan_pool.workers * 4)
+    
+    def _parallel_rows(self, stmt: SelectStmt, where, ranges: List):
+        # Workers filter their partitions and, unless the rows are sorted afterwards,
+        # project them too
+        columns = stmt.columns if stmt.columns != ['*'] and not stmt.order_by else None
+        
+        def scan(partition):
+            rows = self.storage.iter_rows(stmt.table_name, where, stmt.history, partition=partition)
+            return [self._project(r, columns) for r in rows] if columns else list(rows)
+        
+        results = self.scan_pool.map(scan, ranges, self.storage.scan_locks(stmt.table_name))
+        return chain.from_iterable(results)
+    
+    def _parallel_groups(self, stmt: SelectStmt, aggregates: List[Aggregate], columns: List[str], where,
+                         ranges: List):
+        # Workers aggregate their partitions; _fold merges the group states
+        def aggregate(partition):
+            return self._partial(stmt, aggregates, self._table_batches(stmt, columns, where, partition))
         
-        return {"rows": rows}
+        results = self.scan_pool.map(aggregate, ranges, self.storage.scan_locks(stmt.table_name))
+        return self._traced(results, self._scan_node(stmt.table_name, where, stmt), batched=True)
+    
+    def _row_batches(self, rows, columns: List[str]):
+        while True:
+            batch = list(islice(rows, AGGREGATE_BATCH_SIZE))
+            if not batch:
+                return
+            yield len(batch), {c: [self._value(r, c) for r in batch] for c in columns}
+    
+    def _accumulate(self, agg: Aggregate, acc: List, values, count: int):
+        # acc is [non-null count, running value]
+        if values is None:
+            acc[0] += count
+            return
+        if None in values:
+            values = [v for v in values if v is not None]
+        if not values:
+            return
+        if agg.func == 'COUNT':
+            self._combine(agg, acc, len(values), None)
+        elif agg.func in ('SUM', 'AVG'):
+            self._combine(agg, acc, len(values), sum(self._numeric(agg, values)))
+        else:
+            self._combine(agg, acc, len(values), self._extreme(min if agg.func == 'MIN' else max, values))
+    
+    def _combine(self, agg: Aggregate, acc: List, count: int, value):
+        # Folds a count of non-null values and their total or extreme into acc
+        acc[0] += count
+        if value is None:
+            return
+        if acc[1] is None:
+            acc[1] = value
+        elif agg.func in ('SUM', 'AVG'):
+            acc[1] += value
+        else:
+            acc[1] = self._extreme(min if agg.func == 'MIN' else max, [acc[1], value])
+    
+    def _numeric(self, agg: Aggregate, values: List):
+        # Packed arrays keep integer sums exact and make the sum a single C loop
+        try:
+            return array('q', values)
+        except (TypeError, OverflowError):
+            pass
+        try:
+            return array('d', values)
+        except TypeError:
+            raise ValueError(f"{agg.func} requires a numeric column: {agg.column}")
+    
+    def _extreme(self, pick, values: List):
+        try:
+            return pick(values)
+        except TypeError:
+            return pick(values, key=_sort_key)
+    
+    def _finish(self, agg: Aggregate, acc: List):
+        if agg.func == 'COUNT':
+            return acc[0]
+        if agg.func == 'AVG':
+            return acc[1] / acc[0] if acc[0] else None
+        return acc[1]
+    
+    def _index_order(self, stmt: SelectStmt, where):
+        # A single ORDER BY column with an ordered index is read in index order, unless
+        # another index already narrows the scan
+        if (len(stmt.order_by) != 1 or stmt.joins or stmt.history or stmt.as_of is not None
+                or stmt.as_of_version is not None):
+            return None
+        col, descending = stmt.order_by[0]
+        table, _, name = col.rpartition('.')
+        if table and table != stmt.table_name or not self.index.is_ordered(stmt.table_name, name):
+            return None
+        if self.storage.access_path(stmt.table_name, where)['operator'] == 'Index Scan':
+            return None
+        return name, descending
+    
+    def _sort(self, rows, stmt: SelectStmt):
+        # NULLs sort last in either direction; with a LIMIT only the top rows are kept
+        directions = {desc for _, desc in stmt.order_by}
+        if len(directions) == 1:
+            descending = directions.pop()
+            columns = [col for col, _ in stmt.order_by]
+            key = lambda r: tuple(self._null_key(self._value(r, c), descending) for c in columns)
+        else:
+            descending = False
+            key = cmp_to_key(lambda a, b: self._compare(a, b, stmt.order_by))
+        
+        # Sorting waits for the first row to be pulled, like the rest of the pipeline
+        if stmt.limit is not None:
+            top = heapq.nlargest if descending else heapq.nsmallest
+            yield from top(stmt.offset + stmt.limit, rows, key=key)
+        else:
+            yield from sorted(rows, key=key, reverse=descending)
+    
+    def _null_key(self, value, descending: bool):
+        if value is None:
+            return (not descending,)
+        return (descending, _sort_key(value))
+    
+    def _compare(self, a: Dict, b: Dict, order_by: List):
+        for col, descending in order_by:
+            x, y = self._null_key(self._value(a, col), False), self._null_key(self._value(b, col), False)
+            if x != y:
+                return (-1 if x < y else 1) * (-1 if descending and len(x) == len(y) == 2 else 1)
+        return 0
+    
+    def _exec_verify(self, stmt: VerifyStmt):
+        if stmt.table_name not in self.storage.schemas:
+            raise ValueError(f"Table {stmt.table_name} does not exist")
+        if stmt.rid is not None:
+            proof = self.storage.prove(stmt.table_name, stmt.rid)
+            status = "included in" if proof['valid'] else "NOT included in"
+            return {"message": f"Row {stmt.rid} of {stmt.table_name} is {status} root {proof['root']}",
+                    "proof": proof}
+        report = self.storage.verify(stmt.table_name, stmt.since)
+        if report['valid']:
+            message = f"{stmt.table_name}: {report['checked']} records verified, root {report['root']}"
+        else:
+            message = f"{stmt.table_name}: verification FAILED: {report['error']}"
+        return {"message": message, "verification": report}
     
     def _exec_update(self, stmt: UpdateStmt):
-        if not stmt.where:
+        if stmt.where is None:
             raise ValueError("UPDATE requires WHERE clause")
         self.storage.update_rows(stmt.table_name, stmt.set_clause, stmt.where)
         return {"message": "Rows updated"}
@@ -65,22 +629,122 @@ class QueryExecutor:
         self.storage.delete_rows(stmt.table_name, stmt.where)
         return {"message": "Rows deleted"}
     
-    def _exec_join(self, left_rows, stmt: SelectStmt):
-        join_table = stmt.join['table']
-        join_on = stmt.join['on']
-        
-        left_col, right_col = join_on.split('=')
-        left_col = left_col.strip().split('.')[-1]
-        right_col = right_col.strip().split('.')[-1]
-        
-        right_rows = self.storage.select_rows(join_table)
-        
-        result = []
-        for left in left_rows:
-            for right in right_rows:
-                if left.get(left_col) == right.get(right_col):
-                    merged = {f"{stmt.table_name}.{k}": v for k, v in left.items()}
-                    merged.update({f"{join_table}.{k}": v for k, v in right.items()})
-                    result.append(merged)
-        
+    def _scan(self, table: str, where, stmt: SelectStmt):
+        # AS OF '<timestamp>' applies to every ledger table in the query
+        if stmt.as_of is not None and self.storage.schemas[table]['is_ledger']:
+            return self._deferred(self.storage.select_as_of, table, stmt.as_of, where)
+        if table == stmt.table_name:
+            parts = self._partitions(stmt, where)
+            if parts is not None:
+                return self._parallel_rows(stmt, where, parts[0])
+        return self.storage.iter_rows(table, where, stmt.history and table == stmt.table_name)
+    
+    def _split_where(self, stmt: SelectStmt):
+        # AND terms that only read the base table are pushed into the scan; the rest
+        # filter joined rows
+        pushed, residual = [], []
+        for term in conjuncts(stmt.where):
+            if all(c.rpartition('.')[0] in ('', stmt.table_name) for c in referenced_columns(term)):
+                pushed.append(map_columns(term, lambda c: c.rpartition('.')[2]))
+            else:
+                residual.append(term)
+        return conjoin(pushed), conjoin(residual)
+    
+    def _query_types(self, stmt: SelectStmt):
+        # Declared types of every column in a join, by qualified name
+        types = {}
+        for table in [stmt.table_name] + [j['table'] for j in stmt.joins]:
+            for name, type_ in self.storage.column_types(table).items():
+                types[f"{table}.{name}"] = type_
+        return types
+    
+    def _value(self, row: Dict, col: str):
+        if col in row:
+            return row[col]
+        matches = [k for k in row if k.endswith('.' + col)]
+        return row[matches[0]] if len(matches) == 1 else None
+    
+    def _project(self, row: Dict, columns: List[str]):
+        result = {}
+        for col in columns:
+            if isinstance(col, Aggregate):
+                result[col.label] = row[col.label]
+                continue
+            if col in row:
+                result[col] = row[col]
+                continue
+            matches = [k for k in row if k.endswith('.' + col)]
+            if len(matches) == 1:
+                result[col] = row[matches[0]]
         return result
+    
+    def _exec_join(self, left_rows, stmt: SelectStmt, plan: Dict):
+        rows = ({f"{plan['driver']}.{k}": v for k, v in r.items()} for r in left_rows)
+        for step in plan['steps']:
+            table = step['table']
+            node = self._node('Join', type=step['type'], table=table, on=f"{step['left_key']} = {table}.{step['right_col']}",
+                              strategy=step['strategy'], est_rows=round(step['est_rows'], 1),
+                              cost=round(step['cost'], 1))
+            rows = self._traced(self._join(rows, stmt, step, node), node)
+        return rows
+    
+    def _join(self, rows, stmt: SelectStmt, step: Dict, node):
+        # Each join runs the way the planner found cheapest: building a hash table on the
+        # side expected to be smaller, or looking up the right table's index per left row
+        table, left_key, right_col = step['table'], step['left_key'], step['right_col']
+        left_outer = step['type'] == 'LEFT'
+        if step['method'] == 'index':
+            return self._index_join(rows, table, left_key, right_col, left_outer, step['filter'])
+        right_rows = self._right_rows(table, stmt, node, step['filter'])
+        if step['method'] == 'hash_left':
+            return self._deferred(lambda: self._hash_join_build_left(list(rows), right_rows, table, left_key,
+                                                                      right_col))
+        return self._hash_join(rows, right_rows, table, left_key, right_col, left_outer)
+    
+    def _right_rows(self, table: str, stmt: SelectStmt, node, where=None):
+        return self._traced(self._scan(table, where, stmt), self._scan_node(table, where, stmt), parent=node)
+    
+    def _null_row(self, table: str):
+        return {f"{table}.{c}": None for c in self.storage.column_names(table)}
+    
+    def _merge(self, left: Dict, table: str, right: Dict):
+        merged = dict(left)
+        merged.update({f"{table}.{k}": v for k, v in right.items()})
+        return merged
+    
+    def _index_join(self, left_rows, table: str, left_key: str, right_col: str, left_outer: bool, where=None):
+        for left in left_rows:
+            value = left.get(left_key)
+            matches = []
+            if value is not None:
+                matches = self.storage.select_rows(table, conjoin([Comparison(right_col, '=', value)] + conjuncts(where)))
+            for right in matches:
+                yield self._merge(left, table, right)
+            if not matches and left_outer:
+                yield dict(left, **self._null_row(table))
+    
+    def _hash_join(self, left_rows, right_rows, table: str, left_key: str, right_col: str, left_outer: bool):
+        # Build on the right input and stream the left
+        buckets = {}
+        for right in right_rows:
+            if right.get(right_col) is not None:
+                buckets.setdefault(right[right_col], []).append(right)
+        for left in left_rows:
+            matches = buckets.get(left.get(left_key), ())
+            for right in matches:
+                yield self._merge(left, table, right)
+            if not matches and left_outer:
+                yield dict(left, **self._null_row(table))
+    
+    def _hash_join_build_left(self, left_rows: List[Dict], right_rows, table: str, left_key: str, right_col: str):
+        # Build on the smaller left input and stream the right, keeping left order
+        buckets = {}
+        for pos, left in enumerate(left_rows):
+            if left.get(left_key) is not None:
+                buckets.setdefault(left[left_key], []).append(pos)
+        pairs = []
+        for right in right_rows:
+            for pos in buckets.get(right.get(right_col), ()):
+                pairs.append((pos, self._merge(left_rows[pos], table, right)))
+        pairs.sort(key=lambda p: p[0])
+        return iter([merged for _, merged in pairs])
@@ -0,0 +1,140 @@
+import bisect
+import heapq
+import json
+import os
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from operator import itemgetter
+from typing import Dict, List, Tuple
+
+class HistoryStore:
+    def __init__(self, path: str, cache_size: int = 4):
+        # Immutable segments of retired ledger versions, stored column by column and
+        # compressed; only the sorted row ids of each segment are kept in memory
+        self.path = path
+        self.cache_size = cache_size
+        self.segments = []
+        self.rid_arrays = []
+        self._cache = OrderedDict()
+        # Guards the decompressed segment cache
+        self.lock = threading.Lock()
+        if os.path.exists(self._manifest_path()):
+            with open(self._manifest_path(), 'r') as f:
+                self.segments = json.load(f)
+            for entry in self.segments:
+                rids = array('q')
+                with open(os.path.join(self.path, entry['rids']), 'rb') as f:
+                    rids.frombytes(f.read())
+                self.rid_arrays.append(rids)
+    
+    def _manifest_path(self):
+        return os.path.join(self.path, "manifest.json")
+    
+    def __len__(self):
+        return sum(len(rids) for rids in self.rid_arrays)
+    
+    def write(self, rows: List[Tuple[int, Dict]]):
+        if not rows:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        rows = sorted(rows, key=lambda r: r[0])
+        columns = list(dict.fromkeys(c for _, row in rows for c in row))
+        seq = self.segments[-1]['seq'] + 1 if self.segments else 1
+        entry = {'seq': seq, 'file': f"{seq:06d}.col", 'rids': f"{seq:06d}.rids", 'count': len(rows)}
+        
+        data = {'columns': {c: [row.get(c) for _, row in rows] for c in columns},
+                'missing': {c: [i for i, (_, row) in enumerate(rows) if c not in row] for c in columns}}
+        rids = array('q', [rid for rid, _ in rows])
+        self._write(entry['file'], zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8')))
+        self._write(entry['rids'], rids.tobytes())
+        
+        self.segments.append(entry)
+        self.rid_arrays.append(rids)
+        self._write(os.path.basename(self._manifest_path()), json.dumps(self.segments).encode('utf-8'))
+    
+    def _write(self, name: str, data: bytes):
+        path = os.path.join(self.path, name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+    
+    def _locate(self, rid: int):
+        for pos, rids in enumerate(self.rid_arrays):
+            i = bisect.bisect_left(rids, rid)
+            if i < len(rids) and rids[i] == rid:
+                return pos, i
+        return None
+    
+    def __contains__(self, rid: int):
+        return self._locate(rid) is not None
+    
+    def get(self, rid: int):
+        found = self._locate(rid)
+        if found is None:
+            return None
+        pos, i = found
+        return self._row(self._segment(pos), i)
+    
+    def get_many(self, rids):
+        # {rid: row} for the row ids stored here, decompressing each segment that holds
+        # any of them once
+        by_segment = {}
+        for rid in rids:
+            found = self._locate(rid)
+            if found is not None:
+                by_segment.setdefault(found[0], []).append((rid, found[1]))
+        rows = {}
+        for pos, found in by_segment.items():
+            data = self._segment(pos)
+            for rid, i in found:
+                rows[rid] = self._row(data, i)
+        return rows
+    
+    def rids(self):
+        # Every row id in ascending order across segments
+        return heapq.merge(*self.rid_arrays)
+    
+    def scan(self, lo: int = None, hi: int = None):
+        # (rid, row) for the rows with lo <= rid < hi, in ascending rid order. Each
+        # segment is decompressed once and read in order, and the segments are merged
+        segments = [self._scan_segment(pos, lo, hi) for pos in range(len(self.segments))]
+        return heapq.merge(*segments, key=itemgetter(0))
+    
+    def _scan_segment(self, pos: int, lo: int, hi: int):
+        rids = self.rid_arrays[pos]
+        start = 0 if lo is None else bisect.bisect_left(rids, lo)
+        end = len(rids) if hi is None else bisect.bisect_left(rids, hi)
+        if start >= end:
+            return
+        data = self._segment(pos)
+        if data['missing']:
+            for i in range(start, end):
+                yield rids[i], self._row(data, i)
+            return
+        columns = list(data['columns'])
+        values = zip(*(column[start:end] for column in data['columns'].values()))
+        for rid, row in zip(rids[start:end], values):
+            yield rid, dict(zip(columns, row))
+    
+    def _segment(self, pos: int):
+        seq = self.segments[pos]['seq']
+        with self.lock:
+            if seq in self._cache:
+                self._cache.move_to_end(seq)
+                return self._cache[seq]
+        with open(os.path.join(self.path, self.segments[pos]['file']), 'rb') as f:
+            data = json.loads(zlib.decompress(f.read()))
+        data['missing'] = {c: set(ids) for c, ids in data['missing'].items() if ids}
+        with self.lock:
+            self._cache[seq] = data
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return data
+    
+    def _row(self, data: Dict, i: int):
+        missing = data['missing']
+        return {c: values[i] for c, values in data['columns'].items() if c not in missing or i not in missing[c]}
@@ -1,27 +1,166 @@
+import bisect
+import threading
 from typing import Dict, Any, List
 
+def _sort_key(value: Any):
+    # Numbers and strings never compare directly, so rank by type first
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (0, value)
+    return (1, str(value))
+
+def _rids(entry):
+    # A value held by a single row maps to its bare rid rather than a one-element set
+    if entry is None:
+        return ()
+    return entry if isinstance(entry, set) else (entry,)
+
 class Index:
     def __init__(self):
         self.indexes = {}
+        # Snapshot readers look up entries while the writer is changing them
+        self.lock = threading.Lock()
     
-    def create_index(self, table_name: str, column: str, unique: bool = False):
+    def create_index(self, table_name: str, column: str, unique: bool = False, ordered: bool = False):
         key = f"{table_name}.{column}"
-        self.indexes[key] = {'unique': unique, 'data': {}}
+        self.indexes[key] = {'unique': unique, 'ordered': ordered, 'data': {}, 'keys': []}
+    
+    def clear_table(self, table_name: str):
+        for column in self.table_columns(table_name):
+            entry = self.indexes[f"{table_name}.{column}"]
+            entry['data'] = {}
+            entry['keys'] = []
     
-    def add_to_index(self, table_name: str, column: str, value: Any, row_id: int):
+    def has_index(self, table_name: str, column: str):
+        return f"{table_name}.{column}" in self.indexes
+    
+    def is_unique(self, table_name: str, column: str):
+        return self.indexes[f"{table_name}.{column}"]['unique']
+    
+    def is_ordered(self, table_name: str, column: str):
+        key = f"{table_name}.{column}"
+        return key in self.indexes and self.indexes[key]['ordered']
+    
+    def table_columns(self, table_name: str):
+        prefix = f"{table_name}."
+        return [k[len(prefix):] for k in self.indexes if k.startswith(prefix)]
+    
+    def add_to_index(self, table_name: str, column: str, value: Any, row_id: int, check: bool = True):
         key = f"{table_name}.{column}"
         if key not in self.indexes:
             return
         
-        if self.indexes[key]['unique'] and value in self.indexes[key]['data']:
+        if check and self.indexes[key]['unique'] and self.indexes[key]['data'].get(value) is not None:
             raise ValueError(f"Unique constraint violation on {column}")
         
-        if value not in self.indexes[key]['data']:
-            self.indexes[key]['data'][value] = []
-        self.indexes[key]['data'][value].append(row_id)
+        with self.lock:
+            data = self.indexes[key]['data']
+            entry = data.get(value)
+            if entry is None:
+                data[value] = row_id
+                if self.indexes[key]['ordered']:
+                    bisect.insort(self.indexes[key]['keys'], (_sort_key(value), value))
+            elif isinstance(entry, set):
+                entry.add(row_id)
+            elif entry != row_id:
+                data[value] = {entry, row_id}
+    
+    def remove_from_index(self, table_name: str, column: str, value: Any, row_id: int):
+        key = f"{table_name}.{column}"
+        if key not in self.indexes:
+            return
+        
+        with self.lock:
+            data = self.indexes[key]['data']
+            entry = data.get(value)
+            if isinstance(entry, set):
+                entry.discard(row_id)
+                if len(entry) == 1:
+                    data[value] = next(iter(entry))
+            elif entry is not None and entry == row_id:
+                del data[value]
+                if self.indexes[key]['ordered']:
+                    keys = self.indexes[key]['keys']
+                    pos = bisect.bisect_left(keys, (_sort_key(value),))
+                    while keys[pos][1] != value:
+                        pos += 1
+                    del keys[pos]
     
     def lookup(self, table_name: str, column: str, value: Any):
         key = f"{table_name}.{column}"
         if key not in self.indexes:
             return None
-        return self.indexes[key]['data'].get(value, [])
+        with self.lock:
+            return sorted(_rids(self.indexes[key]['data'].get(value)))
+    
+    def contains(self, table_name: str, column: str, value: Any, row_id: int):
+        with self.lock:
+            return row_id in _rids(self.indexes[f"{table_name}.{column}"]['data'].get(value))
+    
+    def count(self, table_name: str, column: str, value: Any):
+        # Rows indexed under a value, including versions retired but not yet released
+        with self.lock:
+            return len(_rids(self.indexes[f"{table_name}.{column}"]['data'].get(value)))
+    
+    def range_lookup(self, table_name: str, column: str, low: Any = None, high: Any = None,
+                     low_inclusive: bool = True, high_inclusive: bool = True):
+        key = f"{table_name}.{column}"
+        if not self.is_ordered(table_name, column):
+            return None
+        
+        keys = self.indexes[key]['keys']
+        data = self.indexes[key]['data']
+        result = []
+        with self.lock:
+            start = 0 if low is None else bisect.bisect_left(keys, (_sort_key(low),))
+            for pos in range(start, len(keys)):
+                sort_key, value = keys[pos]
+                if low is not None and not low_inclusive and sort_key == _sort_key(low):
+                    continue
+                if high is not None:
+                    if sort_key > _sort_key(high) or (not high_inclusive and sort_key == _sort_key(high)):
+                        break
+                result.extend(_rids(data[value]))
+        return sorted(result)
+    
+    def ordered_rids(self, table_name: str, column: str, descending: bool = False):
+        # (value, rid) in key order with NULLs last; entries may be stale, so callers
+        # compare the value with the row they read
+        entry = self.indexes[f"{table_name}.{column}"]
+        with self.lock:
+            keys = list(entry['keys'])
+        if descending:
+            keys.reverse()
+        for _, value in keys:
+            if value is None:
+                continue
+            with self.lock:
+                ids = sorted(_rids(entry['data'].get(value)))
+            for rid in ids:
+                yield value, rid
+        with self.lock:
+            ids = sorted(_rids(entry['data'].get(None)))
+        for rid in ids:
+            yield None, rid
+    
+    def dump_table(self, table_name: str, keep=None):
+        dump = {}
+        for column in self.table_columns(table_name):
+            data = self.indexes[f"{table_name}.{column}"]['data']
+            entries = []
+            for v, ids in data.items():
+                ids = sorted(i for i in _rids(ids) if keep is None or keep(column, v, i))
+                if ids:
+                    entries.append([v, ids])
+            dump[column] = entries
+        return dump
+    
+    def restore_table(self, table_name: str, dump: Dict):
+        # An index created after the snapshot was taken has to be rebuilt from the log
+        if set(dump) != set(self.table_columns(table_name)):
+            return False
+        for column, entries in dump.items():
+            entry = self.indexes[f"{table_name}.{column}"]
+            entry['data'] = {v: ids[0] if len(ids) == 1 else set(ids) for v, ids in entries}
+            if entry['ordered']:
+                entry['keys'] = sorted((_sort_key(v), v) for v in entry['data'])
+        return True
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+from array import array
+from typing import List, Tuple
+
+ZERO_HASH = bytes(32)
+
+def chain_hash(prev: bytes, line: str):
+    # A record's hash covers its encoded contents and the hash of the record before it
+    return hashlib.sha256(prev + line.encode('utf-8')).digest()
+
+def _leaf(digest: bytes):
+    return hashlib.sha256(b'\x00' + digest).digest()
+
+def _node(left: bytes, right: bytes):
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+def _split(n: int):
+    # Largest power of two below n
+    return 1 << ((n - 1).bit_length() - 1)
+
+def verify_inclusion(digest: bytes, index: int, size: int, path: List[bytes], root: bytes):
+    # RFC 9162 inclusion proof check
+    if index >= size:
+        return False
+    fn, sn, r = index, size - 1, _leaf(digest)
+    for p in path:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            r = _node(p, r)
+            while not fn & 1 and fn != 0:
+                fn >>= 1
+                sn >>= 1
+        else:
+            r = _node(r, p)
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and r == root
+
+class MerkleLog:
+    def __init__(self, path: str):
+        # Chain hashes of every record in a table's log, in log order, and an RFC 6962
+        # style Merkle tree over them. Each level keeps only its completed nodes, so any
+        # prefix root or inclusion proof takes O(log^2 n) hashes. Roots are checkpointed
+        # to `path` every so often and anchor later verification
+        self.path = path
+        self.hashes = bytearray()
+        self.levels = [bytearray()]
+        # Log position of each record, packed as segment << 32 | offset
+        self.positions = array('q')
+        # Leaf of the record that inserted each row id
+        self.inserts = array('q')
+        self.checkpoints = self._read_checkpoints()
+    
+    def _read_checkpoints(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as f:
+            return [json.loads(line) for line in f if line.endswith('\n')]
+    
+    def __len__(self):
+        return len(self.hashes) // 32
+    
+    def head(self):
+        return bytes(self.hashes[-32:]) if self.hashes else ZERO_HASH
+    
+    def hash_at(self, index: int):
+        return bytes(self.hashes[index * 32:(index + 1) * 32])
+    
+    def position_at(self, index: int):
+        packed = self.positions[index]
+        return (packed >> 32, packed & 0xFFFFFFFF)
+    
+    def leaf_of(self, rid: int):
+        if rid < 1 or rid > len(self.inserts) or self.inserts[rid - 1] < 0:
+            return None
+        return self.inserts[rid - 1]
+    
+    def append(self, digest: bytes, position: Tuple[int, int], rid: int = None):
+        index = len(self)
+        self.hashes += digest
+        self.positions.append(position[0] << 32 | position[1])
+        if rid is not None:
+            while len(self.inserts) < rid - 1:
+                self.inserts.append(-1)
+            if len(self.inserts) == rid - 1:
+                self.inserts.append(index)
+        
+        node = _leaf(digest)
+        level = 0
+        while True:
+            nodes = self.levels[level]
+            nodes += node
+            if (len(nodes) // 32) % 2:
+                break
+            node = _node(bytes(nodes[-64:-32]), bytes(nodes[-32:]))
+            level += 1
+            if level == len(self.levels):
+                self.levels.append(bytearray())
+    
+    def root(self, size: int = None):
+        size = len(self) if size is None else size
+        if size == 0:
+            return hashlib.sha256(b'').digest()
+        return self._subtree(0, size)
+    
+    def _subtree(self, start: int, end: int):
+        n = end - start
+        if n & (n - 1) == 0:
+            level = n.bit_length() - 1
+            pos = (start >> level) * 32
+            return bytes(self.levels[level][pos:pos + 32])
+        k = _split(n)
+        return _node(self._subtree(start, start + k), self._subtree(start + k, end))
+    
+    def proof(self, index: int, size: int = None):
+        size = len(self) if size is None else size
+        path = []
+        start, end = 0, size
+        while end - start > 1:
+            k = _split(end - start)
+            if index < start + k:
+                path.append(self._subtree(start + k, end))
+                end = start + k
+            else:
+                path.append(self._subtree(start, start + k))
+                start += k
+        return path[::-1]
+    
+    def checkpoint(self, position: Tuple[int, int], at: str):
+        entry = {'seq': self.checkpoints[-1]['seq'] + 1 if self.checkpoints else 1, 'size': len(self),
+                 'root': self.root().hex(), 'head': self.head().hex(), 'position': list(position), 'at': at}
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        self.checkpoints.append(entry)
+    
+    def reload(self):
+        # A replica picks up the checkpoints another process recorded, up to its own size
+        self.checkpoints = [c for c in self._read_checkpoints() if c['size'] <= len(self)]
+    
+    def discard_after(self, size: int):
+        # Checkpoints of records lost in a crash are dropped with them
+        kept = [c for c in self.checkpoints if c['size'] <= size]
+        if len(kept) == len(self.checkpoints):
+            return
+        self.checkpoints = kept
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(''.join(json.dumps(c) + '\n' for c in kept))
+        os.replace(self.path + '.tmp', self.path)
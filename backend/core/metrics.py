@@ -0,0 +1,144 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels: tuple, extra: str = ''):
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+class Metrics:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        # Counters, gauges and latency histograms, rendered in the Prometheus text
+        # format. An update is one dict lookup and an add under a lock, cheap enough
+        # for every statement and disk write
+        self.buckets = buckets
+        self.counters = {}
+        self.gauges = {}
+        # (name, labels) -> per-bucket counts, with +Inf last, then the sum
+        self.histograms = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+    
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts = self.histograms.get(key)
+            if counts is None:
+                counts = self.histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            counts[-1] += seconds
+    
+    @contextmanager
+    def timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('ledgerdb_stage_seconds', time.perf_counter() - start, stage=stage)
+    
+    def render(self):
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, list(counts)) for key, counts in self.histograms.items())
+        lines = []
+        for kind, series in (('counter', counters), ('gauge', gauges)):
+            last = None
+            for (name, labels), value in series:
+                if name != last:
+                    lines.append(f"# TYPE {name} {kind}")
+                    last = name
+                lines.append(f"{name}{_labels(labels)} {value}")
+        last = None
+        for (name, labels), counts in histograms:
+            if name != last:
+                lines.append(f"# TYPE {name} histogram")
+                last = name
+            # Prometheus buckets are cumulative
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(labels, le)} {total}")
+            lines.append(f"{name}_sum{_labels(labels)} {counts[-1]}")
+            lines.append(f"{name}_count{_labels(labels)} {total}")
+        return '\n'.join(lines) + '\n'
+
+class PlanTrace:
+    def __init__(self, analyze: bool):
+        # The operator tree of one SELECT, built as its pipeline is assembled. Each node
+        # is a dict naming the operator and its details, with its inputs as `children`.
+        # Under ANALYZE every operator also counts the rows it produces and the time
+        # spent producing them, which includes the time of its inputs
+        self.analyze = analyze
+        self.root = None
+    
+    def add(self, rows: Iterable, node: Dict, parent: Dict = None, batched: bool = False):
+        # A node goes above the plan so far, or under `parent` as a side input such as
+        # the right side of a join. Batched inputs yield (row count, batch) pairs
+        if parent is not None:
+            parent.setdefault('children', []).append(node)
+        else:
+            if self.root is not None:
+                node.setdefault('children', []).insert(0, self.root)
+            self.root = node
+        return _timed(rows, node, batched) if self.analyze else rows
+
+def _timed(rows: Iterable, node: Dict, batched: bool):
+    node['rows'] = 0
+    node['time_ms'] = 0.0
+    rows = iter(rows)
+    clock = time.perf_counter
+    while True:
+        start = clock()
+        try:
+            item = next(rows)
+        except StopIteration:
+            node['time_ms'] += (clock() - start) * 1000
+            return
+        node['time_ms'] += (clock() - start) * 1000
+        node['rows'] += item[0] if batched else 1
+        yield item
+
+def exclusive_times(node: Dict, out: List = None):
+    # (operator, milliseconds) of every traced node, less the time of its inputs
+    out = [] if out is None else out
+    children = node.get('children', ())
+    if 'time_ms' in node:
+        out.append((node['operator'], max(0.0, node['time_ms'] - sum(c.get('time_ms', 0) for c in children))))
+    for child in children:
+        exclusive_times(child, out)
+    return out
+
+def format_plan(node: Dict):
+    # Indented text of a plan tree, one operator per line
+    return '\n'.join(_plan_lines(node, 0))
+
+def _plan_lines(node: Dict, depth: int):
+    details = [f"{k}={v}" for k, v in node.items() if k not in ('operator', 'children', 'rows', 'time_ms')]
+    line = node['operator'] + (f" ({', '.join(details)})" if details else '')
+    if 'rows' in node:
+        line += f" [rows={node['rows']} time={node['time_ms']:.3f}ms]"
+    lines = [('  ' * (depth - 1) + '-> ' if depth else '') + line]
+    for child in node.get('children', ()):
+        lines.extend(_plan_lines(child, depth + 1))
+    return lines
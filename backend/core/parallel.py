@@ -0,0 +1,53 @@
+import multiprocessing
+import os
+import threading
+from contextlib import ExitStack
+from typing import Callable, List
+
+# The work of the pool being started. Forked workers inherit it with the rest of the
+# parent's memory, so neither the function nor the tables it reads are pickled
+_work = None
+_fork_lock = threading.Lock()
+
+def _started():
+    # Locks held across the fork are the parent's; each worker frees its own copies
+    for lock in _work[2]:
+        lock.release()
+
+def _run(i: int):
+    fn, items, _ = _work
+    return fn(items[i])
+
+class ScanPool:
+    def __init__(self, workers: int = None, min_rows: int = 100000):
+        # Runs a function over partitions of a table in forked worker processes and
+        # returns their results, which must pickle. Workers see memory as it was when
+        # they were forked, including the calling thread's read snapshot, and are
+        # started per scan so they never see stale tables
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.min_rows = min_rows
+        # Without fork, workers would have to be sent the tables
+        self.available = 'fork' in multiprocessing.get_all_start_methods()
+    
+    def enabled(self, rows: int):
+        return self.available and self.workers > 1 and rows >= self.min_rows
+    
+    def map(self, fn: Callable, items: List, locks: List = ()):
+        # Results in item order, each as soon as it and those before it are done.
+        # `locks` are ones fn may take; they are held across the forks so no worker
+        # starts with one taken mid-update by another thread
+        global _work
+        if not items:
+            return
+        with _fork_lock, ExitStack() as held:
+            for lock in locks:
+                held.enter_context(lock)
+            _work = (fn, items, locks)
+            try:
+                pool = multiprocessing.get_context('fork').Pool(min(self.workers, len(items)), _started)
+            finally:
+                _work = None
+        try:
+            yield from pool.imap(_run, range(len(items)))
+        finally:
+            pool.terminate()
@@ -1,6 +1,8 @@
 import re
-from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields, is_dataclass, replace
+from typing import List, Dict, Any, Optional, Tuple
 
 @dataclass
 class Column:
@@ -16,144 +18,598 @@ class CreateTableStmt:
     is_ledger: bool = False
 
 @dataclass
-class InsertStmt:
+class CreateIndexStmt:
+    index_name: Optional[str]
     table_name: str
+    column: str
+    method: str = 'HASH'
+
+@dataclass
+class CreateViewStmt:
+    view_name: str
+    query: 'SelectStmt'
+
+@dataclass
+class Param:
+    # A `?` placeholder, numbered left to right
+    index: int
+
+@dataclass
+class Range:
+    low: Any = None
+    high: Any = None
+    low_inclusive: bool = True
+    high_inclusive: bool = True
+
+# WHERE and HAVING expressions
+@dataclass
+class Comparison:
+    column: str
+    op: str
+    value: Any
+
+@dataclass
+class Between:
+    column: str
+    low: Any
+    high: Any
+
+@dataclass
+class InList:
+    column: str
     values: List[Any]
 
+@dataclass
+class IsNull:
+    column: str
+
+@dataclass
+class And:
+    items: List[Any]
+
+@dataclass
+class Or:
+    items: List[Any]
+
+@dataclass
+class Not:
+    item: Any
+
+@dataclass
+class Aggregate:
+    func: str
+    column: str
+    alias: Optional[str] = None
+    
+    @property
+    def name(self):
+        return f"{self.func}({self.column})"
+    
+    @property
+    def label(self):
+        return self.alias or self.name
+
+AGGREGATE_FUNCS = ('COUNT', 'SUM', 'AVG', 'MIN', 'MAX')
+
+@dataclass
+class InsertStmt:
+    table_name: str
+    rows: List[List[Any]]
+
+@dataclass
+class CopyStmt:
+    table_name: str
+    path: str
+    format: str = 'CSV'
+
 @dataclass
 class SelectStmt:
     table_name: str
     columns: List[str]
-    where: Optional[Dict] = None
+    where: Optional[Any] = None
     history: bool = False
-    join: Optional[Dict] = None
+    joins: List[Dict] = field(default_factory=list)
+    as_of: Optional[str] = None
+    as_of_version: Optional[int] = None
+    # (column, descending) pairs
+    order_by: List[Tuple[str, bool]] = field(default_factory=list)
+    limit: Optional[int] = None
+    offset: int = 0
+    group_by: List[str] = field(default_factory=list)
+    having: Optional[Any] = None
+    
+    @property
+    def aggregates(self):
+        return [c for c in self.columns if isinstance(c, Aggregate)]
 
 @dataclass
 class UpdateStmt:
     table_name: str
     set_clause: Dict[str, Any]
-    where: Optional[Dict] = None
+    where: Optional[Any] = None
 
 @dataclass
 class DeleteStmt:
     table_name: str
-    where: Optional[Dict] = None
+    where: Optional[Any] = None
+
+@dataclass
+class VerifyStmt:
+    table_name: str
+    # Start at this root checkpoint instead of the first record
+    since: Optional[int] = None
+    # Return the inclusion proof of one row instead
+    rid: Optional[int] = None
+
+@dataclass
+class ExplainStmt:
+    stmt: SelectStmt
+    # Run the query and report rows and time per operator
+    analyze: bool = False
+
+@dataclass
+class AnalyzeStmt:
+    # Every table when None
+    table_name: Optional[str] = None
+
+@dataclass
+class BeginStmt:
+    pass
+
+@dataclass
+class CommitStmt:
+    pass
+
+@dataclass
+class RollbackStmt:
+    pass
+
+_TOKEN_RE = re.compile(r"""\s*(?:(?P<number>\d+\.\d*|\.\d+|\d+)
+                          |(?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+                          |(?P<ident>[A-Za-z_]\w*)
+                          |(?P<op><=|>=|<>|!=|[=<>(),.*;?+-]))""", re.VERBOSE)
 
 class SQLParser:
-    def parse(self, sql: str):
-        sql = sql.strip().rstrip(';')
-        tokens = sql.split()
-        cmd = tokens[0].upper()
-        
-        if cmd == 'CREATE':
-            return self._parse_create(sql)
-        elif cmd == 'INSERT':
-            return self._parse_insert(sql)
-        elif cmd == 'SELECT':
-            return self._parse_select(sql)
-        elif cmd == 'UPDATE':
-            return self._parse_update(sql)
-        elif cmd == 'DELETE':
-            return self._parse_delete(sql)
-        else:
-            raise ValueError(f"Unknown command: {cmd}")
+    def __init__(self, cache_size: int = 256):
+        # Parsed statements keyed by their SQL text and by its normalized token form;
+        # cached statements are shared, so nothing downstream may mutate them
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
     
-    def _parse_create(self, sql: str):
-        match = re.match(r'CREATE TABLE (\w+) \((.*?)\)(?: (LEDGER))?', sql, re.IGNORECASE)
-        if not match:
-            raise ValueError("Invalid CREATE TABLE syntax")
+    def split(self, script: str):
+        # Split a script on semicolons that are not inside quoted strings
+        statements = []
+        current = ''
+        quote = None
+        for ch in script:
+            if quote:
+                if ch == quote:
+                    quote = None
+            elif ch in ("'", '"'):
+                quote = ch
+            elif ch == ';':
+                if current.strip():
+                    statements.append(current.strip())
+                current = ''
+                continue
+            current += ch
+        if current.strip():
+            statements.append(current.strip())
+        return statements
+    
+    def parse(self, sql: str, params: List[Any] = None):
+        stmt, param_count = self._lookup(sql)
+        params = list(params or ())
+        if len(params) != param_count:
+            raise ValueError(f"Expected {param_count} parameters, got {len(params)}")
+        return self._bind(stmt, params) if param_count else stmt
+    
+    def _lookup(self, sql: str):
+        with self._lock:
+            entry = self._cache.get(sql)
+            if entry is not None:
+                self._cache.move_to_end(sql)
+                return entry
         
-        table_name = match.group(1)
-        cols_str = match.group(2)
-        is_ledger = match.group(3) is not None
+        tokens = self.tokenize(sql)
+        key = ' '.join(text for _, text in tokens)
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is None:
+            parser = _StatementParser(tokens)
+            entry = (parser.statement(), parser.param_count)
         
+        with self._lock:
+            self._cache[key] = entry
+            self._cache[sql] = entry
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return entry
+    
+    def tokenize(self, sql: str):
+        tokens = []
+        pos = 0
+        sql = sql.rstrip()
+        while pos < len(sql):
+            match = _TOKEN_RE.match(sql, pos)
+            if not match:
+                raise ValueError(f"Unexpected character {sql[pos:].strip()[:1]!r} at position {pos}")
+            tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            pos = match.end()
+        return tokens
+    
+    def _bind(self, value, params: List[Any]):
+        if isinstance(value, Param):
+            return params[value.index]
+        if isinstance(value, list):
+            return [self._bind(v, params) for v in value]
+        if isinstance(value, tuple):
+            return tuple(self._bind(v, params) for v in value)
+        if isinstance(value, dict):
+            return {k: self._bind(v, params) for k, v in value.items()}
+        if is_dataclass(value):
+            return replace(value, **{f.name: self._bind(getattr(value, f.name), params) for f in fields(value)})
+        return value
+
+class _StatementParser:
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.tokens = tokens
+        self.pos = 0
+        self.param_count = 0
+    
+    def _peek(self, offset: int = 0):
+        pos = self.pos + offset
+        return self.tokens[pos] if pos < len(self.tokens) else ('end', '')
+    
+    def _is(self, *words: str, offset: int = 0):
+        kind, text = self._peek(offset)
+        if kind == 'ident':
+            return text.upper() in words
+        return kind == 'op' and text in words
+    
+    def _accept(self, *words: str):
+        if self._is(*words):
+            self.pos += 1
+            return self.tokens[self.pos - 1][1].upper()
+        return None
+    
+    def _expect(self, *words: str):
+        word = self._accept(*words)
+        if word is None:
+            raise ValueError(f"Expected {' or '.join(words)} {self._near()}")
+        return word
+    
+    def _near(self):
+        if self.pos >= len(self.tokens):
+            return "at end of statement"
+        return "near " + ' '.join(text for _, text in self.tokens[self.pos:self.pos + 3])
+    
+    def _ident(self):
+        kind, text = self._peek()
+        if kind != 'ident':
+            raise ValueError(f"Expected a name {self._near()}")
+        self.pos += 1
+        return text
+    
+    def _name(self):
+        # Possibly qualified: table.column
+        name = self._ident()
+        while self._is('.') and self._peek(1)[0] == 'ident':
+            self.pos += 1
+            name += '.' + self._ident()
+        return name
+    
+    def _int(self):
+        kind, text = self._peek()
+        if kind != 'number' or not text.isdigit():
+            raise ValueError(f"Expected an integer {self._near()}")
+        self.pos += 1
+        return int(text)
+    
+    def _value(self):
+        if self._accept('?'):
+            self.param_count += 1
+            return Param(self.param_count - 1)
+        negative = self._accept('-') is not None
+        kind, text = self._peek()
+        if kind == 'number':
+            self.pos += 1
+            value = int(text) if text.isdigit() else float(text)
+            return -value if negative else value
+        if negative:
+            raise ValueError(f"Expected a number {self._near()}")
+        if kind == 'string':
+            self.pos += 1
+            return text[1:-1].replace(text[0] * 2, text[0])
+        if kind == 'ident':
+            self.pos += 1
+            keyword = text.upper()
+            if keyword == 'NULL':
+                return None
+            if keyword in ('TRUE', 'FALSE'):
+                return keyword == 'TRUE'
+            # Bare words have always been accepted as strings
+            return text
+        raise ValueError(f"Expected a value {self._near()}")
+    
+    def statement(self):
+        word = self._expect('BEGIN', 'START', 'COMMIT', 'END', 'ROLLBACK', 'CREATE', 'INSERT', 'COPY',
+                            'SELECT', 'UPDATE', 'DELETE', 'VERIFY', 'EXPLAIN', 'ANALYZE')
+        if word in ('BEGIN', 'START'):
+            self._accept('TRANSACTION', 'WORK')
+            stmt = BeginStmt()
+        elif word in ('COMMIT', 'END'):
+            self._accept('TRANSACTION', 'WORK')
+            stmt = CommitStmt()
+        elif word == 'ROLLBACK':
+            self._accept('TRANSACTION', 'WORK')
+            stmt = RollbackStmt()
+        elif word == 'CREATE':
+            if self._accept('INDEX'):
+                stmt = self._parse_create_index()
+            elif self._accept('MATERIALIZED'):
+                stmt = self._parse_create_view()
+            else:
+                stmt = self._parse_create()
+        elif word == 'INSERT':
+            stmt = self._parse_insert()
+        elif word == 'COPY':
+            stmt = self._parse_copy()
+        elif word == 'SELECT':
+            stmt = self._parse_select()
+        elif word == 'UPDATE':
+            stmt = self._parse_update()
+        elif word == 'VERIFY':
+            stmt = self._parse_verify()
+        elif word == 'EXPLAIN':
+            analyze = self._accept('ANALYZE') is not None
+            self._expect('SELECT')
+            stmt = ExplainStmt(self._parse_select(), analyze)
+        elif word == 'ANALYZE':
+            stmt = AnalyzeStmt(self._ident() if self._peek()[0] == 'ident' else None)
+        else:
+            stmt = self._parse_delete()
+        
+        self._accept(';')
+        if self.pos < len(self.tokens):
+            raise ValueError(f"Unexpected input {self._near()}")
+        return stmt
+    
+    def _parse_create(self):
+        self._expect('TABLE')
+        table_name = self._ident()
+        self._expect('(')
         columns = []
-        for col_def in cols_str.split(','):
-            col_def = col_def.strip()
-            parts = col_def.split()
-            name = parts[0]
-            type_ = parts[1]
-            pk = 'PRIMARY' in col_def.upper()
-            uniq = 'UNIQUE' in col_def.upper()
+        while True:
+            name = self._ident()
+            type_ = self._ident()
+            if self._accept('('):
+                args = [str(self._int())]
+                while self._accept(','):
+                    args.append(str(self._int()))
+                self._expect(')')
+                type_ += f"({','.join(args)})"
+            pk = uniq = False
+            while True:
+                if self._accept('PRIMARY'):
+                    self._expect('KEY')
+                    pk = True
+                elif self._accept('UNIQUE'):
+                    uniq = True
+                else:
+                    break
             columns.append(Column(name, type_, pk, uniq))
-        
+            if not self._accept(','):
+                break
+        self._expect(')')
+        is_ledger = self._accept('LEDGER') is not None
         return CreateTableStmt(table_name, columns, is_ledger)
     
-    def _parse_insert(self, sql: str):
-        match = re.match(r'INSERT INTO (\w+) VALUES \((.*?)\)', sql, re.IGNORECASE)
-        if not match:
-            raise ValueError("Invalid INSERT syntax")
-        
-        table_name = match.group(1)
-        values_str = match.group(2)
-        values = [self._parse_value(v.strip()) for v in values_str.split(',')]
+    def _parse_create_view(self):
+        self._expect('VIEW')
+        view_name = self._ident()
+        self._expect('AS')
+        self._expect('SELECT')
+        return CreateViewStmt(view_name, self._parse_select())
+    
+    def _parse_create_index(self):
+        index_name = None if self._is('ON') else self._ident()
+        self._expect('ON')
+        table_name = self._ident()
+        self._expect('(')
+        column = self._ident()
+        self._expect(')')
+        method = self._expect('HASH', 'BTREE') if self._accept('USING') else 'HASH'
+        return CreateIndexStmt(index_name, table_name, column, method)
+    
+    def _parse_insert(self):
+        self._expect('INTO')
+        table_name = self._ident()
+        self._expect('VALUES')
+        rows = []
+        while True:
+            self._expect('(')
+            values = [self._value()]
+            while self._accept(','):
+                values.append(self._value())
+            self._expect(')')
+            rows.append(values)
+            if not self._accept(','):
+                break
+        return InsertStmt(table_name, rows)
+    
+    def _parse_copy(self):
+        table_name = self._ident()
+        self._expect('FROM')
+        kind, path = self._peek()
+        if kind != 'string':
+            raise ValueError(f"Expected a quoted file path {self._near()}")
+        self.pos += 1
+        path = path[1:-1]
         
-        return InsertStmt(table_name, values)
+        fmt = 'NDJSON' if path.lower().endswith(('.ndjson', '.jsonl', '.json')) else 'CSV'
+        self._accept('WITH')
+        parens = self._accept('(')
+        if self._accept('FORMAT'):
+            fmt = self._expect('CSV', 'NDJSON')
+        if parens:
+            self._expect(')')
+        return CopyStmt(table_name, path, fmt)
     
-    def _parse_select(self, sql: str):
-        history = 'HISTORY' in sql.upper()
-        sql = sql.replace(' HISTORY', '').replace(' history', '')
+    def _parse_select(self):
+        columns = ['*'] if self._accept('*') else self._select_items()
+        self._expect('FROM')
+        table_name = self._ident()
+        history = self._accept('HISTORY') is not None
+        as_of = as_of_version = None
+        if self._is('AS') and self._is('OF', offset=1):
+            self.pos += 2
+            if self._accept('VERSION'):
+                as_of_version = self._int()
+            else:
+                kind, text = self._peek()
+                if kind != 'string':
+                    raise ValueError(f"Expected a timestamp or VERSION after AS OF {self._near()}")
+                self.pos += 1
+                as_of = text[1:-1]
+        history = self._accept('HISTORY') is not None or history
         
-        match = re.match(r'SELECT (.*?) FROM (\w+)(?: JOIN (\w+) ON (.*?))?(?: WHERE (.*))?', sql, re.IGNORECASE)
-        if not match:
-            raise ValueError("Invalid SELECT syntax")
+        joins = []
+        while self._is('JOIN', 'LEFT', 'INNER'):
+            join_type = self._accept('LEFT', 'INNER') or 'INNER'
+            self._accept('OUTER')
+            self._expect('JOIN')
+            table = self._ident()
+            self._expect('ON')
+            left = self._name()
+            self._expect('=')
+            joins.append({'table': table, 'type': join_type, 'on': (left, self._name())})
         
-        cols_str = match.group(1).strip()
-        columns = ['*'] if cols_str == '*' else [c.strip() for c in cols_str.split(',')]
-        table_name = match.group(2)
-        join_table = match.group(3)
-        join_on = match.group(4)
-        where_str = match.group(5)
+        where = self._parse_where() if self._accept('WHERE') else None
+        group_by = []
+        if self._accept('GROUP'):
+            self._expect('BY')
+            group_by = [self._name()]
+            while self._accept(','):
+                group_by.append(self._name())
+        having = self._parse_where() if self._accept('HAVING') else None
         
-        where = self._parse_where(where_str) if where_str else None
-        join = {'table': join_table, 'on': join_on} if join_table else None
+        order_by = []
+        if self._accept('ORDER'):
+            self._expect('BY')
+            while True:
+                col = self._operand()
+                order_by.append((col, self._accept('ASC', 'DESC') == 'DESC'))
+                if not self._accept(','):
+                    break
+        limit = self._int() if self._accept('LIMIT') else None
+        offset = self._int() if self._accept('OFFSET') else 0
         
-        return SelectStmt(table_name, columns, where, history, join)
+        return SelectStmt(table_name, columns, where, history, joins, as_of, as_of_version,
+                          order_by, limit, offset, group_by, having)
     
-    def _parse_update(self, sql: str):
-        match = re.match(r'UPDATE (\w+) SET (.*?)(?: WHERE (.*))?$', sql, re.IGNORECASE)
-        if not match:
-            raise ValueError("Invalid UPDATE syntax")
-        
-        table_name = match.group(1)
-        set_str = match.group(2).strip()
-        where_str = match.group(3)
-        
+    def _select_items(self):
+        items = []
+        while True:
+            if self._peek()[0] == 'ident' and self._is('(', offset=1):
+                item = self._aggregate()
+                if self._accept('AS'):
+                    item.alias = self._ident()
+            else:
+                item = self._name()
+            items.append(item)
+            if not self._accept(','):
+                return items
+    
+    def _aggregate(self):
+        func = self._ident().upper()
+        if func not in AGGREGATE_FUNCS:
+            raise ValueError(f"Unknown function: {func}")
+        self._expect('(')
+        column = '*' if self._accept('*') else self._name()
+        self._expect(')')
+        if column == '*' and func != 'COUNT':
+            raise ValueError(f"{func}(*) is not allowed")
+        return Aggregate(func, column)
+    
+    def _operand(self):
+        # HAVING and ORDER BY refer to aggregates by their canonical FUNC(column) name
+        if self._peek()[0] == 'ident' and self._is('(', offset=1):
+            return self._aggregate().name
+        return self._name()
+    
+    def _parse_update(self):
+        table_name = self._ident()
+        self._expect('SET')
         set_clause = {}
-        for pair in set_str.split(','):
-            pair = pair.strip()
-            if '=' not in pair:
-                raise ValueError(f"Invalid SET clause: {pair}")
-            parts = pair.split('=', 1)
-            k = parts[0].strip()
-            v = parts[1].strip() if len(parts) > 1 else ''
-            set_clause[k] = self._parse_value(v)
-        
-        where = self._parse_where(where_str) if where_str else None
+        while True:
+            column = self._ident()
+            self._expect('=')
+            set_clause[column] = self._value()
+            if not self._accept(','):
+                break
+        where = self._parse_where() if self._accept('WHERE') else None
         return UpdateStmt(table_name, set_clause, where)
     
-    def _parse_delete(self, sql: str):
-        match = re.match(r'DELETE FROM (\w+)(?: WHERE (.*))?', sql, re.IGNORECASE)
-        if not match:
-            raise ValueError("Invalid DELETE syntax")
-        
-        table_name = match.group(1)
-        where_str = match.group(2)
-        where = self._parse_where(where_str) if where_str else None
-        
+    def _parse_delete(self):
+        self._expect('FROM')
+        table_name = self._ident()
+        where = self._parse_where() if self._accept('WHERE') else None
         return DeleteStmt(table_name, where)
     
-    def _parse_where(self, where_str: str):
-        match = re.match(r'(\w+)\s*=\s*(.+)', where_str.strip())
-        if match:
-            return {match.group(1): self._parse_value(match.group(2))}
-        return {}
-    
-    def _parse_value(self, val: str):
-        val = val.strip().strip("'\"")
-        if val.isdigit():
-            return int(val)
-        try:
-            return float(val)
-        except:
-            return val
+    def _parse_verify(self):
+        table_name = self._ident()
+        if self._accept('SINCE'):
+            return VerifyStmt(table_name, since=self._int())
+        if self._accept('ROW'):
+            return VerifyStmt(table_name, rid=self._int())
+        return VerifyStmt(table_name)
+    
+    def _parse_where(self):
+        # OR binds loosest, then AND, then NOT
+        items = [self._parse_and()]
+        while self._accept('OR'):
+            items.append(self._parse_and())
+        return items[0] if len(items) == 1 else Or(items)
+    
+    def _parse_and(self):
+        items = [self._parse_not()]
+        while self._accept('AND'):
+            items.append(self._parse_not())
+        return items[0] if len(items) == 1 else And(items)
+    
+    def _parse_not(self):
+        if self._accept('NOT'):
+            return Not(self._parse_not())
+        if self._accept('('):
+            expr = self._parse_where()
+            self._expect(')')
+            return expr
+        return self._parse_predicate()
+    
+    def _parse_predicate(self):
+        col = self._operand()
+        if self._accept('IS'):
+            negated = self._accept('NOT') is not None
+            self._expect('NULL')
+            return Not(IsNull(col)) if negated else IsNull(col)
+        
+        negated = self._accept('NOT') is not None
+        if self._accept('BETWEEN'):
+            low = self._value()
+            self._expect('AND')
+            expr = Between(col, low, self._value())
+        elif self._accept('IN'):
+            self._expect('(')
+            values = [self._value()]
+            while self._accept(','):
+                values.append(self._value())
+            self._expect(')')
+            expr = InList(col, values)
+        elif negated:
+            raise ValueError(f"Expected BETWEEN or IN {self._near()}")
+        else:
+            op = self._expect('=', '!=', '<>', '<', '>', '<=', '>=')
+            return Comparison(col, '!=' if op == '<>' else op, self._value())
+        return Not(expr) if negated else expr
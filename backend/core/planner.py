@@ -0,0 +1,155 @@
+from itertools import permutations
+from typing import Dict, List
+
+from .predicate import conjuncts, conjoin, referenced_columns, map_columns
+
+# Relative cost of the work a plan does per row, in units of one row read by a
+# sequential scan, as measured on the storage. An index scan sorts the row ids it finds
+# and fetches each row by id; a nested loop join pays for a whole lookup per outer row.
+# Rows a join reads are copied out of storage, and the rows it returns are new dicts
+SEQ_ROW_COST = 1.0
+INDEX_ROW_COST = 1.5
+INDEX_PROBE_COST = 20.0
+ROW_OUTPUT_COST = 2.0
+HASH_BUILD_COST = 0.2
+HASH_PROBE_COST = 0.1
+JOIN_ROW_COST = 0.3
+# Join orders are searched exhaustively up to this many tables; longer joins run as written
+MAX_REORDERED_TABLES = 6
+
+def seq_scan_cost(rows: int):
+    return rows * SEQ_ROW_COST
+
+def index_scan_cost(rows: float):
+    return rows * INDEX_ROW_COST
+
+class Planner:
+    def __init__(self, storage):
+        # Chooses how the tables of a join are read and combined, from the statistics
+        # the storage keeps per table: which table drives the join, the order the others
+        # are joined in, which side of each hash join is built, and where an index
+        # lookup per row beats reading a table whole
+        self.storage = storage
+    
+    def plan_joins(self, stmt, where, residual):
+        # `where` holds the base table's own terms and `residual` the rest. Terms on a
+        # single inner-joined table are pushed into its scan. Returns the driving table,
+        # the filter per table, the join steps and the terms left over
+        tables = [stmt.table_name] + [j['table'] for j in stmt.joins]
+        inner = {stmt.table_name} | {j['table'] for j in stmt.joins if j['type'] != 'LEFT'}
+        filters = {stmt.table_name: where} if where is not None else {}
+        left = []
+        for term in conjuncts(residual):
+            owners = {c.rpartition('.')[0] for c in referenced_columns(term)}
+            table = owners.pop() if len(owners) == 1 else None
+            if table in inner and table != stmt.table_name:
+                filters[table] = conjoin(conjuncts(filters.get(table)) +
+                                         [map_columns(term, lambda c: c.rpartition('.')[2])])
+            else:
+                left.append(term)
+        
+        scans = {t: self.storage.access_path(t, filters.get(t), stmt.history and t == stmt.table_name)
+                 for t in dict.fromkeys(tables)}
+        edges = self._edges(stmt, tables)
+        orders = [[stmt.table_name] + [j['table'] for j in stmt.joins]]
+        if edges is not None:
+            orders = [list(order) for order in permutations(tables) if self._connected(order, edges)]
+        best = None
+        for order in orders:
+            steps, cost = self._steps(stmt, order, edges, scans, filters)
+            if best is None or cost < best[2]:
+                best = (order, steps, cost)
+        order, steps, cost = best
+        return {'driver': order[0], 'filters': filters, 'steps': steps, 'residual': conjoin(left),
+                'reordered': order != tables, 'scans': scans}
+    
+    def _edges(self, stmt, tables: List[str]):
+        # The join conditions as (table, column, table, column), if the joins may run in
+        # any order: all inner, each condition naming both tables, and no condition
+        # beyond the one that links each table in
+        if (len(tables) > MAX_REORDERED_TABLES or len(set(tables)) < len(tables) or stmt.history
+                or stmt.as_of_version is not None or any(j['type'] == 'LEFT' for j in stmt.joins)):
+            return None
+        edges = []
+        for join in stmt.joins:
+            sides = [c.split('.') for c in join['on']]
+            if any(len(s) != 2 or s[0] not in tables for s in sides) or sides[0][0] == sides[1][0]:
+                return None
+            edges.append((sides[0][0], sides[0][1], sides[1][0], sides[1][1]))
+        linked = {stmt.table_name}
+        for a, _, b, _ in edges:
+            if (a in linked) == (b in linked):
+                return None
+            linked |= {a, b}
+        return edges
+    
+    def _connected(self, order, edges: List):
+        # Every table after the first joins one before it
+        return all(any({a, b} & set(order[:i]) and t in (a, b) for a, _, b, _ in edges)
+                   for i, t in enumerate(order) if i)
+    
+    def _steps(self, stmt, order: List[str], edges, scans: Dict, filters: Dict):
+        rows = scans[order[0]]['est_rows']
+        cost = scans[order[0]]['cost'] + rows * ROW_OUTPUT_COST
+        steps = []
+        for i, table in enumerate(order[1:], 1):
+            if edges is None:
+                join = stmt.joins[i - 1]
+                left_key, right_col = self._written_keys(join, order[:i])
+            else:
+                join = {'type': 'INNER'}
+                for a, ca, b, cb in edges:
+                    if table in (a, b) and {a, b} & set(order[:i]):
+                        left_key, right_col = (f"{a}.{ca}", cb) if b == table else (f"{b}.{cb}", ca)
+                        break
+            step = self._join_step(stmt, table, join['type'] == 'LEFT', left_key, right_col, rows,
+                                   scans[table], filters.get(table))
+            step.update(table=table, type=join['type'], left_key=left_key, right_col=right_col,
+                        filter=filters.get(table))
+            steps.append(step)
+            rows = step['est_rows']
+            cost += step['cost']
+        return steps, cost
+    
+    def _written_keys(self, join: Dict, joined: List[str]):
+        # The join as written; an unqualified column on the left is the base table's
+        table = join['table']
+        a, b = join['on']
+        if a.split('.')[0] == table and b.split('.')[0] in joined:
+            a, b = b, a
+        if '.' not in a:
+            a = f"{joined[0]}.{a}"
+        return a, b.split('.')[-1]
+    
+    def _join_step(self, stmt, table: str, left_outer: bool, left_key: str, right_col: str, left_rows: float,
+                   scan: Dict, where):
+        # Estimates a join's output and picks the cheapest way to compute it
+        storage = self.storage
+        right_rows = scan['est_rows']
+        left_table, _, left_col = left_key.rpartition('.')
+        left_distinct = min(self._distinct(left_table, left_col), max(left_rows, 1))
+        right_distinct = min(self._distinct(table, right_col), max(right_rows, 1))
+        out = left_rows * right_rows / max(left_distinct, right_distinct, 1)
+        if left_outer:
+            out = max(out, left_rows)
+        
+        read = scan['cost'] + right_rows * ROW_OUTPUT_COST
+        options = [(read + right_rows * HASH_BUILD_COST + left_rows * HASH_PROBE_COST, 'hash, build right',
+                    'hash_right')]
+        if not left_outer:
+            options.append((read + left_rows * HASH_BUILD_COST + right_rows * HASH_PROBE_COST, 'hash, build left',
+                            'hash_left'))
+        if stmt.as_of is None and storage.index.has_index(table, right_col) and not (
+                stmt.history and table == stmt.table_name):
+            # Each lookup reads every active row with the key before `where` filters them
+            per_key = storage.live_rows[table] / self._distinct(table, right_col)
+            options.append((left_rows * (INDEX_PROBE_COST + per_key * (INDEX_ROW_COST + ROW_OUTPUT_COST)),
+                            f"index nested loop on {table}.{right_col}", 'index'))
+        cost, strategy, method = min(options, key=lambda o: o[0])
+        return {'strategy': strategy, 'method': method, 'est_rows': out, 'cost': cost + out * JOIN_ROW_COST}
+    
+    def _distinct(self, table: str, column: str):
+        rows = self.storage.live_rows[table]
+        if self.storage.index.has_index(table, column) and self.storage.index.is_unique(table, column):
+            return max(rows, 1)
+        return self.storage.table_stats(table).distinct(column, rows)
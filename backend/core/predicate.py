@@ -0,0 +1,213 @@
+import operator
+from operator import methodcaller
+from dataclasses import replace
+from typing import Any, Callable, Dict, List
+
+from .parser import Comparison, Between, InList, IsNull, And, Or, Not, Range
+
+NUMERIC_TYPES = ('INT', 'INTEGER', 'BIGINT', 'SMALLINT', 'FLOAT', 'REAL', 'DOUBLE', 'DECIMAL', 'NUMERIC')
+TEXT_TYPES = ('TEXT', 'VARCHAR', 'CHAR', 'STRING')
+
+_OPS = {'=': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+        '>': operator.gt, '>=': operator.ge}
+_NEGATED = {'=': '!=', '!=': '=', '<': '>=', '<=': '>', '>': '<=', '>=': '<'}
+
+def _by_key(column: str):
+    return methodcaller('get', column)
+
+def compile_predicate(expr, types: Dict[str, str] = None,
+                      getter: Callable[[str], Callable] = None) -> Callable[[Dict], bool]:
+    # Turns a WHERE/HAVING expression into a closure over a row. Literals are coerced
+    # to their column's declared type once, here, so the per-row work is a dict lookup
+    # and a native comparison. NOT is pushed down to the leaves, where a NULL operand
+    # makes every comparison false, as SQL's unknown does in a filter. `getter` maps a
+    # column to the function reading it from a row, for rows that are not dicts
+    return _compile(expr, types or {}, getter or _by_key, False)
+
+def _compile(expr, types: Dict[str, str], getter: Callable[[str], Callable], negate: bool):
+    if isinstance(expr, Not):
+        return _compile(expr.item, types, getter, not negate)
+    if isinstance(expr, (And, Or)):
+        tests = [_compile(item, types, getter, negate) for item in expr.items]
+        if isinstance(expr, And) != negate:
+            def test(row):
+                for t in tests:
+                    if not t(row):
+                        return False
+                return True
+        else:
+            def test(row):
+                for t in tests:
+                    if t(row):
+                        return True
+                return False
+        return test
+    if isinstance(expr, Between):
+        bounds = [Comparison(expr.column, '>=', expr.low), Comparison(expr.column, '<=', expr.high)]
+        return _compile(And(bounds), types, getter, negate)
+    if isinstance(expr, IsNull):
+        get = getter(expr.column)
+        if negate:
+            return lambda row: get(row) is not None
+        return lambda row: get(row) is None
+    if isinstance(expr, InList):
+        return _compile_in(expr, types, getter, negate)
+    if isinstance(expr, Comparison):
+        return _compile_comparison(expr, types, getter, negate)
+    raise ValueError(f"Unsupported condition: {expr!r}")
+
+def _compile_comparison(expr: Comparison, types: Dict[str, str], getter: Callable[[str], Callable],
+                        negate: bool):
+    if expr.value is None:
+        # Comparing with NULL is never true
+        return lambda row: False
+    get = getter(expr.column)
+    value = coerce_literal(expr.value, expr.column, types)
+    op = _NEGATED[expr.op] if negate else expr.op
+    if op == '=':
+        return lambda row: get(row) == value
+    
+    compare = _OPS[op]
+    text = str(value)
+    def test(row):
+        v = get(row)
+        if v is None:
+            return False
+        try:
+            return compare(v, value)
+        except TypeError:
+            # A value stored with a different type than its column declares
+            return compare(str(v), text)
+    return test
+
+def _compile_in(expr: InList, types: Dict[str, str], getter: Callable[[str], Callable], negate: bool):
+    get = getter(expr.column)
+    values = {coerce_literal(v, expr.column, types) for v in expr.values if v is not None}
+    if not negate:
+        return lambda row: get(row) in values
+    if len(values) < len(expr.values):
+        # x NOT IN (..., NULL) is never true
+        return lambda row: False
+    def test(row):
+        v = get(row)
+        return v is not None and v not in values
+    return test
+
+def coerce_literal(value: Any, column: str, types: Dict[str, str]):
+    type_ = types.get(column)
+    if type_ is None or value is None or isinstance(value, bool):
+        return value
+    base = type_.split('(')[0].upper()
+    if base in NUMERIC_TYPES:
+        if isinstance(value, (int, float)):
+            return value
+        try:
+            return int(value)
+        except ValueError:
+            pass
+        try:
+            return float(value)
+        except ValueError:
+            raise ValueError(f"Invalid value {value!r} for {type_} column {column}")
+    if base in TEXT_TYPES:
+        return str(value)
+    return value
+
+def conjuncts(expr) -> List:
+    if expr is None:
+        return []
+    if isinstance(expr, And):
+        return [term for item in expr.items for term in conjuncts(item)]
+    return [expr]
+
+def conjoin(terms: List):
+    if not terms:
+        return None
+    return terms[0] if len(terms) == 1 else And(terms)
+
+def referenced_columns(expr) -> List[str]:
+    if expr is None:
+        return []
+    if isinstance(expr, (And, Or)):
+        return [c for item in expr.items for c in referenced_columns(item)]
+    if isinstance(expr, Not):
+        return referenced_columns(expr.item)
+    return [expr.column]
+
+def map_columns(expr, fn: Callable[[str], str]):
+    if isinstance(expr, (And, Or)):
+        return replace(expr, items=[map_columns(item, fn) for item in expr.items])
+    if isinstance(expr, Not):
+        return Not(map_columns(expr.item, fn))
+    return replace(expr, column=fn(expr.column))
+
+def index_terms(expr, types: Dict[str, str] = None) -> Dict[str, Any]:
+    # Top-level AND terms an index can answer, by column: an equality value, a Range
+    # or an InList. The full predicate is still applied to every row read
+    types = types or {}
+    terms = {}
+    for term in conjuncts(expr):
+        if isinstance(term, Comparison) and term.value is not None and term.op != '!=':
+            value = coerce_literal(term.value, term.column, types)
+            if term.op == '=':
+                terms[term.column] = value
+                continue
+            rng = terms.setdefault(term.column, Range())
+            if not isinstance(rng, Range):
+                continue
+            if term.op in ('>', '>=') and rng.low is None:
+                rng.low, rng.low_inclusive = value, term.op == '>='
+            elif term.op in ('<', '<=') and rng.high is None:
+                rng.high, rng.high_inclusive = value, term.op == '<='
+        elif isinstance(term, Between) and term.low is not None and term.high is not None:
+            terms.setdefault(term.column, Range(coerce_literal(term.low, term.column, types),
+                                                coerce_literal(term.high, term.column, types)))
+        elif isinstance(term, InList) and term.column not in terms:
+            terms[term.column] = InList(term.column, [coerce_literal(v, term.column, types)
+                                                      for v in term.values if v is not None])
+    return terms
+
+def term_expr(column: str, term):
+    # The condition an index_terms entry stands for
+    if isinstance(term, InList):
+        return term
+    if not isinstance(term, Range):
+        return Comparison(column, '=', term)
+    bounds = []
+    if term.low is not None:
+        bounds.append(Comparison(column, '>=' if term.low_inclusive else '>', term.low))
+    if term.high is not None:
+        bounds.append(Comparison(column, '<=' if term.high_inclusive else '<', term.high))
+    return conjoin(bounds)
+
+def format_expr(expr) -> str:
+    # SQL text of an expression, for EXPLAIN
+    if expr is None:
+        return None
+    if isinstance(expr, (And, Or)):
+        parts = []
+        for item in expr.items:
+            text = format_expr(item)
+            # AND binds tighter than OR, so only an OR inside an AND needs parentheses
+            parts.append(f"({text})" if isinstance(item, Or) and isinstance(expr, And) else text)
+        return (' AND ' if isinstance(expr, And) else ' OR ').join(parts)
+    if isinstance(expr, Not):
+        if isinstance(expr.item, IsNull):
+            return f"{expr.item.column} IS NOT NULL"
+        return f"NOT ({format_expr(expr.item)})"
+    if isinstance(expr, Between):
+        return f"{expr.column} BETWEEN {_literal(expr.low)} AND {_literal(expr.high)}"
+    if isinstance(expr, InList):
+        return f"{expr.column} IN ({', '.join(_literal(v) for v in expr.values)})"
+    if isinstance(expr, IsNull):
+        return f"{expr.column} IS NULL"
+    return f"{expr.column} {expr.op} {_literal(expr.value)}"
+
+def _literal(value: Any):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
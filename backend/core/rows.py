@@ -0,0 +1,121 @@
+from itertools import repeat
+from operator import methodcaller
+from typing import Dict, List
+
+# Marks a column the row has no value for, as opposed to a NULL value
+_MISSING = object()
+_tuple_getitem = tuple.__getitem__
+_tuple_contains = tuple.__contains__
+
+class Row(tuple):
+    # A stored row: its values in the table layout's column order, with a read-only
+    # mapping interface over them. Iteration and len() are the tuple's, so rows stay
+    # as cheap to scan as plain tuples; use keys()/items()/to_dict() for the mapping
+    __slots__ = ()
+    layout = None
+    
+    def get(self, key: str, default=None):
+        try:
+            value = _tuple_getitem(self, self.layout.positions[key])
+        except (KeyError, IndexError):
+            # Rows packed before a column was added to the layout are shorter
+            return default
+        return default if value is _MISSING else value
+    
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            return _tuple_getitem(self, key)
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+    
+    def __contains__(self, key: str):
+        return self.get(key, _MISSING) is not _MISSING
+    
+    def keys(self):
+        return [c for c, v in zip(self.layout.columns, tuple.__iter__(self)) if v is not _MISSING]
+    
+    def items(self):
+        return [(c, v) for c, v in zip(self.layout.columns, tuple.__iter__(self)) if v is not _MISSING]
+    
+    def to_dict(self):
+        if len(self) > self.layout.width and _tuple_contains(self, _MISSING):
+            return dict(self.items())
+        return dict(zip(self.layout.columns, tuple.__iter__(self)))
+    
+    def copy(self):
+        return self.to_dict()
+    
+    def __eq__(self, other):
+        if isinstance(other, (Row, dict)):
+            return self.to_dict() == (other.to_dict() if isinstance(other, Row) else other)
+        return NotImplemented
+    
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        return repr(self.to_dict())
+
+class RowLayout:
+    def __init__(self, columns: List[str]):
+        # Column order shared by every row of a table, so a row is one tuple of values
+        # instead of a dict repeating the column names
+        self.columns = []
+        self.positions = {}
+        self._last = ()
+        for column in columns:
+            self._add(column)
+        # Schema columns lead every packed row, so they are always present
+        self.width = len(self.columns)
+        self.row_type = type('Row', (Row,), {'__slots__': (), 'layout': self})
+    
+    def _add(self, column: str):
+        self.positions[column] = len(self.columns)
+        self.columns.append(column)
+    
+    def pack(self, row: Dict):
+        if isinstance(row, Row):
+            row = row.to_dict()
+        if not self.positions.keys() >= row.keys():
+            # A value for a column outside the schema, e.g. from a legacy row
+            for column in row.keys():
+                if column not in self.positions:
+                    self._add(column)
+        get = row.get
+        values = [get(c) for c in self.columns[:self.width]]
+        if len(self.columns) > self.width:
+            values += [get(c, _MISSING) for c in self.columns[self.width:]]
+        # Rows written together share values such as `_created_at`; reuse the previous
+        # row's objects for equal values so each is stored once
+        for i, (value, last) in enumerate(zip(values, self._last)):
+            if value is not last and type(value) is type(last) and value == last:
+                values[i] = last
+        packed = self._last = self.row_type(values)
+        return packed
+    
+    def accessor(self, column: str):
+        # Reads a column from this layout's packed rows, by position for schema columns
+        pos = self.positions.get(column)
+        if pos is not None and pos < self.width:
+            return lambda row: _tuple_getitem(row, pos)
+        return methodcaller('get', column)
+    
+    def column(self, rows: List, column: str):
+        # One column of a list of rows; packed rows are read by position in C
+        pos = self.positions.get(column)
+        if pos is not None:
+            try:
+                values = list(map(_tuple_getitem, rows, repeat(pos, len(rows))))
+            except (TypeError, IndexError):
+                # Dicts (e.g. history rows) or rows packed before the column existed
+                pass
+            else:
+                if _MISSING in values:
+                    values = [None if v is _MISSING else v for v in values]
+                return values
+        return [r.get(column) for r in rows]
@@ -0,0 +1,106 @@
+import json
+import os
+from typing import Dict, Iterator, List, Tuple
+
+class SegmentLog:
+    def __init__(self, path: str, max_bytes: int = 4 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._file = None
+        self.refresh()
+    
+    def refresh(self):
+        # Also picks up segments another process has rolled over to
+        self.segments = sorted(int(f.split('.')[0]) for f in os.listdir(self.path) if f.endswith('.seg'))
+    
+    def _segment_path(self, seq: int):
+        return os.path.join(self.path, f"{seq:06d}.seg")
+    
+    def _open_active(self):
+        if not self.segments:
+            self.segments.append(1)
+        path = self._segment_path(self.segments[-1])
+        self._repair_tail(path)
+        self._file = open(path, 'ab')
+    
+    def _repair_tail(self, path: str):
+        # A crash mid-append leaves a partial last line; drop it before appending
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+    
+    def _roll(self):
+        self._file.close()
+        self.segments.append(self.segments[-1] + 1)
+        self._file = open(self._segment_path(self.segments[-1]), 'ab')
+    
+    def append(self, record: Dict):
+        self.append_many([record])
+    
+    def append_many(self, records: List[Dict]):
+        self.append_lines([json.dumps(r, separators=(',', ':')) for r in records])
+    
+    def append_lines(self, lines: List[str]):
+        # Records already encoded as compact JSON, one per line; returns the position of
+        # the first one
+        if not lines:
+            return None
+        if self._file is None:
+            self._open_active()
+        start = (self.segments[-1], self._file.tell())
+        data = ''.join(line + '\n' for line in lines)
+        self._file.write(data.encode('utf-8'))
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._roll()
+        return start
+    
+    def end_position(self):
+        if not self.segments:
+            return (0, 0)
+        path = self._segment_path(self.segments[-1])
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        return (self.segments[-1], size)
+    
+    def replay(self, start=(0, 0), end=None) -> Iterator[Tuple[Tuple[int, int], Dict]]:
+        # Yields (position, record) where position is (segment, offset past the record)
+        for seq in list(self.segments):
+            if seq < start[0]:
+                continue
+            if end is not None and seq > end[0]:
+                return
+            path = self._segment_path(seq)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                offset = 0
+                if seq == start[0]:
+                    f.seek(start[1])
+                    offset = start[1]
+                for line in f:
+                    if not line.endswith(b'\n') or (end is not None and (seq, offset) >= end):
+                        break
+                    offset += len(line)
+                    yield (seq, offset), json.loads(line)
+    
+    def read_at(self, position: Tuple[int, int]):
+        # The encoded record that starts at position
+        if self._file is not None:
+            self._file.flush()
+        with open(self._segment_path(position[0]), 'rb') as f:
+            f.seek(position[1])
+            return f.readline().decode('utf-8').rstrip('\n')
+    
+    def sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,199 @@
+import bisect
+from collections import Counter
+from typing import Any, Dict, List
+
+from .index import _sort_key
+from .parser import Comparison, Between, InList, IsNull, And, Or, Not, Range
+from .predicate import coerce_literal
+
+# Values kept with their own frequency, and the number of buckets the rest are split into
+MOST_COMMON = 10
+HISTOGRAM_BUCKETS = 100
+# Selectivities assumed for a column without statistics
+DEFAULT_EQ_SELECTIVITY = 0.005
+DEFAULT_RANGE_SELECTIVITY = 1 / 3
+
+def _numeric(value: Any):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+class ColumnStats:
+    def __init__(self, null_frac: float = 0.0, distinct: float = 0.0, common: List = (), bounds: List = (),
+                 hist_frac: float = 0.0):
+        # The share of NULLs, an estimate of the distinct non-NULL values, the most
+        # common values with their share of rows, and an equal-depth histogram of the
+        # other values: bucket boundaries in sort order, covering `hist_frac` of rows
+        self.null_frac = null_frac
+        self.distinct = distinct
+        self.common = {value: frac for value, frac in common}
+        self.bounds = list(bounds)
+        self.hist_frac = hist_frac
+        self._keys = [_sort_key(b) for b in self.bounds]
+    
+    @classmethod
+    def from_values(cls, values: List, total: int):
+        # `values` are a sample of a column of `total` rows
+        n = len(values)
+        present = [v for v in values if v is not None]
+        if not present:
+            return cls(1.0 if n else 0.0)
+        counts = Counter(present)
+        seen = len(counts)
+        once = sum(1 for c in counts.values() if c == 1)
+        if n >= total or once == n:
+            # Every row was read, or no value repeats: assume every value is distinct
+            distinct = seen if n >= total else total * len(present) / n
+        else:
+            # Haas and Stokes' estimator, from how many values the sample saw only once
+            distinct = n * seen / (n - once + once * n / total)
+        distinct = min(max(distinct, seen), total * len(present) / n)
+        # Values well above the average frequency are kept exactly; with few distinct
+        # values that is all of them
+        average = len(present) / seen
+        common = [(v, c / n) for v, c in counts.most_common(MOST_COMMON)
+                  if seen <= MOST_COMMON or c > 1 and c > 1.25 * average]
+        kept = {v for v, _ in common}
+        rest = sorted((v for v in present if v not in kept), key=_sort_key)
+        bounds = []
+        if rest:
+            buckets = min(HISTOGRAM_BUCKETS, len(rest) - 1) or 1
+            bounds = [rest[i * (len(rest) - 1) // buckets] for i in range(buckets + 1)]
+        return cls((n - len(present)) / n, distinct, common, bounds, len(rest) / n)
+    
+    def eq(self, value: Any):
+        if value is None:
+            return 0.0
+        if value in self.common:
+            return self.common[value]
+        if not self.bounds or not self._keys[0] <= _sort_key(value) <= self._keys[-1]:
+            return 0.0
+        return self.hist_frac / max(self.distinct - len(self.common), 1)
+    
+    def range(self, rng: Range):
+        def inside(value):
+            key = _sort_key(value)
+            if rng.low is not None:
+                low = _sort_key(rng.low)
+                if key < low or key == low and not rng.low_inclusive:
+                    return False
+            if rng.high is not None:
+                high = _sort_key(rng.high)
+                if key > high or key == high and not rng.high_inclusive:
+                    return False
+            return True
+        frac = sum(f for v, f in self.common.items() if inside(v))
+        upper = 1.0 if rng.high is None else self._below(rng.high, rng.high_inclusive)
+        lower = 0.0 if rng.low is None else self._below(rng.low, not rng.low_inclusive)
+        return frac + self.hist_frac * max(upper - lower, 0.0)
+    
+    def _below(self, value: Any, inclusive: bool):
+        # Share of histogram values below `value`, or at most it, interpolating within
+        # a bucket when its boundaries are numbers
+        if not self._keys:
+            return 0.0
+        key = _sort_key(value)
+        i = (bisect.bisect_right if inclusive else bisect.bisect_left)(self._keys, key)
+        if i == 0:
+            return 0.0
+        if i == len(self._keys):
+            return 1.0
+        low, high = self.bounds[i - 1], self.bounds[i]
+        within = 0.5
+        if _numeric(low) and _numeric(high) and _numeric(value) and high > low:
+            within = min(max((value - low) / (high - low), 0.0), 1.0)
+        return (i - 1 + within) / (len(self._keys) - 1)
+    
+    def to_dict(self):
+        return {'null_frac': self.null_frac, 'distinct': self.distinct, 'common': [list(c) for c in self.common.items()],
+                'bounds': self.bounds, 'hist_frac': self.hist_frac}
+
+class TableStats:
+    def __init__(self, active: int, versions: int, records: int, columns: Dict[str, ColumnStats]):
+        # What ANALYZE found in a table: its active rows and stored versions, the log
+        # records it had been written with (to tell how much has changed since), and
+        # statistics per column over a sample of the active rows
+        self.active = active
+        self.versions = versions
+        self.records = records
+        self.columns = columns
+    
+    @classmethod
+    def from_rows(cls, layout, columns: List[str], rows: List, active: int, versions: int, records: int):
+        total = max(active, len(rows))
+        return cls(active, versions, records,
+                   {c: ColumnStats.from_values(layout.column(rows, c), total) for c in columns})
+    
+    @classmethod
+    def from_dict(cls, data: Dict):
+        return cls(data['active'], data['versions'], data['records'],
+                   {c: ColumnStats(**s) for c, s in data['columns'].items()})
+    
+    def to_dict(self):
+        return {'active': self.active, 'versions': self.versions, 'records': self.records,
+                'columns': {c: s.to_dict() for c, s in self.columns.items()}}
+    
+    def distinct(self, column: str, rows: int):
+        # Distinct values among `rows` active rows; a column that was nearly unique is
+        # assumed to stay so as the table grows
+        stats = self.columns.get(column)
+        if stats is None or not stats.distinct:
+            return max(rows, 1)
+        distinct = stats.distinct
+        if self.active and distinct >= 0.9 * self.active * (1 - stats.null_frac):
+            distinct *= rows / self.active
+        return max(min(distinct, rows), 1)
+    
+    def selectivity(self, expr, types: Dict[str, str] = None):
+        # Estimated share of active rows matching a WHERE expression; AND terms are
+        # taken to be independent
+        types = types or {}
+        if expr is None:
+            return 1.0
+        if isinstance(expr, And):
+            frac = 1.0
+            for item in expr.items:
+                frac *= self.selectivity(item, types)
+            return frac
+        if isinstance(expr, Or):
+            miss = 1.0
+            for item in expr.items:
+                miss *= 1.0 - self.selectivity(item, types)
+            return 1.0 - miss
+        if isinstance(expr, Not):
+            # NULLs match neither a condition nor its negation
+            item = expr.item
+            nulls = self._null_frac(item.column) if isinstance(item, (Comparison, Between, InList)) else 0.0
+            return min(max(1.0 - self.selectivity(item, types) - nulls, 0.0), 1.0)
+        stats = self.columns.get(expr.column)
+        if isinstance(expr, IsNull):
+            return self._null_frac(expr.column)
+        try:
+            if isinstance(expr, InList):
+                values = {coerce_literal(v, expr.column, types) for v in expr.values if v is not None}
+                if stats is None:
+                    return min(DEFAULT_EQ_SELECTIVITY * len(values), 1.0)
+                return min(sum(stats.eq(v) for v in values), 1.0)
+            if isinstance(expr, Between):
+                rng = Range(coerce_literal(expr.low, expr.column, types), coerce_literal(expr.high, expr.column, types))
+                if rng.low is None or rng.high is None:
+                    return 0.0
+                return DEFAULT_RANGE_SELECTIVITY if stats is None else stats.range(rng)
+            if isinstance(expr, Comparison):
+                if expr.value is None:
+                    return 0.0
+                value = coerce_literal(expr.value, expr.column, types)
+                if expr.op in ('=', '!='):
+                    eq = DEFAULT_EQ_SELECTIVITY if stats is None else stats.eq(value)
+                    return eq if expr.op == '=' else max(1.0 - eq - self._null_frac(expr.column), 0.0)
+                if stats is None:
+                    return DEFAULT_RANGE_SELECTIVITY
+                if expr.op in ('>', '>='):
+                    return stats.range(Range(low=value, low_inclusive=expr.op == '>='))
+                return stats.range(Range(high=value, high_inclusive=expr.op == '<='))
+        except ValueError:
+            # A literal that does not fit its column; the query itself will say so
+            pass
+        return DEFAULT_RANGE_SELECTIVITY
+    
+    def _null_frac(self, column: str):
+        stats = self.columns.get(column)
+        return stats.null_frac if stats is not None else 0.0
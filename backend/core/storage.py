@@ -1,30 +1,151 @@
+import bisect
+import heapq
 import json
 import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
+from operator import itemgetter
 from typing import List, Dict, Any
 
+from .segment import SegmentLog
+from .checkpoint import CheckpointStore
+from .history import HistoryStore
+from .rows import Row, RowLayout
+from .merkle import MerkleLog, ZERO_HASH, chain_hash, verify_inclusion
+from .wal import WriteAheadLog, CommitMarker
+from .index import Index
+from .metrics import Metrics
+from .stats import TableStats
+from .planner import seq_scan_cost, index_scan_cost
+from .parser import SQLParser, Range, InList
+from .predicate import compile_predicate, coerce_literal, index_terms, term_expr, format_expr
+from .views import MaterializedView
+
+# One (timestamp, log position) sample is kept per this many records
+TIME_INDEX_STRIDE = 256
+# A Merkle root checkpoint is recorded after about this many records
+MERKLE_CHECKPOINT_EVERY = 1024
+# ANALYZE reads about this many active rows of a table, and statistics are gathered
+# again once more than ANALYZE_THRESHOLD records plus ANALYZE_SCALE of the active rows
+# have been written since
+ANALYZE_SAMPLE_ROWS = 30000
+ANALYZE_THRESHOLD = 50
+ANALYZE_SCALE = 0.1
+
 class LedgerStorage:
-    def __init__(self, data_dir='data'):
+    def __init__(self, data_dir='data', segment_size=4 * 1024 * 1024, snapshot_every=1000,
+                 checkpoint_every=5000, wal_limit=16 * 1024 * 1024, sync=True, read_only=False):
         self.data_dir = data_dir
+        self.segment_size = segment_size
+        self.snapshot_every = snapshot_every
+        self.checkpoint_every = checkpoint_every
+        self.wal_limit = wal_limit
         os.makedirs(data_dir, exist_ok=True)
         self.schemas = {}
+        self.index = Index()
+        self.logs = {}
+        # rid -> Row per table, packed by the table's RowLayout
+        self.tables = {}
+        self.layouts = {}
+        self.next_rid = {}
+        self.unsnapshotted = {}
+        # Per-key version chains for ledger tables: key -> [latest version, head rid, active rid]
+        self.chains = {}
+        self.prev_version = {}
+        self.checkpoints = {}
+        self.history = {}
+        self.uncheckpointed = {}
+        self.record_count = {}
+        self.time_index = {}
+        self.merkle = {}
+        # Active rows per table, kept as records are applied, and the statistics the
+        # planner estimates row counts from
+        self.live_rows = {}
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        # Materialized views kept over each table, and their parsed definitions
+        self.views = {}
+        self.view_defs = {}
+        # Every record gets a global log sequence number; tables remember the last one applied
+        self.wal = WriteAheadLog(os.path.join(data_dir, "wal.log"), sync)
+        self.next_lsn = 1
+        self.table_lsn = {}
+        self.pending = []
+        # What each pending record replaced in memory, so a rollback can put it back
+        self.undo = []
+        self.in_transaction = False
+        # MVCC: rid -> [created lsn, ended lsn] per table; readers see the versions
+        # committed as of their snapshot while the single writer moves ahead
+        self.row_lsn = {}
+        self.superseded = {}
+        self.garbage = deque()
+        self.committed_lsn = 0
+        # Bumped per table after each commit that touches it; result caches compare them
+        self.generations = {}
+        self.readers = {}
+        self.readers_cond = threading.Condition()
+        self.writer_ident = None
+        self.grouping = False
+        self.loading = set()
+        self.load_lock = threading.RLock()
+        self._local = threading.local()
+        self.metrics = Metrics()
+        # A read-only replica shares the data directory with a primary in another process
+        # and follows its commits: it never writes, and reads each table's log only up to
+        # the LSN the primary publishes once a commit's records are all in the segments
+        self.read_only = read_only
+        self.marker = CommitMarker(os.path.join(data_dir, "commit.lsn"))
+        self.published_lsn = None
+        self.tail_positions = {}
+        self.schemas_mtime = None
+        self.caught_up_at = time.monotonic()
+    
+    def _table_dir(self, table_name: str):
+        return os.path.join(self.data_dir, table_name)
     
-    def _table_path(self, table_name: str):
+    def _legacy_path(self, table_name: str):
+        # Pre-segment format: one JSON array per table, rewritten on every write
         return os.path.join(self.data_dir, f"{table_name}.json")
     
     def _schema_path(self):
         return os.path.join(self.data_dir, "schemas.json")
     
+    def _stats_path(self, table_name: str):
+        return os.path.join(self._table_dir(table_name), "stats.json")
+    
+    def _snapshot_path(self, table_name: str):
+        return os.path.join(self._table_dir(table_name), "snapshot.json")
+    
     def load_schemas(self):
+        if self.read_only:
+            self.catch_up()
+            return
         if os.path.exists(self._schema_path()):
             with open(self._schema_path(), 'r') as f:
                 self.schemas = json.load(f)
+        self.views = {}
+        for table_name, schema in self.schemas.items():
+            if 'view' in schema:
+                self.views.setdefault(schema['view']['source'], []).append(table_name)
+        for table_name in self.schemas:
+            self._table(table_name)
+        self._recover()
+        self.committed_lsn = self.next_lsn - 1
+        self.marker.publish(self.committed_lsn)
     
     def save_schemas(self):
         with open(self._schema_path(), 'w') as f:
             json.dump(self.schemas, f, indent=2)
     
     def create_table(self, table_name: str, columns: List[Dict], is_ledger: bool):
+        self._check_writable()
+        if self.in_transaction:
+            raise ValueError("CREATE is not allowed inside a transaction")
         if table_name in self.schemas:
             raise ValueError(f"Table {table_name} already exists")
         
@@ -33,105 +154,1440 @@ class LedgerStorage:
             'is_ledger': is_ledger
         }
         self.save_schemas()
-        
-        with open(self._table_path(table_name), 'w') as f:
-            json.dump([], f)
+        self._table(table_name)
     
-    def insert_row(self, table_name: str, row: Dict):
-        rows = self._read_table(table_name)
+    def create_view(self, view_name: str, query):
+        # A view is stored as a table of its groups, one row each with the state needed
+        # to fold changes into it in hidden columns. A single grouping column is its
+        # primary key; several are each indexed
+        self._check_writable()
+        if self.in_transaction:
+            raise ValueError("CREATE is not allowed inside a transaction")
+        if view_name in self.schemas:
+            raise ValueError(f"Table {view_name} already exists")
+        source = query.table_name
+        self._table(source)
+        if 'view' in self.schemas[source]:
+            raise ValueError(f"{source} is a materialized view; views can only read tables")
+        types = self._source_types(source)
+        view = MaterializedView(view_name, query, types)
+        columns, hidden = view.schema(types)
         
+        self.schemas[view_name] = {
+            'columns': columns,
+            'is_ledger': False,
+            'view': {'source': source, 'query': view.query, 'hidden': hidden}
+        }
+        if len(view.group_by) > 1:
+            self.schemas[view_name]['indexes'] = [{'name': f"{view_name}_{c}_idx", 'column': c, 'using': 'HASH'}
+                                                  for c in view.group_by]
+        self.view_defs[view_name] = view
+        self._table(view_name)
+        try:
+            records = self._maintain(view_name, [(None, row) for row in self._visible_rows(source)])
+        except Exception:
+            # Nothing of the view is kept until it has been filled
+            del self.schemas[view_name]
+            del self.view_defs[view_name]
+            self._unload(view_name)
+            raise
+        if not view.group_by and not records:
+            # An aggregate over no rows is still one row
+            records = [self._new_row_record(view_name, view.apply(None, (), [])[0])]
+        self.save_schemas()
+        self.views.setdefault(source, []).append(view_name)
+        self._stage(view_name, records)
+        self._commit()
+    
+    def _view(self, view_name: str):
+        view = self.view_defs.get(view_name)
+        if view is None:
+            definition = self.schemas[view_name]['view']
+            view = MaterializedView(view_name, SQLParser().parse(definition['query']),
+                                    self._source_types(definition['source']))
+            self.view_defs[view_name] = view
+        return view
+    
+    def _source_types(self, table_name: str):
+        types = self.column_types(table_name)
         if self.schemas[table_name]['is_ledger']:
-            row['_version'] = len([r for r in rows if self._match_pk(r, row)]) + 1
-            row['_created_at'] = datetime.now().isoformat()
-            row['_is_active'] = True
+            types.update(_version='INT', _created_at='TEXT')
+        return types
+    
+    def _check_not_view(self, table_name: str):
+        if 'view' in self.schemas[table_name]:
+            raise ValueError(f"{table_name} is a materialized view; write to {self.schemas[table_name]['view']['source']}")
+    
+    def create_index(self, table_name: str, column: str, method: str = 'HASH', index_name: str = None):
+        self._check_writable()
+        if self.in_transaction:
+            raise ValueError("CREATE is not allowed inside a transaction")
+        if table_name not in self.schemas:
+            raise ValueError(f"Table {table_name} does not exist")
+        schema = self.schemas[table_name]
+        columns = [c['name'] for c in schema['columns']]
+        if schema['is_ledger']:
+            columns += ['_version', '_created_at']
+        if column not in columns:
+            raise ValueError(f"Column {column} does not exist in {table_name}")
+        if self.index.has_index(table_name, column):
+            raise ValueError(f"Index on {table_name}.{column} already exists")
         
-        rows.append(row)
-        self._write_table(table_name, rows)
+        rows = self._table(table_name)
+        self.index.create_index(table_name, column, ordered=method == 'BTREE')
+        for rid, row in list(rows.items()):
+            if self._is_live(table_name, rid):
+                self._reindex(table_name, rid, row, [column])
+        
+        schema.setdefault('indexes', []).append({
+            'name': index_name or f"{table_name}_{column}_idx",
+            'column': column,
+            'using': method
+        })
+        self.save_schemas()
+        self.save_snapshot(table_name)
     
-    def update_rows(self, table_name: str, set_clause: Dict, where: Dict):
-        rows = self._read_table(table_name)
+    def insert_row(self, table_name: str, row: Dict):
+        self.insert_rows(table_name, [row])
+    
+    def insert_rows(self, table_name: str, rows: List[Dict]):
+        # The whole batch is checked before anything is logged, then appended at once
+        self._table(table_name)
+        self._check_not_view(table_name)
+        rows = [self._coerce_row(table_name, row) for row in rows]
         is_ledger = self.schemas[table_name]['is_ledger']
-        updated = False
-        new_rows = []
+        seen = {c: set() for c in self.index.table_columns(table_name) if self.index.is_unique(table_name, c)}
+        for row in rows:
+            self._check_primary_key(table_name, row, partial=False)
+            self._check_unique(table_name, row)
+            for column, values in seen.items():
+                # Any number of rows may leave a unique column NULL
+                value = row.get(column)
+                if value is None:
+                    continue
+                if value in values:
+                    raise ValueError(f"Constraint violation on {column}")
+                values.add(value)
         
+        now = datetime.now().isoformat()
+        records = []
         for row in rows:
-            if self._match_where(row, where) and row.get('_is_active', True):
-                updated = True
+            record = self._new_row_record(table_name, row)
+            if is_ledger:
+                self._link_version(table_name, record)
+                row['_created_at'] = now
+                row['_is_active'] = True
+            records.append(record)
+        
+        self._append(table_name, records)
+    
+    def update_rows(self, table_name: str, set_clause: Dict, where=None):
+        rows = self._table(table_name)
+        self._check_not_view(table_name)
+        set_clause = self._coerce_row(table_name, set_clause)
+        self._check_primary_key(table_name, set_clause, partial=True)
+        is_ledger = self.schemas[table_name]['is_ledger']
+        match = self.compile_where(table_name, where, packed=True)
+        records = []
+        claimed = {}
+        
+        for rid in self._candidates(table_name, where):
+            row = rows.get(rid)
+            if self._is_live(table_name, rid) and (match is None or match(row)):
+                self._check_unique(table_name, set_clause, rid, claimed)
                 if is_ledger:
-                    # Mark old row as inactive
-                    row['_is_active'] = False
-                    new_rows.append(row)
-                    # Create new version
+                    # Tombstone the old version and append the new one
+                    now = datetime.now().isoformat()
+                    records.append({'op': 'deact', 'rid': rid, 'at': now})
                     new_row = row.copy()
                     new_row.update(set_clause)
-                    new_row['_version'] = row.get('_version', 1) + 1
-                    new_row['_created_at'] = datetime.now().isoformat()
+                    record = self._new_row_record(table_name, new_row)
+                    self._link_version(table_name, record)
+                    new_row['_created_at'] = now
                     new_row['_is_active'] = True
-                    new_rows.append(new_row)
+                    records.append(record)
                 else:
-                    row.update(set_clause)
-                    new_rows.append(row)
-            else:
-                new_rows.append(row)
+                    new_row = row.copy()
+                    new_row.update(set_clause)
+                    records.append({'op': 'upd', 'rid': rid, 'row': new_row})
         
-        self._write_table(table_name, new_rows)
-        return updated
+        self._append(table_name, records)
+        return bool(records)
     
-    def delete_rows(self, table_name: str, where: Dict):
-        rows = self._read_table(table_name)
+    def delete_rows(self, table_name: str, where=None):
+        rows = self._table(table_name)
+        self._check_not_view(table_name)
         is_ledger = self.schemas[table_name]['is_ledger']
+        match = self.compile_where(table_name, where, packed=True)
+        records = []
+        
+        for rid in self._candidates(table_name, where):
+            row = rows.get(rid)
+            if self._is_live(table_name, rid) and (match is None or match(row)):
+                if is_ledger:
+                    records.append({'op': 'deact', 'rid': rid, 'at': datetime.now().isoformat()})
+                else:
+                    records.append({'op': 'del', 'rid': rid})
         
-        if is_ledger:
+        self._append(table_name, records)
+    
+    def _coerce_row(self, table_name: str, row: Dict):
+        # Written values take their column's type, as literals in a WHERE do, so '7' and 7
+        # are one key; a value that does not convert is rejected
+        types = self.column_types(table_name)
+        return {c: coerce_literal(v, c, types) for c, v in row.items()}
+    
+    def select_rows(self, table_name: str, where=None, history: bool = False):
+        return list(self.iter_rows(table_name, where, history))
+    
+    def iter_rows(self, table_name: str, where=None, history: bool = False, order_by: str = None,
+                  descending: bool = False, partition: tuple = None):
+        # Rows are produced lazily; `order_by` walks an ordered index instead of sorting
+        rows = self._visible_rows(table_name, where, history, order_by, descending, partition)
+        if 'view' in self.schemas[table_name]:
+            # A view's rows end with the hidden columns of its group state
+            columns = self.layouts[table_name].columns[:len(self.schemas[table_name]['columns'])]
             for row in rows:
-                if self._match_where(row, where) and row.get('_is_active', True):
-                    row['_is_active'] = False
+                yield dict(zip(columns, row))
+            return
+        for row in rows:
+            yield row.to_dict() if isinstance(row, Row) else dict(row)
+    
+    def iter_batches(self, table_name: str, columns: List[str], where=None, history: bool = False,
+                     size: int = 4096, partition: tuple = None):
+        # Column-at-a-time reads for aggregation: yields (row count, {column: values})
+        # without copying rows
+        rows = self._visible_rows(table_name, where, history, partition=partition)
+        while True:
+            batch = list(islice(rows, size))
+            if not batch:
+                return
+            layout = self.layouts[table_name]
+            yield len(batch), {c: layout.column(batch, c) for c in columns}
+    
+    def _visible_rows(self, table_name: str, where=None, history: bool = False, order_by: str = None,
+                      descending: bool = False, partition: tuple = None):
+        table = self._table(table_name)
+        is_ledger = self.schemas[table_name]['is_ledger']
+        # Compacted versions are only ever read by HISTORY queries
+        cold = self.history[table_name] if is_ledger and history else None
+        
+        snapshot = getattr(self._local, 'snapshot', None)
+        match = self.compile_where(table_name, where, packed=True)
+        is_active = self.layouts[table_name].accessor('_is_active')
+        # Compacted versions come back as dicts
+        cold_match = self.compile_where(table_name, where) if cold is not None else None
+        
+        # Indexes only cover active rows; history for a single key walks its version chain.
+        # A partition is a range of row ids, read whole by one worker of a parallel scan.
+        # Whole scans read compacted versions in one pass over the history segments,
+        # merged with the hot row ids as (rid, compacted row or None)
+        cold_rows = None
+        if partition is not None:
+            rids = range(*partition)
+            if cold is not None:
+                cold_rows = cold.scan(*partition)
+        elif order_by is not None:
+            if history or not self.index.is_ordered(table_name, order_by):
+                raise ValueError(f"No ordered index on {table_name}.{order_by}")
+            rids = self.index.ordered_rids(table_name, order_by, descending)
+        elif is_ledger and history:
+            rids = self._chain_lookup(table_name, where)
         else:
-            rows = [r for r in rows if not self._match_where(r, where)]
+            rids = self._index_lookup(table_name, where)
+        if rids is None:
+            rids = list(table)
+            if cold:
+                cold_rows = cold.scan()
+        if cold_rows is not None:
+            rids = self._merge_cold(rids, cold_rows)
         
-        self._write_table(table_name, rows)
+        for rid in rids:
+            if order_by is not None:
+                value, rid = rid
+            elif cold_rows is not None:
+                rid, row = rid
+            version = self._row_at(table_name, rid, snapshot)
+            if version is None and cold is not None:
+                if cold_rows is None:
+                    row = cold.get(rid)
+                if row is not None and (cold_match is None or cold_match(row)):
+                    yield row if row.get('_is_active') is False else dict(row, _is_active=False)
+                continue
+            if version is None:
+                continue
+            row, active = version
+            if not active and not (is_ledger and history):
+                continue
+            if order_by is not None and row.get(order_by) != value:
+                continue
+            if match is not None and not match(row):
+                continue
+            if is_ledger and is_active(row) != active:
+                row = dict(row, _is_active=active)
+            yield row
     
-    def select_rows(self, table_name: str, where: Dict = None, history: bool = False):
-        rows = self._read_table(table_name)
-        is_ledger = self.schemas[table_name]['is_ledger']
+    def partitions(self, table_name: str, where=None, count: int = 1):
+        # Splits a table into `count` row id ranges for a parallel scan. Ledger rows are
+        # numbered in `_created_at` order, so a range lies between the creation times of
+        # its first row and the next range's; ranges outside a `_created_at` bound in
+        # `where` are pruned. Returns the ranges left and how many were pruned
+        self._table(table_name)
+        end = self.next_rid[table_name]
+        step = max(1, -(-(end - 1) // count))
+        ranges = [(lo, min(lo + step, end)) for lo in range(1, end, step)]
+        bound = None
+        if self.schemas[table_name]['is_ledger']:
+            bound = index_terms(where, self.column_types(table_name)).get('_created_at')
+        if isinstance(bound, InList):
+            bound = Range(min(bound.values), max(bound.values)) if bound.values else None
+        elif bound is not None and not isinstance(bound, Range):
+            bound = Range(bound, bound)
+        if bound is None:
+            return ranges, 0
+        
+        firsts = [self._first_created_at(table_name, lo, hi) for lo, hi in ranges] + [None]
+        kept = []
+        for rids, first, following in zip(ranges, firsts, firsts[1:]):
+            try:
+                if bound.low is not None and following is not None and (
+                        following < bound.low or following == bound.low and not bound.low_inclusive):
+                    continue
+                if bound.high is not None and first is not None and (
+                        first > bound.high or first == bound.high and not bound.high_inclusive):
+                    continue
+            except TypeError:
+                pass
+            kept.append(rids)
+        return kept, len(ranges) - len(kept)
+    
+    def _first_created_at(self, table_name: str, lo: int, hi: int):
+        # Creation time of the first row found near the start of a range, compacted or not
+        rows = self.tables[table_name]
+        cold = self.history.get(table_name)
+        for rid in range(lo, min(hi, lo + 64)):
+            row = rows.get(rid)
+            if row is None and cold is not None:
+                row = cold.get(rid)
+            if row is not None:
+                return row.get('_created_at')
+        return None
+    
+    def scan_locks(self, table_name: str):
+        # Locks a scan of the table can take, held by a parallel scan while it forks so
+        # no worker starts with one taken by another thread
+        return [self.history[table_name].lock] if table_name in self.history else []
+    
+    def _merge_cold(self, rids, cold_rows):
+        # Hot row ids and compacted (rid, row) pairs in rid order, one pair per rid; a
+        # row compacted mid-scan can show up in both
+        last = None
+        for rid, row in heapq.merge(((rid, None) for rid in rids), cold_rows, key=itemgetter(0)):
+            if last is not None and last[0] == rid:
+                if row is not None:
+                    last = (rid, row)
+                continue
+            if last is not None:
+                yield last
+            last = (rid, row)
+        if last is not None:
+            yield last
+    
+    def _row_at(self, table_name: str, rid: int, snapshot: int = None):
+        # The writer publishes a version's LSNs before the row itself, so a reader that
+        # sees new LSNs next to the old row is sent to the superseded versions instead.
+        # A rollback goes the other way, row first, then LSNs, then superseded versions:
+        # a reader that raced it reads the row again
+        rows = self.tables[table_name]
+        row = rows.get(rid)
+        lsns = self.row_lsn[table_name].get(rid)
+        if row is None or lsns is None:
+            return None
+        created, ended = lsns
+        if snapshot is None:
+            return row, ended is None
+        if created > snapshot:
+            for old_created, old_ended, old_row in self.superseded[table_name].get(rid, ()):
+                if old_created <= snapshot < old_ended:
+                    return old_row, True
+            if self.row_lsn[table_name].get(rid) is not lsns:
+                return self._row_at(table_name, rid, snapshot)
+            return None
+        if rows.get(rid) is not row:
+            return self._row_at(table_name, rid, snapshot)
+        return row, ended is None or ended > snapshot
+    
+    def _is_live(self, table_name: str, rid: int):
+        lsns = self.row_lsn[table_name].get(rid)
+        return lsns is not None and lsns[1] is None
+    
+    @contextmanager
+    def snapshot(self):
+        # Pin the last committed LSN for the duration of a read; the writer thread
+        # (and a session inside its own transaction) reads the latest state instead
+        if self.writer_ident == threading.get_ident():
+            yield None
+            return
+        with self.readers_cond:
+            lsn = self.committed_lsn
+            self.readers[lsn] = self.readers.get(lsn, 0) + 1
+        self._local.snapshot = lsn
+        try:
+            yield lsn
+        finally:
+            self._local.snapshot = None
+            with self.readers_cond:
+                self.readers[lsn] -= 1
+                if not self.readers[lsn]:
+                    del self.readers[lsn]
+    
+    @contextmanager
+    def write_group(self):
+        # Autocommit writes made inside the group share one WAL commit at the end
+        self.writer_ident = threading.get_ident()
+        self.grouping = True
+        try:
+            yield
+        finally:
+            self.grouping = False
+            try:
+                if self.in_transaction:
+                    self.rollback()
+                self._commit()
+            finally:
+                self.writer_ident = None
+    
+    def select_as_of(self, table_name: str, timestamp: str, where=None):
+        self._table(table_name)
+        if not self.schemas[table_name]['is_ledger']:
+            raise ValueError("AS OF requires a LEDGER table")
+        try:
+            at = datetime.fromisoformat(timestamp).isoformat()
+        except ValueError:
+            raise ValueError(f"Invalid AS OF timestamp: {timestamp}")
         
-        if is_ledger and not history:
-            rows = [r for r in rows if r.get('_is_active', True)]
+        # Start from the newest checkpoint taken before `at` and replay up to the
+        # first sampled log position known to be later than `at`
+        checkpoint = self.checkpoints[table_name].latest_before(at)
+        state = self.checkpoints[table_name].load(checkpoint) if checkpoint else {}
+        start = tuple(checkpoint['position']) if checkpoint else (0, 0)
+        times, positions = self.time_index[table_name]
+        pos = bisect.bisect_right(times, at)
+        end = positions[pos] if pos < len(positions) else self.tail_positions.get(table_name)
         
-        if where:
-            rows = [r for r in rows if self._match_where(r, where)]
+        for _, record in self._log(table_name).replay(start, end):
+            record_at = self._record_time(record)
+            if record_at is None or record_at > at:
+                continue
+            if record['op'] == 'ins':
+                state.pop(record.get('prev'), None)
+                state[record['rid']] = dict(record['row'], _is_active=True)
+            elif record['op'] == 'deact':
+                state.pop(record['rid'], None)
         
+        rows = [state[rid] for rid in sorted(state)]
+        match = self.compile_where(table_name, where)
+        if match is not None:
+            rows = [r for r in rows if match(r)]
         return rows
     
-    def _read_table(self, table_name: str):
-        if not os.path.exists(self._table_path(table_name)):
+    def select_version(self, table_name: str, version: int, where=None):
+        # Version n of each key, found by walking the key's chain back from its newest
+        # version, one step per version. Without a primary key every row is version 1
+        if not self.schemas[table_name]['is_ledger']:
+            raise ValueError("AS OF VERSION requires a LEDGER table")
+        self._table(table_name)
+        if not self.primary_key(table_name):
+            return [r for r in self.select_rows(table_name, where, True) if r.get('_version') == version]
+        snapshot = getattr(self._local, 'snapshot', None)
+        match = self.compile_where(table_name, where)
+        chains = self.chains[table_name]
+        key = self._chain_key(table_name, index_terms(where, self.column_types(table_name)))
+        if key is None:
+            heads = list(chains.values())
+        else:
+            heads = [chains[key]] if key in chains else []
+        
+        prev = self.prev_version[table_name]
+        rids = []
+        for latest, rid, _ in heads:
+            steps = latest - version
+            while rid is not None and steps > 0:
+                rid = prev.get(rid)
+                steps -= 1
+            if rid is not None and steps == 0:
+                rids.append(rid)
+        
+        found = {}
+        cold = []
+        for rid in rids:
+            hot = self._row_at(table_name, rid, snapshot)
+            if hot is None:
+                # Compacted, or not yet visible to this snapshot
+                cold.append(rid)
+                continue
+            row, active = hot
+            found[rid] = dict(row.to_dict() if isinstance(row, Row) else row, _is_active=active)
+        for rid, row in self.history[table_name].get_many(cold).items():
+            found[rid] = dict(row, _is_active=False)
+        return [row for _, row in sorted(found.items())
+                if row.get('_version') == version and (match is None or match(row))]
+    
+    def verify(self, table_name: str, since: int = None):
+        # Recompute the hash chain from the log, starting at a root checkpoint when one
+        # is given, and check it against the stored hashes, the in-memory tree and every
+        # later checkpoint. Checkpoints before the start are checked against the tree
+        self._table(table_name)
+        merkle = self.merkle[table_name]
+        checkpoints = merkle.checkpoints
+        index, head, start = 0, ZERO_HASH, (0, 0)
+        if since is not None:
+            found = [c for c in checkpoints if c['seq'] == since]
+            if not found:
+                raise ValueError(f"No checkpoint {since} for {table_name}")
+            index, head, start = found[0]['size'], bytes.fromhex(found[0]['head']), tuple(found[0]['position'])
+        first = index
+        
+        result = {'table': table_name, 'valid': True, 'since': since, 'checked': 0, 'size': len(merkle),
+                  'root': merkle.root().hex(),
+                  'checkpoint': checkpoints[-1]['seq'] if checkpoints else None}
+        for c in checkpoints:
+            if c['size'] <= index and merkle.root(c['size']).hex() != c['root']:
+                return dict(result, valid=False, error=f"Root of checkpoint {c['seq']} does not match the log")
+        pending = [c for c in checkpoints if c['size'] > index]
+        for _, record in self._log(table_name).replay(start, self.tail_positions.get(table_name)):
+            stored = record.pop('h', None)
+            head = chain_hash(head, self._encode(record))
+            if stored is not None and stored != head.hex():
+                return dict(result, valid=False, error=f"Hash mismatch at {self._describe(index, record)}")
+            if index >= len(merkle) or merkle.hash_at(index) != head:
+                return dict(result, valid=False, error=f"Unexpected content at {self._describe(index, record)}")
+            index += 1
+            while pending and pending[0]['size'] == index:
+                if pending[0]['head'] != head.hex() or merkle.root(index).hex() != pending[0]['root']:
+                    return dict(result, valid=False, error=f"Checkpoint {pending[0]['seq']} does not match the log")
+                pending.pop(0)
+        result['checked'] = index - first
+        if index != len(merkle) or pending:
+            return dict(result, valid=False, error=f"Log ends at record {index}, expected {len(merkle)}")
+        return result
+    
+    def _describe(self, index: int, record: Dict):
+        return f"record {index} (rid {record.get('rid')}, lsn {record.get('lsn')})"
+    
+    def prove(self, table_name: str, rid: int):
+        # Inclusion proof of the record that inserted row `rid` in the current root
+        self._table(table_name)
+        merkle = self.merkle[table_name]
+        index = merkle.leaf_of(rid)
+        if index is None:
+            raise ValueError(f"No row {rid} in {table_name}")
+        size = len(merkle)
+        digest = merkle.hash_at(index)
+        path = merkle.proof(index, size)
+        root = merkle.root(size)
+        return {
+            'table': table_name,
+            'rid': rid,
+            'index': index,
+            'record': self._log(table_name).read_at(merkle.position_at(index)),
+            'prev_hash': (merkle.hash_at(index - 1) if index else ZERO_HASH).hex(),
+            'hash': digest.hex(),
+            'size': size,
+            'root': root.hex(),
+            'path': [p.hex() for p in path],
+            'valid': verify_inclusion(digest, index, size, path, root),
+        }
+    
+    def generation(self, table_name: str):
+        return self.generations.get(table_name, 0)
+    
+    def row_count(self, table_name: str):
+        return len(self._table(table_name))
+    
+    def compacted_rows(self, table_name: str):
+        self._table(table_name)
+        return len(self.history[table_name]) if table_name in self.history else 0
+    
+    def analyze(self, table_name: str):
+        # Gathers a table's statistics from a random sample of its active rows, read at
+        # the caller's snapshot, and keeps them for the planner
+        self._table(table_name)
+        with self.stats_lock:
+            return self._analyze(table_name)
+    
+    def _analyze(self, table_name: str):
+        table = self.tables[table_name]
+        with self.metrics.timed('analyze'):
+            snapshot = getattr(self._local, 'snapshot', None)
+            records = self.record_count[table_name]
+            live = self.live_rows[table_name]
+            rids = list(table)
+            versions = len(rids) + len(self.history.get(table_name, ()))
+            # Retired versions are skipped, so sample enough row ids to find the rows wanted
+            wanted = min(len(rids), ANALYZE_SAMPLE_ROWS * len(rids) // max(live, 1) + 1,
+                         ANALYZE_SAMPLE_ROWS * 4)
+            if wanted < len(rids):
+                rids = random.sample(rids, wanted)
+            rows = []
+            for rid in rids:
+                version = self._row_at(table_name, rid, snapshot)
+                if version is not None and version[1]:
+                    rows.append(version[0])
+            if len(rids) == len(table):
+                live = len(rows)
+            stats = TableStats.from_rows(self.layouts[table_name], self.column_names(table_name), rows, live,
+                                         versions, records)
+        self.stats[table_name] = stats
+        if not self.read_only:
+            self._save_stats(table_name, stats)
+        return stats
+    
+    def table_stats(self, table_name: str):
+        # A table's statistics, gathered again once enough has been written since that
+        # they may mislead
+        self._table(table_name)
+        stats = self.stats.get(table_name)
+        if stats is None or self._stale(table_name, stats):
+            with self.stats_lock:
+                # Another thread may have gathered them while this one waited
+                stats = self.stats.get(table_name)
+                if stats is None or self._stale(table_name, stats):
+                    stats = self._analyze(table_name)
+        return stats
+    
+    def _stale(self, table_name: str, stats: TableStats):
+        changed = abs(self.record_count[table_name] - stats.records)
+        return changed > ANALYZE_THRESHOLD + ANALYZE_SCALE * stats.active
+    
+    def estimate_rows(self, table_name: str, where=None, history: bool = False):
+        # Rows a scan is expected to return: the active rows, or with `history` every
+        # stored version, times the share the statistics expect `where` to match
+        stats = self.table_stats(table_name)
+        rows = self.live_rows[table_name]
+        if history and self.schemas[table_name]['is_ledger']:
+            rows = len(self.tables[table_name]) + len(self.history[table_name])
+        return rows * stats.selectivity(where, self.column_types(table_name))
+    
+    def column_names(self, table_name: str):
+        names = [c['name'] for c in self.schemas[table_name]['columns']]
+        if self.schemas[table_name]['is_ledger']:
+            names += ['_version', '_created_at', '_is_active']
+        return names
+    
+    def column_types(self, table_name: str):
+        return {c['name']: c['type'] for c in self.schemas[table_name]['columns']}
+    
+    def compile_where(self, table_name: str, where, packed: bool = False):
+        # `packed` predicates read the table's stored rows by position
+        if where is None:
+            return None
+        getter = self.layouts[table_name].accessor if packed else None
+        return compile_predicate(where, self.column_types(table_name), getter)
+    
+    def access_path(self, table_name: str, where=None, history: bool = False, order_by: str = None,
+                    descending: bool = False):
+        # How _visible_rows finds a scan's rows, as an EXPLAIN plan node with the rows it
+        # is expected to return and its cost
+        table = self._table(table_name)
+        estimate = round(self.estimate_rows(table_name, where, history), 1)
+        if order_by is not None:
+            return {'operator': 'Index Scan', 'table': table_name, 'index': f"{table_name}.{order_by}",
+                    'order': 'DESC' if descending else 'ASC', 'est_rows': estimate,
+                    'cost': round(index_scan_cost(len(table)), 1)}
+        terms = index_terms(where, self.column_types(table_name))
+        if self.schemas[table_name]['is_ledger'] and history:
+            key = self._chain_key(table_name, terms)
+            if key is not None:
+                versions = len(self.version_chain(table_name, key))
+                return {'operator': 'Version Chain Scan', 'table': table_name, 'key': key,
+                        'est_rows': min(estimate, versions), 'cost': round(index_scan_cost(versions), 1)}
+            return {'operator': 'Seq Scan', 'table': table_name, 'history': True, 'est_rows': estimate,
+                    'cost': round(seq_scan_cost(len(table) + len(self.history[table_name])), 1)}
+        found = self._index_term(table_name, terms)
+        if found is None:
+            return {'operator': 'Seq Scan', 'table': table_name, 'est_rows': estimate,
+                    'cost': round(seq_scan_cost(len(table)), 1)}
+        column, value = found
+        matched = self._term_rows(table_name, column, value)
+        return {'operator': 'Index Scan', 'table': table_name, 'index': f"{table_name}.{column}",
+                'cond': format_expr(term_expr(column, value)), 'est_rows': round(min(estimate, matched), 1),
+                'cost': round(index_scan_cost(matched), 1)}
+    
+    def _index_term(self, table_name: str, terms: Dict):
+        # The indexed term expected to match the fewest rows, provided fetching those by
+        # row id is cheaper than scanning every stored version of the table. Equality on
+        # a unique column always qualifies
+        best = None
+        for column, value in terms.items():
+            if isinstance(value, Range):
+                if not self.index.is_ordered(table_name, column):
+                    continue
+            elif not self.index.has_index(table_name, column):
+                continue
+            elif not isinstance(value, InList) and self.index.is_unique(table_name, column):
+                return column, value
+            rows = self._term_rows(table_name, column, value)
+            if best is None or rows < best[0]:
+                best = (rows, column, value)
+        if best is None or index_scan_cost(best[0]) >= seq_scan_cost(len(self.tables[table_name])):
+            return None
+        return best[1], best[2]
+    
+    def _term_rows(self, table_name: str, column: str, value):
+        # Rows an index term matches: counted from the index for values, estimated from
+        # the statistics for a range
+        if isinstance(value, Range):
+            return self.estimate_rows(table_name, term_expr(column, value))
+        values = value.values if isinstance(value, InList) else [value]
+        return sum(self.index.count(table_name, column, v) for v in set(values))
+    
+    def _index_lookup(self, table_name: str, where):
+        found = self._index_term(table_name, index_terms(where, self.column_types(table_name)))
+        if found is None:
+            return None
+        column, value = found
+        if isinstance(value, InList):
+            rids = set()
+            for v in value.values:
+                rids.update(self.index.lookup(table_name, column, v))
+            return sorted(rids)
+        if isinstance(value, Range):
+            return self.index.range_lookup(table_name, column, value.low, value.high,
+                                           value.low_inclusive, value.high_inclusive)
+        return self.index.lookup(table_name, column, value)
+    
+    def primary_key(self, table_name: str):
+        return [c['name'] for c in self.schemas[table_name]['columns'] if c.get('primary_key')]
+    
+    def _key_of(self, table_name: str, values: Dict):
+        pk = self.primary_key(table_name)
+        if not pk or any(c not in values for c in pk):
+            return None
+        return values[pk[0]] if len(pk) == 1 else tuple(values[c] for c in pk)
+    
+    def _link_version(self, table_name: str, record: Dict):
+        chain = self.chains[table_name].get(self._key_of(table_name, record['row']))
+        record['row']['_version'] = chain[0] + 1 if chain else 1
+        if chain:
+            record['prev'] = chain[1]
+    
+    def version_chain(self, table_name: str, key: Any):
+        # Row ids of every version of one key, oldest first
+        self._table(table_name)
+        chain = self.chains[table_name].get(key)
+        rids = []
+        rid = chain[1] if chain else None
+        while rid is not None:
+            rids.append(rid)
+            rid = self.prev_version[table_name].get(rid)
+        return rids[::-1]
+    
+    def _chain_key(self, table_name: str, terms: Dict):
+        pk = self.primary_key(table_name)
+        if not pk or any(c not in terms or isinstance(terms[c], (Range, InList)) for c in pk):
+            return None
+        return self._key_of(table_name, terms)
+    
+    def _chain_lookup(self, table_name: str, where):
+        key = self._chain_key(table_name, index_terms(where, self.column_types(table_name)))
+        return None if key is None else self.version_chain(table_name, key)
+    
+    def _candidates(self, table_name: str, where):
+        rids = self._index_lookup(table_name, where)
+        return list(self.tables[table_name]) if rids is None else rids
+    
+    def _check_unique(self, table_name: str, row: Dict, rid: int = None, claimed: Dict = None):
+        rows = self.tables[table_name]
+        for column in self.index.table_columns(table_name):
+            if row.get(column) is None or not self.index.is_unique(table_name, column):
+                continue
+            # Index entries of retired versions linger until no reader needs them
+            existing = [r for r in self.index.lookup(table_name, column, row[column])
+                        if r != rid and self._is_live(table_name, r) and rows[r].get(column) == row[column]]
+            if existing:
+                raise ValueError(f"Constraint violation on {column}")
+            if claimed is not None:
+                if column in claimed:
+                    raise ValueError(f"Constraint violation on {column}")
+                claimed[column] = rid
+    
+    def _check_primary_key(self, table_name: str, row: Dict, partial: bool):
+        # A primary key column is never NULL; an update only checks the columns it sets
+        for column in self.primary_key(table_name):
+            if (column in row or not partial) and row.get(column) is None:
+                raise ValueError(f"Primary key column {column} cannot be NULL")
+    
+    def _log(self, table_name: str):
+        if table_name not in self.logs:
+            self.logs[table_name] = SegmentLog(self._table_dir(table_name), self.segment_size)
+        return self.logs[table_name]
+    
+    def _table(self, table_name: str):
+        if table_name in self.tables and table_name not in self.loading:
+            return self.tables[table_name]
+        if table_name not in self.schemas:
+            raise ValueError(f"Table {table_name} does not exist")
+        with self.load_lock:
+            if table_name not in self.tables:
+                self.loading.add(table_name)
+                try:
+                    with self.metrics.timed('table_load'):
+                        self._load_table(table_name)
+                finally:
+                    self.loading.discard(table_name)
+            return self.tables[table_name]
+    
+    def _load_table(self, table_name: str, use_snapshot: bool = True):
+        # Rebuild the table state from its segments the first time it is touched
+        self.tables[table_name] = {}
+        self.layouts[table_name] = RowLayout(self.column_names(table_name) +
+                                             self.schemas[table_name].get('view', {}).get('hidden', []))
+        self.row_lsn[table_name] = {}
+        self.superseded[table_name] = {}
+        self.next_rid[table_name] = 1
+        self.unsnapshotted[table_name] = 0
+        self.chains[table_name] = {}
+        self.prev_version[table_name] = {}
+        self.uncheckpointed[table_name] = 0
+        self.record_count[table_name] = 0
+        self.live_rows[table_name] = 0
+        self.stats[table_name] = self._load_stats(table_name)
+        self.time_index[table_name] = ([], [])
+        self.table_lsn[table_name] = 0
+        merkle = self.merkle[table_name] = MerkleLog(os.path.join(self._table_dir(table_name), "merkle.ndjson"))
+        if self.schemas[table_name]['is_ledger']:
+            self.history[table_name] = HistoryStore(os.path.join(self._table_dir(table_name), "history"))
+        for col in self.schemas[table_name]['columns']:
+            if col.get('primary_key') or col.get('unique'):
+                self.index.create_index(table_name, col['name'], True)
+        for idx in self.schemas[table_name].get('indexes', []):
+            self.index.create_index(table_name, idx['column'], ordered=idx['using'] == 'BTREE')
+        
+        log = self._log(table_name)
+        if not log.segments and os.path.exists(self._legacy_path(table_name)) and not self.read_only:
+            self._import_legacy(table_name)
+        
+        # Index and chain entries up to the snapshot position come from the snapshot file
+        indexed_to = self._load_snapshot(table_name) if use_snapshot else None
+        if indexed_to is None or indexed_to > log.end_position():
+            indexed_to = (0, 0)
+            self.index.clear_table(table_name)
+            self.chains[table_name] = {}
+        end, _ = self._replay(table_name, (0, 0), indexed_to)
+        if self.schemas[table_name]['is_ledger']:
+            self.checkpoints[table_name] = CheckpointStore(os.path.join(self._table_dir(table_name), "checkpoints"))
+        if not self.read_only:
+            merkle.discard_after(len(merkle))
+            if table_name in self.checkpoints:
+                self.checkpoints[table_name].discard_after(log.end_position())
+        elif end < indexed_to:
+            # The snapshot indexes records the primary has not published yet
+            self._unload(table_name)
+            return self._load_table(table_name, use_snapshot=False)
+        else:
+            merkle.reload()
+            if table_name in self.checkpoints:
+                self.checkpoints[table_name].reload(end)
+    
+    def _replay(self, table_name: str, start, indexed_to):
+        # Apply a table's logged records from `start`, indexing those past `indexed_to`;
+        # a replica stops at the first one the primary has not published. Returns the
+        # position after the last record applied and how many there were
+        merkle = self.merkle[table_name]
+        count = 0
+        try:
+            for position, record in self._log(table_name).replay(start):
+                if self.published_lsn is not None and record.get('lsn', 0) > self.published_lsn:
+                    break
+                record_start = start if start[0] == position[0] else (position[0], 0)
+                # Records written before hashing was added are chained as they are read
+                digest = record.get('h')
+                digest = bytes.fromhex(digest) if digest else chain_hash(merkle.head(), self._encode(record))
+                merkle.append(digest, record_start, record['rid'] if record['op'] == 'ins' else None)
+                self._apply(table_name, record, position > indexed_to)
+                self._track_time(table_name, record_start, record, 1)
+                start = position
+                count += 1
+        finally:
+            self.next_lsn = max(self.next_lsn, self.table_lsn[table_name] + 1)
+            if self.read_only:
+                self.tail_positions[table_name] = start
+        return start, count
+    
+    def _unload(self, table_name: str):
+        for state in (self.tables, self.row_lsn, self.superseded, self.chains, self.prev_version,
+                      self.checkpoints, self.history, self.merkle, self.layouts, self.live_rows):
+            state.pop(table_name, None)
+        self.garbage = deque(g for g in self.garbage if g[1] != table_name)
+    
+    def _recover(self):
+        # Committed WAL records newer than a table's segments were lost in a crash; re-apply them
+        for txn in self.wal.recover():
+            for table_name, record in txn:
+                if table_name not in self.schemas:
+                    continue
+                self._table(table_name)
+                if record['lsn'] > self.table_lsn[table_name]:
+                    self._apply(table_name, record)
+                    self._write_segments(table_name, [record], [self._encode(record)])
+                self.next_lsn = max(self.next_lsn, record['lsn'] + 1)
+        self._truncate_wal()
+    
+    def catch_up(self):
+        # Replica side: apply every commit the primary has published since the last call.
+        # All tables are brought to the same LSN before readers' snapshots move to it
+        started = time.monotonic()
+        published = self.marker.read()
+        with self.load_lock:
+            # None when no primary has published an LSN, e.g. a directory written by an
+            # older version: everything complete in the segments counts as committed
+            self.published_lsn = published[0] if published else None
+            self._follow_schemas()
+            touched = {}
+            for table_name in list(self.tables):
+                _, count = self._tail(table_name)
+                if count:
+                    touched[table_name] = count
+            self.committed_lsn = max(self.committed_lsn, self.next_lsn - 1)
+            for table_name in touched:
+                self.generations[table_name] = self.generations.get(table_name, 0) + 1
+        self._collect_garbage()
+        self.caught_up_at = started
+        if touched:
+            self.metrics.inc('ledgerdb_replica_records_applied_total', sum(touched.values()))
+            self.metrics.observe('ledgerdb_stage_seconds', time.monotonic() - started, stage='replica_apply')
+            if published:
+                # Primary commit to replica visibility, across the two processes' clocks
+                self.metrics.observe('ledgerdb_replication_delay_seconds', max(0.0, time.time() - published[1]))
+        self.metrics.set('ledgerdb_replica_applied_lsn', self.committed_lsn)
+        return sum(touched.values())
+    
+    def _tail(self, table_name: str):
+        log = self._log(table_name)
+        log.refresh()
+        end, count = self._replay(table_name, self.tail_positions[table_name], (0, 0))
+        if count:
+            self.merkle[table_name].reload()
+            if table_name in self.checkpoints:
+                self.checkpoints[table_name].reload(end)
+        return end, count
+    
+    def _follow_schemas(self):
+        # Tables and indexes the primary created since the schemas were last read
+        try:
+            mtime = os.stat(self._schema_path()).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self.schemas_mtime:
+            return
+        try:
+            with open(self._schema_path(), 'r') as f:
+                schemas = json.load(f)
+        except ValueError:
+            # Caught mid-rewrite; read it again on the next call
+            return
+        for table_name, schema in schemas.items():
+            known = self.schemas.get(table_name)
+            if known is None or table_name not in self.tables:
+                continue
+            indexed = {idx['column'] for idx in known.get('indexes', [])}
+            for idx in schema.get('indexes', []):
+                if idx['column'] not in indexed:
+                    self.index.create_index(table_name, idx['column'], ordered=idx['using'] == 'BTREE')
+                    for rid, row in list(self.tables[table_name].items()):
+                        if self._is_live(table_name, rid):
+                            self._reindex(table_name, rid, row, [idx['column']])
+        self.schemas = dict(self.schemas, **schemas)
+        self.schemas_mtime = mtime
+        for table_name in schemas:
+            self._table(table_name)
+    
+    def replica_lag(self):
+        # Seconds since the replica last confirmed it had every commit published before
+        return time.monotonic() - self.caught_up_at
+    
+    def _truncate_wal(self):
+        for log in self.logs.values():
+            log.sync()
+        self.wal.reset()
+    
+    def _import_legacy(self, table_name: str):
+        with open(self._legacy_path(table_name), 'r') as f:
+            legacy_rows = json.load(f)
+        records = []
+        heads = {}
+        for rid, row in enumerate(legacy_rows, 1):
+            record = {'op': 'ins', 'rid': rid, 'row': row}
+            key = self._key_of(table_name, row)
+            if self.schemas[table_name]['is_ledger'] and key is not None:
+                if key in heads:
+                    record['prev'] = heads[key]
+                heads[key] = rid
+            records.append(record)
+        self._log(table_name).append_many(records)
+    
+    def _new_row_record(self, table_name: str, row: Dict):
+        rid = self.next_rid[table_name]
+        self.next_rid[table_name] = rid + 1
+        return {'op': 'ins', 'rid': rid, 'row': row}
+    
+    def compact(self, table_name: str, min_rows: int = 1):
+        # Move ledger versions retired before every reader's snapshot out of the hot set
+        # into a history segment; must run on the writer thread, outside a transaction
+        if not self.schemas[table_name]['is_ledger'] or self.in_transaction or self.read_only:
+            return 0
+        self._table(table_name)
+        self._collect_garbage()
+        with self.readers_cond:
+            horizon = min(self.readers) if self.readers else self.committed_lsn
+        rows = self.tables[table_name]
+        lsns = self.row_lsn[table_name]
+        retired = [rid for rid, (_, ended) in list(lsns.items()) if ended is not None and ended <= horizon]
+        if not retired or len(retired) < min_rows:
+            return 0
+        
+        # Readers fall back to the history store once a row leaves the hot set
+        self.history[table_name].write([(rid, rows[rid].to_dict()) for rid in retired])
+        for rid in retired:
+            del rows[rid]
+            del lsns[rid]
+        return len(retired)
+    
+    def begin(self):
+        self._check_writable()
+        if self.in_transaction:
+            raise ValueError("Transaction already in progress")
+        # Writes grouped before the transaction must not be undone by its rollback
+        self._commit()
+        self.in_transaction = True
+        self.writer_ident = threading.get_ident()
+    
+    def commit(self):
+        if not self.in_transaction:
+            raise ValueError("No transaction in progress")
+        self._commit()
+    
+    def flush(self):
+        # Commit autocommit writes held back by a write group
+        if not self.in_transaction:
+            self._commit()
+    
+    def rollback(self):
+        if not self.in_transaction:
+            raise ValueError("No transaction in progress")
+        self.in_transaction = False
+        if not self.grouping:
+            self.writer_ident = None
+        
+        # Uncommitted records only ever reached memory, so undoing them there discards
+        # them. Readers keep going: none can see an uncommitted version
+        self._revert((0, 0))
+    
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError("Read-only replica: send writes to the primary")
+    
+    def _append(self, table_name: str, records: List[Dict]):
+        # Views over the table are brought up to date with the records, and their
+        # changes are committed together with them. If that fails, only this
+        # statement's records are undone; the rest of a transaction or write group stays
+        self._check_writable()
+        if not records:
+            return
+        mark = self._mark()
+        try:
+            changes = self._stage(table_name, records)
+            for view_name in self.views.get(table_name, ()):
+                self._stage(view_name, self._maintain(view_name, changes))
+        except Exception:
+            self._revert(mark)
+            raise
+        if not self.in_transaction and not self.grouping:
+            self._commit()
+    
+    def _stage(self, table_name: str, records: List[Dict]):
+        # Applies records under the next LSNs, to be committed with the pending ones.
+        # For a table with views, returns the (old, new) live version of each row written
+        if not records:
             return []
-        with open(self._table_path(table_name), 'r') as f:
-            return json.load(f)
-    
-    def _write_table(self, table_name: str, rows: List[Dict]):
-        with open(self._table_path(table_name), 'w') as f:
-            json.dump(rows, f, indent=2)
-    
-    def _match_where(self, row: Dict, where: Dict):
-        if not where:
-            return True
-        for k, v in where.items():
-            row_val = row.get(k)
-            # Handle type conversions for comparison
-            if row_val is None:
-                return False
-            # Convert both to same type for comparison
-            if isinstance(v, (int, float)) and isinstance(row_val, (int, float)):
-                if float(row_val) != float(v):
-                    return False
-            elif str(row_val) != str(v):
-                return False
-        return True
-    
-    def _match_pk(self, row1: Dict, row2: Dict):
-        # Find the table name by checking which schema we're working with
-        for table_name, schema in self.schemas.items():
-            pk_cols = [c['name'] for c in schema['columns'] if c.get('primary_key')]
-            if pk_cols and all(k in row1 and k in row2 for k in pk_cols):
-                return all(row1.get(k) == row2.get(k) for k in pk_cols)
-        return False
+        watched = table_name in self.views
+        changes = {}
+        for record in records:
+            if watched and record['rid'] not in changes:
+                changes[record['rid']] = self._live_row(table_name, record['rid'])
+            record['lsn'] = self.next_lsn
+            self.next_lsn += 1
+            self.undo.append(self._undo_entry(table_name, record))
+            self._apply(table_name, record)
+        self.pending.append((table_name, records))
+        return [(old, self._live_row(table_name, rid)) for rid, old in changes.items()]
+    
+    def _undo_entry(self, table_name: str, record: Dict):
+        # What applying a record replaces: the row and its LSNs, the version chains of
+        # its keys and the counters, and which index entries it adds
+        rid = record['rid']
+        old = self.tables[table_name].get(rid)
+        lsns = self.row_lsn[table_name].get(rid)
+        row = record.get('row')
+        chains = None
+        if self.schemas[table_name]['is_ledger']:
+            keys = {self._key_of(table_name, r) for r in (old, row) if r is not None} - {None}
+            chains = [(key, list(self.chains[table_name][key]) if key in self.chains[table_name] else None)
+                      for key in keys]
+        added = []
+        if row is not None and row.get('_is_active', True):
+            added = [(c, row[c]) for c in self.index.table_columns(table_name)
+                     if c in row and not self.index.contains(table_name, c, row[c], rid)]
+        return (table_name, record, old, lsns and tuple(lsns), chains, added,
+                self.prev_version[table_name].get(rid), self.live_rows[table_name], self.table_lsn[table_name])
+    
+    def _mark(self):
+        return len(self.pending), len(self.undo)
+    
+    def _revert(self, mark: tuple):
+        # Undoes the records staged since `mark`, newest first, without touching disk.
+        # Each row goes back before its LSNs and superseded versions, see _row_at
+        pending, undo = mark
+        lsn = None
+        while len(self.undo) > undo:
+            table_name, record, old, lsns, chains, added, prev, live, table_lsn = self.undo.pop()
+            rid, lsn = record['rid'], record['lsn']
+            rows = self.tables[table_name]
+            if old is None:
+                rows.pop(rid, None)
+                self.row_lsn[table_name].pop(rid, None)
+            else:
+                rows[rid] = old
+                self.row_lsn[table_name][rid] = list(lsns)
+            versions = self.superseded[table_name].get(rid)
+            if versions:
+                kept = [v for v in versions if v[1] != lsn]
+                if kept:
+                    self.superseded[table_name][rid] = kept
+                else:
+                    del self.superseded[table_name][rid]
+            for column, value in added:
+                self.index.remove_from_index(table_name, column, value, rid)
+            for key, chain in chains or ():
+                if chain is None:
+                    self.chains[table_name].pop(key, None)
+                else:
+                    self.chains[table_name][key] = chain
+            if prev is None:
+                self.prev_version[table_name].pop(rid, None)
+            else:
+                self.prev_version[table_name][rid] = prev
+            self.live_rows[table_name] = live
+            self.table_lsn[table_name] = table_lsn
+        # The versions the undone records retired stay current
+        while lsn is not None and self.garbage and self.garbage[-1][0] >= lsn:
+            self.garbage.pop()
+        del self.pending[pending:]
+    
+    def _live_row(self, table_name: str, rid: int):
+        return self.tables[table_name][rid] if self._is_live(table_name, rid) else None
+    
+    def _maintain(self, view_name: str, changes: List):
+        # Records that fold changed source rows into a view's groups. A MIN or MAX
+        # whose value was retracted is recomputed from the group's rows
+        view = self._view(view_name)
+        rows = self._table(view_name)
+        records = []
+        for key, deltas in view.group_changes(changes).items():
+            rid = self._view_rid(view, key)
+            old = rows[rid].to_dict() if rid is not None else None
+            state, stale = view.apply(old, key, deltas)
+            if stale:
+                state = view.recompute(key, list(self._visible_rows(view.source, view.group_filter(key))))
+            if state is None:
+                if rid is not None:
+                    records.append({'op': 'del', 'rid': rid})
+            elif rid is None:
+                records.append(self._new_row_record(view_name, state))
+            elif state != old:
+                records.append({'op': 'upd', 'rid': rid, 'row': state})
+        return records
+    
+    def _view_rid(self, view: MaterializedView, key: tuple):
+        # The view row of a group, found through the index on its first grouping column
+        rows = self.tables[view.name]
+        if not view.group_by:
+            return next((rid for rid in rows if self._is_live(view.name, rid)), None)
+        for rid in self.index.lookup(view.name, view.group_by[0], key[0]):
+            if self._is_live(view.name, rid) and all(rows[rid].get(c) == v for c, v in zip(view.group_by, key)):
+                return rid
+        return None
+    
+    def _commit(self):
+        pending = self.pending
+        self.in_transaction = False
+        if not self.grouping:
+            self.writer_ident = None
+        if not pending:
+            return
+        # Each record is encoded once and the same line goes to the WAL and its segment
+        encoded = self._encode_chained(pending)
+        try:
+            with self.metrics.timed('wal_commit'):
+                self.wal.commit([(table_name, line) for (table_name, _), lines in zip(pending, encoded)
+                                 for line in lines])
+        except OSError:
+            self.in_transaction = True
+            self.rollback()
+            raise
+        self.pending = []
+        self.undo = []
+        self.committed_lsn = pending[-1][1][-1]['lsn']
+        for table_name in {table_name for table_name, _ in pending}:
+            self.generations[table_name] = self.generations.get(table_name, 0) + 1
+        
+        for (table_name, records), lines in zip(pending, encoded):
+            self.metrics.inc('ledgerdb_records_written_total', len(records), table=table_name)
+            self.metrics.inc('ledgerdb_bytes_written_total', sum(len(line) + 1 for line in lines), table=table_name)
+            self._write_segments(table_name, records, lines)
+        self.marker.publish(self.committed_lsn)
+        if self.wal.size() >= self.wal_limit:
+            self._truncate_wal()
+        self._collect_garbage()
+    
+    def _encode(self, record: Dict):
+        return json.dumps(record, separators=(',', ':'))
+    
+    def _encode_chained(self, pending: List):
+        # Every record carries `h`, the hash of its encoding without `h` chained to the
+        # previous record of its table. `h` is appended last, so dropping it from the
+        # parsed record and re-encoding reproduces the hashed text
+        heads = {}
+        encoded = []
+        for table_name, records in pending:
+            head = heads.get(table_name) or self.merkle[table_name].head()
+            lines = []
+            for record in records:
+                line = self._encode(record)
+                head = chain_hash(head, line)
+                record['h'] = head.hex()
+                lines.append(f'{line[:-1]},"h":"{record["h"]}"}}')
+            heads[table_name] = head
+            encoded.append(lines)
+        return encoded
+    
+    def _write_segments(self, table_name: str, records: List[Dict], lines: List[str]):
+        log = self._log(table_name)
+        with self.metrics.timed('segment_write'):
+            start = log.append_lines(lines)
+        self._track_time(table_name, start, records[0], len(records))
+        
+        merkle = self.merkle[table_name]
+        before = len(merkle)
+        seq, offset = start
+        for record, line in zip(records, lines):
+            # WAL records from before hashing was added have no `h`
+            digest = bytes.fromhex(record['h']) if 'h' in record else chain_hash(merkle.head(), line)
+            merkle.append(digest, (seq, offset), record['rid'] if record['op'] == 'ins' else None)
+            offset += len(line) + 1
+        if len(merkle) // MERKLE_CHECKPOINT_EVERY > before // MERKLE_CHECKPOINT_EVERY:
+            merkle.checkpoint(log.end_position(), self._record_time(records[-1]))
+        
+        # Both files are rewritten whole, so the interval grows with the table to keep
+        # bulk loads linear
+        grown = len(self.tables[table_name]) // 4
+        self.unsnapshotted[table_name] += len(records)
+        if self.unsnapshotted[table_name] >= max(self.snapshot_every, grown):
+            self.save_snapshot(table_name)
+        if table_name in self.checkpoints:
+            self.uncheckpointed[table_name] += len(records)
+            if self.uncheckpointed[table_name] >= max(self.checkpoint_every, grown):
+                self.save_checkpoint(table_name, self._record_time(records[-1]))
+    
+    def _record_time(self, record: Dict):
+        if record['op'] == 'ins':
+            return record['row'].get('_created_at')
+        return record.get('at')
+    
+    def _track_time(self, table_name: str, start, record: Dict, count: int):
+        # Sample the time index once per stride; records are appended in time order
+        before = self.record_count[table_name]
+        self.record_count[table_name] += count
+        if before and before // TIME_INDEX_STRIDE == self.record_count[table_name] // TIME_INDEX_STRIDE:
+            return
+        at = self._record_time(record)
+        times, positions = self.time_index[table_name]
+        if at is not None and (not times or at >= times[-1]):
+            times.append(at)
+            positions.append(start)
+    
+    def save_checkpoint(self, table_name: str, at: str):
+        with self.metrics.timed('checkpoint'):
+            self._save_checkpoint(table_name, at)
+    
+    def _save_checkpoint(self, table_name: str, at: str):
+        self._log(table_name).sync()
+        rows = [[rid, row.to_dict()] for rid, row in self.tables[table_name].items() if self._is_live(table_name, rid)]
+        self.checkpoints[table_name].save(at, self._log(table_name).end_position(), rows)
+        self.uncheckpointed[table_name] = 0
+    
+    def save_snapshot(self, table_name: str):
+        with self.metrics.timed('snapshot'):
+            self._save_snapshot(table_name)
+    
+    def _save_snapshot(self, table_name: str):
+        self._log(table_name).sync()
+        snapshot = {
+            'position': list(self._log(table_name).end_position()),
+            'indexes': self.index.dump_table(table_name, lambda c, v, rid: self._is_live(table_name, rid)
+                                             and self.tables[table_name][rid].get(c) == v),
+            'chains': [[key, *chain] for key, chain in self.chains[table_name].items()]
+        }
+        tmp_path = self._snapshot_path(table_name) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(snapshot, separators=(',', ':')))
+        os.replace(tmp_path, self._snapshot_path(table_name))
+        self.unsnapshotted[table_name] = 0
+    
+    def _save_stats(self, table_name: str, stats: TableStats):
+        tmp_path = self._stats_path(table_name) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(stats.to_dict(), separators=(',', ':')))
+        os.replace(tmp_path, self._stats_path(table_name))
+    
+    def _load_stats(self, table_name: str):
+        try:
+            with open(self._stats_path(table_name), 'r') as f:
+                return TableStats.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+    
+    def _load_snapshot(self, table_name: str):
+        if not os.path.exists(self._snapshot_path(table_name)):
+            return None
+        with open(self._snapshot_path(table_name), 'r') as f:
+            snapshot = json.load(f)
+        if not self.index.restore_table(table_name, snapshot['indexes']):
+            return None
+        self.chains[table_name] = {
+            tuple(key) if isinstance(key, list) else key: chain for key, *chain in snapshot['chains']
+        }
+        return tuple(snapshot['position'])
+    
+    def close(self):
+        if self.read_only:
+            for log in self.logs.values():
+                log.close()
+            return
+        if self.in_transaction:
+            self.rollback()
+        for table_name in self.tables:
+            if self.unsnapshotted[table_name]:
+                self.save_snapshot(table_name)
+        self._truncate_wal()
+        self.wal.close()
+        self.marker.close()
+        for log in self.logs.values():
+            log.close()
+    
+    def _apply(self, table_name: str, record: Dict, update_index: bool = True):
+        rows = self.tables[table_name]
+        lsns = self.row_lsn[table_name]
+        op = record['op']
+        rid = record['rid']
+        lsn = record.get('lsn', 0)
+        old = rows.get(rid)
+        self.table_lsn[table_name] = max(self.table_lsn[table_name], lsn)
+        if op == 'ins' and table_name in self.loading and rid in self.history.get(table_name, ()):
+            # Already compacted into history: replay only the bookkeeping around it
+            self.next_rid[table_name] = max(self.next_rid[table_name], rid + 1)
+            if record.get('prev') is not None:
+                self.prev_version[table_name][rid] = record['prev']
+            if update_index:
+                self._advance_chain(table_name, rid, op, dict(record['row'], _is_active=False))
+            return
+        was_live = old is not None and lsns[rid][1] is None
+        # Publish LSNs before rows so concurrent readers never pair a new row with old LSNs
+        if op in ('ins', 'upd'):
+            row = record['row']
+            if old is not None:
+                self.superseded[table_name].setdefault(rid, []).append((lsns[rid][0], lsn, old))
+            lsns[rid] = [lsn, None if row.get('_is_active', True) else lsn]
+            self.live_rows[table_name] += (lsns[rid][1] is None) - was_live
+            rows[rid] = self.layouts[table_name].pack(row)
+            if rid >= self.next_rid[table_name]:
+                self.next_rid[table_name] = rid + 1
+            if record.get('prev') is not None:
+                self.prev_version[table_name][rid] = record['prev']
+        elif op == 'deact':
+            if old is not None:
+                lsns[rid][1] = lsn
+                rows[rid] = self.layouts[table_name].pack(dict(old.items(), _is_active=False))
+                self.live_rows[table_name] -= was_live
+        elif op == 'del':
+            if old is not None:
+                lsns[rid][1] = lsn
+                self.live_rows[table_name] -= was_live
+        
+        if update_index:
+            if op in ('ins', 'upd') and self._is_live(table_name, rid):
+                self._reindex(table_name, rid, rows[rid])
+            if self.schemas[table_name]['is_ledger']:
+                self._advance_chain(table_name, rid, op, rows.get(rid))
+        if old is not None:
+            self._retire(table_name, lsn, rid, old, update_index)
+    
+    def _retire(self, table_name: str, lsn: int, rid: int, old: Dict, update_index: bool = True):
+        # Nobody can be reading a table that is still loading, so release right away
+        if table_name in self.loading:
+            self._release(table_name, lsn, rid, old, update_index)
+        else:
+            self.garbage.append((lsn, table_name, rid, old))
+    
+    def _release(self, table_name: str, lsn: int, rid: int, old: Dict, update_index: bool = True):
+        rows = self.tables[table_name]
+        lsns = self.row_lsn[table_name]
+        current = rows.get(rid)
+        live = self._is_live(table_name, rid)
+        
+        if update_index:
+            for column in self.index.table_columns(table_name):
+                if column in old and not (live and current.get(column) == old[column]):
+                    self.index.remove_from_index(table_name, column, old[column], rid)
+        
+        # Replace rather than trim the list so a reader iterating it is undisturbed
+        versions = self.superseded[table_name].get(rid)
+        if versions:
+            kept = [v for v in versions if v[1] > lsn]
+            if kept:
+                self.superseded[table_name][rid] = kept
+            else:
+                del self.superseded[table_name][rid]
+        
+        ended = lsns[rid][1] if rid in lsns else None
+        if not self.schemas[table_name]['is_ledger'] and ended is not None and ended <= lsn:
+            del rows[rid]
+            del lsns[rid]
+    
+    def _collect_garbage(self):
+        # Retired versions and index entries go once every reader's snapshot is past them
+        with self.readers_cond:
+            oldest = min(self.readers) if self.readers else self.committed_lsn
+        while self.garbage and self.garbage[0][0] <= oldest:
+            lsn, table_name, rid, old = self.garbage.popleft()
+            if table_name in self.tables:
+                self._release(table_name, lsn, rid, old)
+    
+    def _advance_chain(self, table_name: str, rid: int, op: str, row: Dict):
+        key = self._key_of(table_name, row or {})
+        if key is None:
+            return
+        chains = self.chains[table_name]
+        if op == 'ins':
+            chain = chains.get(key)
+            version = max(row.get('_version', 1), chain[0] if chain else 0)
+            chains[key] = [version, rid, rid if row.get('_is_active', True) else None]
+        elif op == 'deact' and key in chains and chains[key][2] == rid:
+            chains[key][2] = None
+    
+    def _reindex(self, table_name: str, rid: int, row: Dict, columns: List[str] = None):
+        for column in columns or self.index.table_columns(table_name):
+            if column in row:
+                # Constraints are checked before a record is logged, never on replay
+                self.index.add_to_index(table_name, column, row[column], rid, check=False)
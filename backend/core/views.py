@@ -0,0 +1,142 @@
+from operator import methodcaller
+from typing import Dict, List, Tuple
+
+from .index import _sort_key
+from .parser import SelectStmt, Aggregate, Comparison, IsNull
+from .predicate import compile_predicate, conjoin, conjuncts, map_columns, format_expr, NUMERIC_TYPES
+
+def _unqualified(column: str):
+    return column.rpartition('.')[2]
+
+class MaterializedView:
+    def __init__(self, name: str, query: SelectStmt, types: Dict[str, str]):
+        # An aggregate query over one table whose result is stored as a table and kept
+        # current by the writer: each write to the source becomes changes to the groups
+        # it touches. `types` are the source's column types, version columns included
+        self.name = name
+        self.source = query.table_name
+        if (query.joins or query.history or query.as_of is not None or query.as_of_version is not None
+                or query.having is not None or query.order_by or query.limit is not None or query.offset):
+            raise ValueError("A materialized view is a single-table SELECT with optional WHERE and GROUP BY")
+        if query.columns == ['*'] or not query.aggregates:
+            raise ValueError("A materialized view needs at least one aggregate")
+        self.group_by = [_unqualified(c) for c in query.group_by]
+        for column in self.group_by:
+            if column not in types:
+                raise ValueError(f"Column {column} does not exist in {self.source}")
+        
+        # (output column, function, source column or None for COUNT(*))
+        self.aggregates = []
+        for item in query.columns:
+            if not isinstance(item, Aggregate):
+                if _unqualified(item) not in self.group_by:
+                    raise ValueError(f"Column {item} must appear in GROUP BY or in an aggregate")
+                continue
+            column = None if item.column == '*' else _unqualified(item.column)
+            if column is not None and column not in types:
+                raise ValueError(f"Column {column} does not exist in {self.source}")
+            if item.func in ('SUM', 'AVG') and types[column].split('(')[0].upper() not in NUMERIC_TYPES:
+                raise ValueError(f"{item.func} requires a numeric column: {column}")
+            output = item.alias or (item.func.lower() if column is None else f"{item.func.lower()}_{column}")
+            self.aggregates.append((output, item.func, column))
+        outputs = self.group_by + [output for output, _, _ in self.aggregates]
+        if len(set(outputs)) < len(outputs):
+            raise ValueError("Materialized view columns must have distinct names")
+        
+        self.where = map_columns(query.where, _unqualified) if query.where is not None else None
+        self.query = query_sql(self)
+        # Accessors read stored rows and the dicts of logged records alike
+        self._match = compile_predicate(self.where, types) if self.where is not None else None
+        self._keys = [methodcaller('get', c) for c in self.group_by]
+        self._values = [methodcaller('get', c) if c else None for _, _, c in self.aggregates]
+    
+    def schema(self, types: Dict[str, str]):
+        # The stored table's columns, and the hidden ones that carry each group's state:
+        # its row count, and the non-NULL count (and for AVG the sum) behind a SUM or AVG
+        columns = [{'name': c, 'type': types[c], 'primary_key': len(self.group_by) == 1,
+                    'unique': False} for c in self.group_by]
+        hidden = ['_rows']
+        for output, func, column in self.aggregates:
+            type_ = {'COUNT': 'INT', 'AVG': 'FLOAT'}.get(func) or types[column]
+            columns.append({'name': output, 'type': type_, 'primary_key': False, 'unique': False})
+            if func in ('SUM', 'AVG'):
+                hidden.append(f"_n_{output}")
+            if func == 'AVG':
+                hidden.append(f"_sum_{output}")
+        return columns, hidden
+    
+    def group_changes(self, changes: List[Tuple]):
+        # (old, new) live versions of source rows -> {group key: [(+1 or -1, row)]}
+        groups = {}
+        for old, new in changes:
+            for sign, row in ((-1, old), (1, new)):
+                if row is not None and (self._match is None or self._match(row)):
+                    key = tuple(get(row) for get in self._keys)
+                    groups.setdefault(key, []).append((sign, row))
+        return groups
+    
+    def group_filter(self, key: Tuple):
+        # The source rows of one group, for recomputing it
+        terms = [IsNull(c) if v is None else Comparison(c, '=', v) for c, v in zip(self.group_by, key)]
+        return conjoin(terms + conjuncts(self.where))
+    
+    def empty(self, key: Tuple):
+        state = dict(zip(self.group_by, key))
+        state['_rows'] = 0
+        for output, func, _ in self.aggregates:
+            state[output] = 0 if func == 'COUNT' else None
+            if func in ('SUM', 'AVG'):
+                state[f"_n_{output}"] = 0
+            if func == 'AVG':
+                state[f"_sum_{output}"] = None
+        return state
+    
+    def apply(self, state: Dict, key: Tuple, deltas: List[Tuple]):
+        # Folds added and retracted rows into a group's stored row. Returns the new row,
+        # or None once a group has no rows left, and whether a MIN or MAX lost its
+        # value, in which case the group has to be recomputed from its rows
+        state = self.empty(key) if state is None else dict(state)
+        stale = False
+        for sign, row in deltas:
+            state['_rows'] += sign
+            for (output, func, _), get in zip(self.aggregates, self._values):
+                value = get(row) if get is not None else None
+                if func == 'COUNT':
+                    if get is None or value is not None:
+                        state[output] += sign
+                    continue
+                if value is None:
+                    continue
+                if func in ('SUM', 'AVG'):
+                    count = state[f"_n_{output}"] = state[f"_n_{output}"] + sign
+                    field = output if func == 'SUM' else f"_sum_{output}"
+                    # Back to exactly NULL when the last value goes, whatever float error remains
+                    state[field] = (state[field] or 0) + sign * value if count else None
+                    if func == 'AVG':
+                        state[output] = state[field] / count if count else None
+                    continue
+                current = state[output]
+                if sign > 0:
+                    if current is None or (_sort_key(value) < _sort_key(current) if func == 'MIN'
+                                           else _sort_key(value) > _sort_key(current)):
+                        state[output] = value
+                elif value == current:
+                    stale = True
+        if self.group_by and state['_rows'] <= 0:
+            return None, False
+        return state, stale
+    
+    def recompute(self, key: Tuple, rows: List):
+        return self.apply(None, key, [(1, row) for row in rows])[0]
+
+def query_sql(view: MaterializedView):
+    # The SELECT a view is defined by, as stored in the schema and parsed again on load
+    items = list(view.group_by)
+    for output, func, column in view.aggregates:
+        items.append(f"{func}({column or '*'}) AS {output}")
+    sql = f"SELECT {', '.join(items)} FROM {view.source}"
+    if view.where is not None:
+        sql += f" WHERE {format_expr(view.where)}"
+    if view.group_by:
+        sql += f" GROUP BY {', '.join(view.group_by)}"
+    return sql
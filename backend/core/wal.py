@@ -0,0 +1,144 @@
+import json
+import os
+import struct
+import threading
+import time
+from typing import List, Tuple, Dict
+
+class WriteAheadLog:
+    def __init__(self, path: str, sync: bool = True):
+        self.path = path
+        self.sync = sync
+        self._cond = threading.Condition()
+        self._pending = []
+        self._queued = 0
+        self._durable = 0
+        self._failed = {}
+        self._flushing = False
+        self._file = None
+    
+    def recover(self) -> List[List[Tuple[str, Dict]]]:
+        # Committed transactions in log order; a trailing transaction without its
+        # commit marker (or a torn last line) was never acknowledged and is dropped
+        self.close()
+        txns = []
+        current = []
+        good_bytes = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    offset += len(line)
+                    entry = json.loads(line)
+                    if 'commit' in entry:
+                        txns.append(current)
+                        current = []
+                        good_bytes = offset
+                    else:
+                        current.append((entry['table'], entry['rec']))
+            with open(self.path, 'rb+') as f:
+                f.truncate(good_bytes)
+        self._file = open(self.path, 'ab')
+        return txns
+    
+    def commit(self, entries: List[Tuple[str, str]]):
+        # Entries are (table, record already encoded as JSON). Group commit: whichever
+        # committer finds no flush in progress writes and fsyncs everything queued so
+        # far; the others wait for that one fsync
+        lines = ['{"table":%s,"rec":%s}' % (json.dumps(t), r) for t, r in entries]
+        lines.append(json.dumps({'commit': len(entries)}))
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        
+        with self._cond:
+            if self._file is None:
+                self._file = open(self.path, 'ab')
+            self._pending.append(data)
+            self._queued += 1
+            ticket = self._queued
+            while self._durable < ticket and ticket not in self._failed:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flush_pending()
+            if ticket in self._failed:
+                raise self._failed.pop(ticket)
+    
+    def _flush_pending(self):
+        batch, self._pending = self._pending, []
+        first, last = self._durable + 1, self._queued
+        self._flushing = True
+        self._cond.release()
+        error = None
+        try:
+            self._file.write(b''.join(batch))
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+        except OSError as e:
+            error = e
+        finally:
+            self._cond.acquire()
+            self._flushing = False
+        if error is not None:
+            for ticket in range(first, last + 1):
+                self._failed[ticket] = error
+        self._durable = last
+        self._cond.notify_all()
+    
+    def size(self):
+        return self._file.tell() if self._file is not None else 0
+    
+    def reset(self):
+        # Only safe once every committed record has been synced to its table segments
+        with self._cond:
+            while self._flushing or self._pending:
+                self._cond.wait()
+            if self._file is None:
+                return
+            self._file.truncate(0)
+            self._file.seek(0)
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CommitMarker:
+    # The LSN of the last commit whose records have all reached the table segments, and
+    # when it committed. Read-only replicas in other processes read records up to it
+    _format = struct.Struct('<qdq')
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+    
+    def publish(self, lsn: int):
+        if self._file is None:
+            self._file = open(self.path, 'wb')
+        # The LSN goes in twice so a reader can tell it raced with this write
+        self._file.seek(0)
+        self._file.write(self._format.pack(lsn, time.time(), lsn))
+        self._file.flush()
+    
+    def read(self):
+        # (lsn, commit time), or None when no primary has published one yet
+        for _ in range(100):
+            try:
+                with open(self.path, 'rb') as f:
+                    data = f.read(self._format.size)
+            except FileNotFoundError:
+                return None
+            if len(data) == self._format.size:
+                lsn, at, check = self._format.unpack(data)
+                if lsn == check:
+                    return lsn, at
+            time.sleep(0.001)
+        raise ValueError(f"Unreadable commit marker {self.path}")
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -29,9 +29,14 @@ def main():
                 print(json.dumps(result['rows'], indent=2))
             else:
                 print(result['message'])
+                for key in ('verification', 'proof'):
+                    if key in result:
+                        print(json.dumps(result[key], indent=2))
         
         except Exception as e:
             print(f"Error: {e}")
+    
+    storage.close()
 
 if __name__ == '__main__':
     main()
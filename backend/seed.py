@@ -3,9 +3,11 @@ from core.parser import SQLParser
 from core.storage import LedgerStorage
 from core.executor import QueryExecutor
 
-def seed_database():
-    storage = LedgerStorage()
-    executor = QueryExecutor(storage)
+def seed_database(executor=None):
+    storage = None
+    if executor is None:
+        storage = LedgerStorage()
+        executor = QueryExecutor(storage)
     parser = SQLParser()
     
     queries = [
@@ -14,6 +16,12 @@ def seed_database():
         "CREATE TABLE wallets (wallet_id INT PRIMARY KEY, user_id INT, balance FLOAT) LEDGER",
         "CREATE TABLE transactions (tx_id INT PRIMARY KEY, wallet_id INT, amount FLOAT, type TEXT) LEDGER",
         
+        # Running totals, kept current as rows are written
+        "CREATE MATERIALIZED VIEW user_balances AS SELECT user_id, SUM(balance) AS total_balance, "
+        "COUNT(*) AS wallets FROM wallets GROUP BY user_id",
+        "CREATE MATERIALIZED VIEW wallet_activity AS SELECT wallet_id, COUNT(*) AS tx_count, "
+        "SUM(amount) AS tx_total FROM transactions GROUP BY wallet_id",
+        
         # Insert users
         "INSERT INTO users VALUES (1, 'Alice Johnson', 'alice@example.com')",
         "INSERT INTO users VALUES (2, 'Bob Smith', 'bob@example.com')",
@@ -87,6 +95,9 @@ def seed_database():
         except Exception as e:
             print(f"Error: {e}")
     
+    if storage is not None:
+        storage.close()
+    
     print("\n✅ Database seeded successfully!")
     print(f"   - 5 users created")
     print(f"   - 5 wallets created")
@@ -95,6 +106,7 @@ def seed_database():
     print("\nTry these queries:")
     print("  SELECT * FROM wallets;")
     print("  SELECT * FROM wallets HISTORY WHERE wallet_id = 1;")
+    print("  SELECT * FROM user_balances WHERE user_id = 1;")
     print("  SELECT users.name, wallets.balance FROM users JOIN wallets ON users.id = wallets.user_id;")
 
 if __name__ == '__main__':
@@ -0,0 +1,33 @@
+import pytest
+
+from core.parser import SQLParser
+from core.storage import LedgerStorage
+from core.executor import QueryExecutor
+
+class Database:
+    def __init__(self, path, **options):
+        # A storage and executor over a data directory, with `run` for one statement
+        self.path = path
+        self.options = options
+        self.parser = SQLParser()
+        self.open()
+    
+    def open(self):
+        self.storage = LedgerStorage(str(self.path), sync=False, **self.options)
+        self.executor = QueryExecutor(self.storage)
+    
+    def reopen(self):
+        self.storage.close()
+        self.open()
+    
+    def run(self, sql: str, params=None):
+        return self.executor.execute(self.parser.parse(sql, params))
+    
+    def rows(self, sql: str, params=None):
+        return self.run(sql, params)['rows']
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(tmp_path / "data")
+    yield database
+    database.storage.close()
@@ -0,0 +1,32 @@
+import pytest
+
+@pytest.fixture
+def ledger(db):
+    db.run("CREATE TABLE tx (id INT PRIMARY KEY, amount FLOAT) LEDGER")
+    return db
+
+def _batch(db, *sqls):
+    with db.storage.write_group():
+        return db.executor.execute_batch([db.parser.parse(sql) for sql in sqls])
+
+def test_partial_failure_reports_committed_statements(ledger):
+    results, failure = _batch(ledger, "INSERT INTO tx VALUES (1000, 1.0)", "INSERT INTO tx VALUES (1001, 2.0)",
+                              "INSERT INTO tx VALUES (1001, 3.0)", "INSERT INTO tx VALUES (1002, 4.0)")
+    assert len(results) == 2
+    assert failure['index'] == 2 and failure['committed'] == 2
+    assert isinstance(failure['error'], ValueError)
+    ledger.reopen()
+    assert ledger.rows("SELECT id, amount FROM tx") == [{'id': 1000, 'amount': 1.0}, {'id': 1001, 'amount': 2.0}]
+
+def test_failure_inside_a_transaction_commits_nothing_after_it(ledger):
+    results, failure = _batch(ledger, "INSERT INTO tx VALUES (1, 1.0)", "BEGIN", "INSERT INTO tx VALUES (2, 2.0)",
+                              "INSERT INTO tx VALUES (1, 3.0)", "COMMIT")
+    assert failure['index'] == 3 and failure['committed'] == 1
+    assert ledger.rows("SELECT id FROM tx") == [{'id': 1}]
+
+def test_unclosed_transaction_fails_at_the_end(ledger):
+    results, failure = _batch(ledger, "BEGIN", "INSERT INTO tx VALUES (1, 1.0)")
+    assert failure['index'] == 2 and failure['committed'] == 0
+    assert ledger.rows("SELECT id FROM tx") == []
+    with pytest.raises(ValueError, match="not committed"):
+        ledger.executor.execute_script([ledger.parser.parse("BEGIN")])
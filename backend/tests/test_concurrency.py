@@ -0,0 +1,78 @@
+import sys
+import threading
+
+import pytest
+
+@pytest.fixture
+def accounts(db):
+    db.run("CREATE TABLE accounts (id INT PRIMARY KEY, balance INT) LEDGER")
+    db.run("CREATE TABLE audit (id INT PRIMARY KEY, note TEXT)")
+    db.storage.insert_rows('accounts', [{'id': i, 'balance': 100} for i in range(200)])
+    return db
+
+def _in_thread(fn):
+    # Runs `fn` on another thread, as the API's writer thread would, and returns
+    # whether it finished in time with its result or exception
+    outcome = {}
+    
+    def run():
+        try:
+            outcome['result'] = fn()
+        except Exception as e:
+            outcome['error'] = e
+    
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(10)
+    return not thread.is_alive(), outcome
+
+def test_rollback_does_not_wait_for_open_readers(accounts):
+    stream = accounts.executor.select_iter(accounts.parser.parse("SELECT * FROM accounts"))
+    first = next(stream)
+    script = [accounts.parser.parse(sql) for sql in (
+        "BEGIN", "UPDATE audit SET note = 'x' WHERE id = 1", "INSERT INTO audit VALUES (1, 'a'), (1, 'b')")]
+    
+    done, outcome = _in_thread(lambda: accounts.executor.execute_script(script))
+    assert done and isinstance(outcome.get('error'), ValueError)
+    done, _ = _in_thread(lambda: accounts.run("INSERT INTO audit VALUES (2, 'after')"))
+    assert done
+    done, outcome = _in_thread(lambda: accounts.rows("SELECT note FROM audit"))
+    assert done and outcome['result'] == [{'note': 'after'}]
+    
+    # The stream still reads its own snapshot
+    assert len([first] + list(stream)) == 200
+
+def test_readers_never_see_rolled_back_versions(accounts):
+    storage = accounts.storage
+    stop = threading.Event()
+    seen = []
+    
+    def read():
+        while not stop.is_set():
+            with storage.snapshot():
+                rows = list(storage.iter_rows('accounts'))
+            seen.append((len(rows), sum(r['balance'] for r in rows)))
+    
+    def write():
+        for i in range(60):
+            storage.begin()
+            storage.update_rows('accounts', {'balance': 0}, accounts.parser.parse(
+                "SELECT * FROM accounts WHERE id < 150").where)
+            storage.insert_rows('accounts', [{'id': 1000 + i, 'balance': 5}])
+            storage.delete_rows('accounts', accounts.parser.parse("SELECT * FROM accounts WHERE id > 180").where)
+            storage.rollback()
+    
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    try:
+        for reader in readers:
+            reader.start()
+        done, outcome = _in_thread(write)
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+        sys.setswitchinterval(interval)
+    assert done and 'error' not in outcome
+    assert seen and set(seen) == {(200, 20000)}
@@ -0,0 +1,29 @@
+import pytest
+
+@pytest.fixture
+def users(db):
+    db.run("CREATE TABLE u (id INT PRIMARY KEY, name TEXT, email TEXT UNIQUE)")
+    db.run("INSERT INTO u VALUES (1, 'a', NULL)")
+    return db
+
+def test_unique_column_allows_many_nulls(users):
+    users.run("INSERT INTO u VALUES (2, 'b', NULL)")
+    users.run("INSERT INTO u VALUES (3, 'c', NULL), (4, 'd', NULL), (5, 'e', 'e@x')")
+    users.run("UPDATE u SET email = NULL WHERE id > 3")
+    assert users.rows("SELECT COUNT(*) FROM u WHERE email IS NULL") == [{'COUNT(*)': 5}]
+    users.run("UPDATE u SET email = 'a@x' WHERE id = 1")
+    with pytest.raises(ValueError, match="Constraint violation on email"):
+        users.run("INSERT INTO u VALUES (6, 'f', 'a@x')")
+    with pytest.raises(ValueError, match="Constraint violation on email"):
+        users.run("INSERT INTO u VALUES (6, 'f', 'b@x'), (7, 'g', 'b@x')")
+    users.reopen()
+    users.run("INSERT INTO u VALUES (6, 'f', NULL)")
+
+def test_primary_key_cannot_be_null(users):
+    with pytest.raises(ValueError, match="Primary key column id cannot be NULL"):
+        users.run("INSERT INTO u VALUES (NULL, 'b', 'b@x')")
+    with pytest.raises(ValueError, match="Primary key column id cannot be NULL"):
+        users.storage.insert_rows('u', [{'name': 'c'}])
+    with pytest.raises(ValueError, match="Primary key column id cannot be NULL"):
+        users.run("UPDATE u SET id = NULL WHERE id = 1")
+    assert users.rows("SELECT id FROM u") == [{'id': 1}]
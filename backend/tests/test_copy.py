@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from core import executor as executor_module
+from core.executor import QueryExecutor
+
+@pytest.fixture
+def loader(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(executor_module, 'COPY_BATCH_SIZE', 10)
+    db.run("CREATE TABLE t (id INT PRIMARY KEY, amount FLOAT)")
+    db.import_dir = tmp_path / "import"
+    db.import_dir.mkdir()
+    db.executor = QueryExecutor(db.storage, import_dir=str(db.import_dir))
+    return db
+
+def _write_csv(path, ids):
+    path.write_text("id,amount\n" + "".join(f"{i},{i}.5\n" for i in ids))
+
+def test_copy_reads_from_the_import_directory(loader):
+    _write_csv(loader.import_dir / "ok.csv", range(25))
+    assert loader.run("COPY t FROM 'ok.csv'") == {"message": "25 rows copied"}
+    assert loader.rows("SELECT COUNT(*) FROM t") == [{'COUNT(*)': 25}]
+
+def test_copy_reports_rows_committed_before_an_error(loader):
+    _write_csv(loader.import_dir / "dup.csv", [*range(25), 3, *range(100, 110)])
+    with pytest.raises(ValueError, match=r"20 rows were copied and committed"):
+        loader.run("COPY t FROM 'dup.csv'")
+    assert loader.rows("SELECT COUNT(*) FROM t") == [{'COUNT(*)': 20}]
+    loader.reopen()
+    assert loader.rows("SELECT COUNT(*) FROM t") == [{'COUNT(*)': 20}]
+
+def test_copy_in_a_transaction_is_all_or_nothing(loader):
+    _write_csv(loader.import_dir / "dup.csv", [*range(25), 3])
+    loader.run("BEGIN")
+    with pytest.raises(ValueError, match="Constraint violation") as error:
+        loader.run("COPY t FROM 'dup.csv'")
+    assert "committed" not in str(error.value)
+    loader.run("ROLLBACK")
+    assert loader.rows("SELECT COUNT(*) FROM t") == [{'COUNT(*)': 0}]
+
+def test_copy_cannot_leave_the_import_directory(loader, tmp_path):
+    _write_csv(tmp_path / "secret.csv", range(3))
+    os.symlink(tmp_path / "secret.csv", loader.import_dir / "link.csv")
+    for path in ("../secret.csv", str(tmp_path / "secret.csv"), "link.csv"):
+        with pytest.raises(ValueError, match="import directory"):
+            loader.run(f"COPY t FROM '{path}'")
+    assert loader.rows("SELECT COUNT(*) FROM t") == [{'COUNT(*)': 0}]
+
+def test_copy_coerces_values_like_insert(loader):
+    (loader.import_dir / "typed.csv").write_text("id,amount\n7,\n8,2\n")
+    (loader.import_dir / "typed.ndjson").write_text('{"id": "9", "amount": "1.25"}\n')
+    loader.run("COPY t FROM 'typed.csv'")
+    loader.run("COPY t FROM 'typed.ndjson'")
+    assert loader.rows("SELECT id, amount FROM t") == [
+        {'id': 7, 'amount': None}, {'id': 8, 'amount': 2}, {'id': 9, 'amount': 1.25}]
+    with pytest.raises(ValueError, match="Constraint violation"):
+        loader.run("INSERT INTO t VALUES (7, 1.0)")
+    (loader.import_dir / "bad.csv").write_text("id,amount\n10,abc\n")
+    with pytest.raises(ValueError, match="Invalid value 'abc' for FLOAT column amount"):
+        loader.run("COPY t FROM 'bad.csv'")
@@ -0,0 +1,64 @@
+import random
+import threading
+
+import pytest
+
+@pytest.fixture
+def compacted(db):
+    # Each round updates random keys, so the versions every compaction moves to a new
+    # history segment interleave by row id with the earlier segments'
+    db.run("CREATE TABLE t (id INT PRIMARY KEY, v INT) LEDGER")
+    db.storage.insert_rows('t', [{'id': i, 'v': 0} for i in range(200)])
+    rng = random.Random(5)
+    for round_ in range(1, 6):
+        for key in rng.sample(range(200), 60):
+            db.run("UPDATE t SET v = ? WHERE id = ?", [round_, key])
+        expected = db.rows("SELECT * FROM t HISTORY")
+        assert db.storage.compact('t')
+        assert db.rows("SELECT * FROM t HISTORY") == expected
+    return db
+
+def test_history_scan_over_compacted_segments(compacted):
+    assert len(compacted.storage.history['t'].segments) == 5
+    expected = compacted.rows("SELECT * FROM t HISTORY")
+    compacted.reopen()
+    assert compacted.rows("SELECT * FROM t HISTORY") == expected
+
+def test_history_filters_over_compacted_segments(compacted):
+    rows = compacted.rows("SELECT * FROM t HISTORY")
+    assert len(rows) == 200 + 5 * 60
+    assert compacted.rows("SELECT * FROM t HISTORY WHERE v = 3") == [r for r in rows if r['v'] == 3]
+    key = rows[-1]['id']
+    assert compacted.rows("SELECT * FROM t HISTORY WHERE id = ?", [key]) == [r for r in rows if r['id'] == key]
+
+def test_history_partitions_cover_the_scan(compacted):
+    storage = compacted.storage
+    with storage.snapshot():
+        whole = list(storage.iter_rows('t', history=True))
+        parts = [row for partition in storage.partitions('t', count=3)[0]
+                 for row in storage.iter_rows('t', history=True, partition=partition)]
+    assert parts == whole
+
+def test_as_of_version_follows_each_chain(compacted):
+    compacted.run("DELETE FROM t WHERE id < 20")
+    compacted.run("INSERT INTO t VALUES (5, 99), (500, 1)")
+    committed = compacted.rows("SELECT * FROM t AS OF VERSION 2")
+    compacted.run("BEGIN")
+    compacted.run("UPDATE t SET v = 7 WHERE id > 100")
+    rows = compacted.rows("SELECT * FROM t HISTORY")
+    for version in range(0, 9):
+        expected = [r for r in rows if r['_version'] == version]
+        assert compacted.rows(f"SELECT * FROM t AS OF VERSION {version}") == expected
+        assert (compacted.rows(f"SELECT * FROM t AS OF VERSION {version} WHERE v = 3")
+                == [r for r in expected if r['v'] == 3])
+        assert (compacted.rows(f"SELECT * FROM t AS OF VERSION {version} WHERE id = 5")
+                == [r for r in expected if r['id'] == 5])
+    
+    # Another session reads the committed versions only
+    seen = []
+    reader = threading.Thread(target=lambda: seen.append(compacted.rows("SELECT * FROM t AS OF VERSION 2")))
+    reader.start()
+    reader.join()
+    assert seen == [committed]
+    compacted.run("ROLLBACK")
+    assert len(compacted.rows("SELECT * FROM t AS OF VERSION 1")) == 201
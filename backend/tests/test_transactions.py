@@ -0,0 +1,78 @@
+import copy
+
+import pytest
+
+def _state(storage):
+    # Everything a rollback has to put back, copied so later writes cannot change it
+    tables = ('accounts', 'notes')
+    return copy.deepcopy({
+        'rows': {t: {rid: tuple(row) for rid, row in storage.tables[t].items()} for t in tables},
+        'lsns': {t: storage.row_lsn[t] for t in tables},
+        'superseded': {t: storage.superseded[t] for t in tables},
+        'chains': storage.chains['accounts'],
+        'prev': storage.prev_version['accounts'],
+        'live': {t: storage.live_rows[t] for t in tables},
+        'indexes': {k: (v['data'], v['keys']) for k, v in storage.index.indexes.items()},
+    })
+
+@pytest.fixture
+def bank(db):
+    db.run("CREATE TABLE accounts (id INT PRIMARY KEY, owner TEXT, balance FLOAT) LEDGER")
+    db.run("CREATE TABLE notes (id INT PRIMARY KEY, account INT, body TEXT)")
+    db.run("CREATE INDEX ON accounts (balance) USING BTREE")
+    db.run("CREATE INDEX ON notes (account)")
+    for i in range(1, 21):
+        db.run("INSERT INTO accounts VALUES (?, ?, ?)", [i, f"owner{i % 3}", float(i * 10)])
+        db.run("INSERT INTO notes VALUES (?, ?, ?)", [i, i % 4, f"note {i}"])
+    db.run("UPDATE accounts SET balance = 5.0 WHERE id = 3")
+    return db
+
+def test_rollback_restores_memory_state(bank):
+    before = _state(bank.storage)
+    bank.run("BEGIN")
+    bank.run("INSERT INTO accounts VALUES (100, 'new', 1.0)")
+    bank.run("UPDATE accounts SET balance = 999.0 WHERE owner = 'owner1'")
+    bank.run("UPDATE accounts SET balance = 998.0 WHERE id = 4")
+    bank.run("DELETE FROM accounts WHERE id = 3")
+    bank.run("INSERT INTO notes VALUES (100, 9, 'x')")
+    bank.run("UPDATE notes SET account = 7 WHERE id < 10")
+    bank.run("UPDATE notes SET account = 8 WHERE id = 2")
+    bank.run("DELETE FROM notes WHERE account = 2")
+    bank.run("ROLLBACK")
+    assert _state(bank.storage) == before
+    assert bank.storage.undo == [] and bank.storage.pending == []
+
+def test_rolled_back_writes_are_invisible(bank):
+    bank.run("BEGIN")
+    bank.run("INSERT INTO accounts VALUES (100, 'new', 1.0)")
+    bank.run("UPDATE accounts SET balance = 999.0 WHERE id = 1")
+    bank.run("DELETE FROM notes WHERE id = 5")
+    assert bank.rows("SELECT balance FROM accounts WHERE id = 1") == [{'balance': 999.0}]
+    bank.run("ROLLBACK")
+    
+    assert bank.rows("SELECT * FROM accounts WHERE id = 100") == []
+    assert bank.rows("SELECT balance FROM accounts WHERE id = 1") == [{'balance': 10.0}]
+    assert bank.rows("SELECT id FROM accounts WHERE balance >= 999") == []
+    assert bank.rows("SELECT id FROM notes WHERE id = 5") == [{'id': 5}]
+    assert [r['_version'] for r in bank.rows("SELECT * FROM accounts HISTORY WHERE id = 1")] == [1]
+    # The keys the transaction used are free again
+    bank.run("INSERT INTO accounts VALUES (100, 'again', 2.0)")
+    bank.run("UPDATE accounts SET balance = 11.0 WHERE id = 1")
+    assert [r['_version'] for r in bank.rows("SELECT * FROM accounts HISTORY WHERE id = 1")] == [1, 2]
+
+def test_rollback_survives_restart(bank):
+    bank.run("BEGIN")
+    bank.run("UPDATE accounts SET balance = 999.0 WHERE id = 1")
+    bank.run("ROLLBACK")
+    bank.run("UPDATE accounts SET balance = 12.0 WHERE id = 2")
+    expected = bank.rows("SELECT * FROM accounts")
+    bank.reopen()
+    assert bank.rows("SELECT * FROM accounts") == expected
+
+def test_failed_script_rolls_back(bank):
+    stmts = [bank.parser.parse(sql) for sql in (
+        "BEGIN", "UPDATE accounts SET balance = 0.0 WHERE id = 1", "INSERT INTO accounts VALUES (2, 'dup', 1.0)")]
+    with pytest.raises(ValueError, match="Constraint violation"):
+        bank.executor.execute_script(stmts)
+    assert not bank.storage.in_transaction
+    assert bank.rows("SELECT balance FROM accounts WHERE id = 1") == [{'balance': 10.0}]
@@ -0,0 +1,26 @@
+import pytest
+
+@pytest.fixture
+def wallets(db):
+    db.run("CREATE TABLE wallets (wallet_id INT PRIMARY KEY, user_id INT, balance FLOAT) LEDGER")
+    return db
+
+def test_quoted_numbers_take_the_column_type(wallets):
+    wallets.run("INSERT INTO wallets VALUES ('7', 1, '5.5')")
+    rows = wallets.rows("SELECT wallet_id, balance FROM wallets WHERE wallet_id = 7")
+    assert rows == [{'wallet_id': 7, 'balance': 5.5}]
+    assert wallets.rows("SELECT wallet_id FROM wallets WHERE wallet_id = '7'") == [{'wallet_id': 7}]
+
+def test_primary_key_is_unique_across_spellings(wallets):
+    wallets.run("INSERT INTO wallets VALUES ('7', 1, 5)")
+    with pytest.raises(ValueError, match="Constraint violation"):
+        wallets.run("INSERT INTO wallets VALUES (7, 1, 5)")
+
+def test_values_that_do_not_convert_are_rejected(wallets):
+    with pytest.raises(ValueError, match="Invalid value"):
+        wallets.run("INSERT INTO wallets VALUES (1, 1, 'oops')")
+    wallets.run("INSERT INTO wallets VALUES (1, 1, 5)")
+    with pytest.raises(ValueError, match="Invalid value"):
+        wallets.run("UPDATE wallets SET user_id = 'x' WHERE wallet_id = 1")
+    wallets.run("UPDATE wallets SET balance = '9.25' WHERE wallet_id = 1")
+    assert wallets.rows("SELECT balance FROM wallets") == [{'balance': 9.25}]
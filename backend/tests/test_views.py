@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+from core.views import MaterializedView
+
+VIEW = ("SELECT g, SUM(v) AS total, COUNT(*) AS n, MIN(v) AS lo, MAX(v) AS hi, AVG(v) AS mean "
+        "FROM t GROUP BY g")
+QUERY = "SELECT g, SUM(v), COUNT(*), MIN(v), MAX(v), AVG(v) FROM t GROUP BY g"
+
+@pytest.fixture
+def ledger(db):
+    db.run("CREATE TABLE t (id INT PRIMARY KEY, g INT, v INT) LEDGER")
+    db.run("CREATE TABLE other (id INT PRIMARY KEY)")
+    db.run(f"CREATE MATERIALIZED VIEW totals AS {VIEW}")
+    return db
+
+def _contents(db):
+    view = sorted(tuple(r.values()) for r in db.rows("SELECT * FROM totals"))
+    return view, sorted(tuple(r.values()) for r in db.rows(QUERY))
+
+def test_view_follows_writes(ledger):
+    rng = random.Random(3)
+    for i in range(300):
+        op = rng.random()
+        if op < 0.5:
+            ledger.run("INSERT INTO t VALUES (?, ?, ?)", [i, rng.randint(0, 4), rng.choice([None, rng.randint(0, 50)])])
+        elif op < 0.8:
+            ledger.run("UPDATE t SET v = ?, g = ? WHERE id = ?", [rng.randint(0, 50), rng.randint(0, 4), rng.randint(0, i)])
+        else:
+            ledger.run("DELETE FROM t WHERE id = ?", [rng.randint(0, i)])
+        view, expected = _contents(ledger)
+        assert view == expected
+    ledger.reopen()
+    view, expected = _contents(ledger)
+    assert view == expected
+
+def test_view_rolls_back_with_its_table(ledger):
+    ledger.run("INSERT INTO t VALUES (1, 1, 10), (2, 1, 20)")
+    before = ledger.rows("SELECT * FROM totals")
+    ledger.run("BEGIN")
+    ledger.run("UPDATE t SET v = 5 WHERE id = 2")
+    ledger.run("INSERT INTO t VALUES (3, 2, 7)")
+    ledger.run("ROLLBACK")
+    assert ledger.rows("SELECT * FROM totals") == before
+
+def test_bad_value_fails_only_its_statement(ledger):
+    storage = ledger.storage
+    with storage.write_group():
+        ledger.run("INSERT INTO other VALUES (42)")
+        with pytest.raises(ValueError, match="Invalid value"):
+            ledger.run("INSERT INTO t VALUES (2, 1, 'oops')")
+        ledger.run("INSERT INTO t VALUES (3, 1, 4)")
+    assert ledger.rows("SELECT * FROM other") == [{'id': 42}]
+    assert ledger.rows("SELECT g, total, n FROM totals") == [{'g': 1, 'total': 4, 'n': 1}]
+
+def test_failed_maintenance_undoes_only_its_statement(ledger, monkeypatch):
+    storage = ledger.storage
+    ledger.run("INSERT INTO t VALUES (1, 1, 10)")
+    apply = MaterializedView.apply
+    
+    def failing(self, state, key, deltas):
+        if any(row.get('id') == 2 for _, row in deltas):
+            raise TypeError("maintenance failed")
+        return apply(self, state, key, deltas)
+    
+    monkeypatch.setattr(MaterializedView, 'apply', failing)
+    with storage.write_group():
+        ledger.run("INSERT INTO other VALUES (42)")
+        with pytest.raises(TypeError):
+            ledger.run("UPDATE t SET id = 2 WHERE id = 1")
+        ledger.run("INSERT INTO t VALUES (3, 1, 5)")
+    assert ledger.rows("SELECT * FROM other") == [{'id': 42}]
+    assert sorted(r['id'] for r in ledger.rows("SELECT id FROM t")) == [1, 3]
+    view, expected = _contents(ledger)
+    assert view == expected == [(1, 15, 2, 5, 10, 7.5)]
+    ledger.reopen()
+    assert sorted(r['id'] for r in ledger.rows("SELECT id FROM t")) == [1, 3]
+
+def test_views_cannot_be_written(ledger):
+    with pytest.raises(ValueError, match="materialized view"):
+        ledger.run("INSERT INTO totals VALUES (1, 1, 1, 1, 1, 1.0)")
+    with pytest.raises(ValueError, match="materialized view"):
+        ledger.run("DELETE FROM totals WHERE g = 1")